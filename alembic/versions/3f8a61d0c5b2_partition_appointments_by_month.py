@@ -0,0 +1,108 @@
+"""Partition appointments by month
+
+Revision ID: 3f8a61d0c5b2
+Revises: 9b4f0e6a2d17
+Create Date: 2026-10-19 13:02:18.554210
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f8a61d0c5b2'
+down_revision = '9b4f0e6a2d17'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ('appointments_id, patient_id, doctor_id, clinic_id, user_fkey, patient_fkey, doctor_fkey, clinic_fkey, '
+           'appointment_date, appointment_time, appointment_status, created_at, version')
+
+# Monthly partitions are created for the months that already hold appointments (at most this many
+# months back) up to this many months ahead; `python -m app.partitions maintain` keeps extending them.
+MONTHS_BACK = 24
+MONTHS_AHEAD = 12
+
+
+def _month(day: date, offset: int = 0) -> date:
+    months = day.year * 12 + day.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def _appointment_columns():
+    return [
+        sa.Column('appointments_id', sa.Integer(), server_default=sa.text("nextval('appointments_appointments_id_seq'::regclass)"), nullable=False),
+        sa.Column('patient_id', sa.Integer(), nullable=False),
+        sa.Column('doctor_id', sa.Integer(), nullable=False),
+        sa.Column('clinic_id', sa.Integer(), nullable=False),
+        sa.Column('user_fkey', sa.Integer(), nullable=False),
+        sa.Column('patient_fkey', sa.Integer(), nullable=False),
+        sa.Column('doctor_fkey', sa.Integer(), nullable=False),
+        sa.Column('clinic_fkey', sa.Integer(), nullable=False),
+        sa.Column('appointment_date', sa.String(), nullable=False),
+        sa.Column('appointment_time', sa.String(), nullable=False),
+        sa.Column('appointment_status', sa.String(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('version', sa.Integer(), server_default=sa.text('1'), nullable=False),
+        sa.ForeignKeyConstraint(['clinic_fkey'], ['clinics.id'], name='appointments_clinic_fkey_fkey', ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['doctor_fkey'], ['doctors.id'], name='appointments_doctor_fkey_fkey', ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['patient_fkey'], ['patients.id'], name='appointments_patient_fkey_fkey', ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_fkey'], ['users.id'], name='appointments_user_fkey_fkey', ondelete='CASCADE'),
+    ]
+
+
+def _swap_in(build_new_table) -> None:
+    # Move the current table aside, build the new one under the same name, copy the rows over
+    # and hand the id sequence to the new table before the old one is dropped.
+    op.execute('ALTER TABLE appointments RENAME TO appointments_old')
+    op.execute('ALTER TABLE appointments_old RENAME CONSTRAINT appointments_pkey TO appointments_old_pkey')
+    build_new_table()
+    op.execute(f'INSERT INTO appointments ({COLUMNS}) SELECT {COLUMNS} FROM appointments_old')
+    op.execute('ALTER SEQUENCE appointments_appointments_id_seq OWNED BY appointments.appointments_id')
+    op.drop_table('appointments_old')
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    this_month = _month(date.today())
+    first_month = _month(this_month, -MONTHS_BACK)
+    oldest = bind.execute(sa.text(
+        r"SELECT min(appointment_date) FROM appointments WHERE appointment_date ~ '^\d{4}-\d{2}-\d{2}$'"
+    )).scalar()
+    if oldest is not None:
+        first_month = max(first_month, min(this_month, _month(date.fromisoformat(oldest[:7] + '-01'))))
+    else:
+        first_month = this_month
+
+    def build_partitioned_table():
+        op.drop_index('ix_appointments_doctor_slot', table_name='appointments_old')
+        op.drop_index('ix_appointments_appointments_id', table_name='appointments_old')
+        op.create_table('appointments', *_appointment_columns(),
+                        sa.PrimaryKeyConstraint('appointments_id', 'appointment_date', name='appointments_pkey'),
+                        postgresql_partition_by='RANGE (appointment_date)')
+        op.create_index('ix_appointments_booked_slot', 'appointments', ['doctor_id', 'appointment_date', 'appointment_time'],
+                        unique=False, postgresql_where=sa.text("appointment_status = 'booked'"))
+
+        op.execute('CREATE TABLE appointments_default PARTITION OF appointments DEFAULT')
+        month = first_month
+        while month <= _month(this_month, MONTHS_AHEAD):
+            upper = _month(month, 1)
+            op.execute(f"CREATE TABLE appointments_p{month.year:04d}_{month.month:02d} PARTITION OF appointments "
+                       f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')")
+            month = upper
+
+    _swap_in(build_partitioned_table)
+    op.execute('ANALYZE appointments')
+
+
+def downgrade() -> None:
+    def build_plain_table():
+        op.create_table('appointments', *_appointment_columns(),
+                        sa.PrimaryKeyConstraint('appointments_id', name='appointments_pkey'))
+        op.create_index('ix_appointments_appointments_id', 'appointments', ['appointments_id'], unique=False)
+        op.create_index('ix_appointments_doctor_slot', 'appointments', ['doctor_id', 'appointment_date', 'appointment_time'], unique=False)
+
+    # Dropping the partitioned table drops its partitions; archived (detached) partitions are left alone
+    _swap_in(build_plain_table)
@@ -0,0 +1,100 @@
+"""Maintain schedule_slots.booked_count with a trigger on appointments
+
+Revision ID: b5e9c2d7a413
+Revises: f1c8d5a3b270
+Create Date: 2026-10-19 23:41:08.512730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e9c2d7a413'
+down_revision = 'f1c8d5a3b270'
+branch_labels = None
+depends_on = None
+
+# Seats taken (+1) and given back (-1) by the booked rows of a statement
+BOOKED_NEW = "SELECT doctor_id, appointment_date, appointment_time, 1 FROM new_rows WHERE appointment_status = 'booked'"
+BOOKED_OLD = "SELECT doctor_id, appointment_date, appointment_time, -1 FROM old_rows WHERE appointment_status = 'booked'"
+
+# Applies the seat deltas of `source` to the slot counters. Slot rows are locked in key order, so
+# statements changing several slots (moves, purges, bulk loads) cannot deadlock. Returns whether a
+# slot that gained seats is now over its capacity; a capacity lowered below the bookings a slot
+# already has does not fail later cancellations.
+APPLY = """
+    WITH delta AS (
+        SELECT doctor_id, day, slot, sum(seats) AS seats
+        FROM ({source}) AS d (doctor_id, day, slot, seats)
+        GROUP BY doctor_id, day, slot
+        HAVING sum(seats) <> 0
+    ), locked AS (
+        SELECT s.doctor_id, s.date, s.slot_time, d.seats
+        FROM schedule_slots AS s
+        JOIN delta AS d ON (s.doctor_id, s.date, s.slot_time) = (d.doctor_id, d.day, d.slot)
+        ORDER BY s.doctor_id, s.date, s.slot_time
+        FOR UPDATE OF s
+    ), changed AS (
+        UPDATE schedule_slots AS s SET booked_count = greatest(s.booked_count + l.seats, 0)
+        FROM locked AS l
+        WHERE (s.doctor_id, s.date, s.slot_time) = (l.doctor_id, l.date, l.slot_time)
+        RETURNING s.booked_count, s.capacity, l.seats
+    )
+    SELECT EXISTS (SELECT 1 FROM changed WHERE seats > 0 AND booked_count > capacity)
+"""
+
+# A booking into a full slot fails with a check violation naming ck_schedule_slots_capacity, which
+# the API turns into 403 (see app/booking.py)
+FUNCTION = f"""
+    CREATE FUNCTION schedule_slots_from_appointments() RETURNS trigger AS $$
+    DECLARE
+        overbooked boolean;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            {APPLY.format(source=BOOKED_NEW)} INTO overbooked;
+        ELSIF TG_OP = 'DELETE' THEN
+            {APPLY.format(source=BOOKED_OLD)} INTO overbooked;
+        ELSE
+            {APPLY.format(source=f"{BOOKED_NEW} UNION ALL {BOOKED_OLD}")} INTO overbooked;
+        END IF;
+        IF overbooked THEN
+            RAISE EXCEPTION 'schedule slot is fully booked'
+                USING ERRCODE = 'check_violation', CONSTRAINT = 'ck_schedule_slots_capacity';
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+TRANSITIONS = {'INSERT': 'NEW TABLE AS new_rows', 'DELETE': 'OLD TABLE AS old_rows',
+               'UPDATE': 'OLD TABLE AS old_rows NEW TABLE AS new_rows'}
+
+# Counters that drifted while appointments were deleted through foreign key cascades
+RECOUNT = """
+    UPDATE schedule_slots AS s SET booked_count = counts.booked
+    FROM (
+        SELECT slot.doctor_id, slot.date, slot.slot_time, count(a.appointments_id) AS booked
+        FROM schedule_slots AS slot
+        LEFT JOIN appointments AS a
+          ON (a.doctor_id, a.appointment_date, a.appointment_time) = (slot.doctor_id, slot.date, slot.slot_time)
+         AND a.appointment_status = 'booked'
+        GROUP BY slot.doctor_id, slot.date, slot.slot_time
+    ) AS counts
+    WHERE (s.doctor_id, s.date, s.slot_time) = (counts.doctor_id, counts.date, counts.slot_time)
+      AND s.booked_count <> counts.booked
+"""
+
+
+def upgrade() -> None:
+    op.execute(FUNCTION)
+    for event, transition in TRANSITIONS.items():
+        op.execute(f"CREATE TRIGGER appointments_slots_{event.lower()} AFTER {event} ON appointments "
+                   f"REFERENCING {transition} FOR EACH STATEMENT EXECUTE FUNCTION schedule_slots_from_appointments()")
+    op.execute(RECOUNT)
+
+
+def downgrade() -> None:
+    for event in TRANSITIONS:
+        op.execute(f"DROP TRIGGER appointments_slots_{event.lower()} ON appointments")
+    op.execute("DROP FUNCTION schedule_slots_from_appointments()")
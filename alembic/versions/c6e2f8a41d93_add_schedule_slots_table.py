@@ -0,0 +1,135 @@
+"""Add schedule capacity and schedule_slots counters
+
+Revision ID: c6e2f8a41d93
+Revises: b9d1f6a2c387
+Create Date: 2026-10-19 20:47:12.640215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e2f8a41d93'
+down_revision = 'b9d1f6a2c387'
+branch_labels = None
+depends_on = None
+
+# Upserts one row per slot of the schedules in `source`, in key order so concurrent statements
+# lock slot rows in the same order. A slot already present keeps its booked_count; a new one
+# starts from the bookings it already has, counted in one grouped pass over the matching days.
+UPSERT_SLOTS = """
+    INSERT INTO schedule_slots AS s (doctor_id, date, slot_time, clinic_id, schedule_id, capacity, booked_count)
+    SELECT DISTINCT ON (n.doctor_id, n.date, slot.slot_time)
+           n.doctor_id, n.date, slot.slot_time, n.clinic_id, n.schedule_id, n.capacity, coalesce(b.booked, 0)
+    FROM {source} AS n
+    CROSS JOIN LATERAL unnest(n.slots) AS slot (slot_time)
+    LEFT JOIN (
+        SELECT a.doctor_id, a.appointment_date, a.appointment_time, count(*) AS booked
+        FROM appointments AS a
+        WHERE a.appointment_status = 'booked'
+          AND (a.doctor_id, a.appointment_date) IN (SELECT doctor_id, date FROM {source})
+        GROUP BY a.doctor_id, a.appointment_date, a.appointment_time
+    ) AS b ON (b.doctor_id, b.appointment_date, b.appointment_time) = (n.doctor_id, n.date, slot.slot_time)
+    ORDER BY n.doctor_id, n.date, slot.slot_time, n.schedule_id DESC
+    ON CONFLICT (doctor_id, date, slot_time) DO UPDATE
+    SET clinic_id = excluded.clinic_id, schedule_id = excluded.schedule_id, capacity = excluded.capacity;
+"""
+
+# Slots an updated schedule no longer has (removed, or the schedule moved to another doctor or date)
+DELETE_REMOVED = """
+    DELETE FROM schedule_slots AS s
+    USING new_rows AS n
+    WHERE s.schedule_id = n.schedule_id
+      AND ((s.doctor_id, s.date) <> (n.doctor_id, n.date) OR s.slot_time <> ALL (n.slots));
+"""
+
+# Rows of a deleted schedule go with it through the foreign key, so only INSERT and UPDATE fire this
+SLOTS_FUNCTION = f"""
+    CREATE FUNCTION schedule_slots_from_schedules() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            {DELETE_REMOVED}
+        END IF;
+        {UPSERT_SLOTS.format(source='new_rows')}
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+# utilization_daily counts available seats instead of slots: a slot of a schedule with capacity 3
+# adds 3. Same function as in d4e8a3c71b59, with the slot count multiplied by the capacity.
+UTILIZATION_UPSERT = """
+    INSERT INTO utilization_daily AS u (doctor_id, clinic_id, date, available_slots, booked_slots)
+    SELECT doctor_id, clinic_id, day, sum(available), sum(booked)
+    FROM ({source}) AS delta (doctor_id, clinic_id, day, available, booked)
+    GROUP BY doctor_id, clinic_id, day
+    HAVING sum(available) <> 0 OR sum(booked) <> 0
+    ORDER BY doctor_id, clinic_id, day
+    ON CONFLICT (doctor_id, clinic_id, date) DO UPDATE
+    SET available_slots = u.available_slots + excluded.available_slots,
+        booked_slots = u.booked_slots + excluded.booked_slots,
+        updated_at = now();
+"""
+
+
+def _utilization_function(seats: str) -> str:
+    from_new = f"SELECT doctor_id, clinic_id, date, {seats}, 0 FROM new_rows"
+    from_old = f"SELECT doctor_id, clinic_id, date, -{seats}, 0 FROM old_rows"
+    return f"""
+        CREATE OR REPLACE FUNCTION utilization_from_schedules() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {UTILIZATION_UPSERT.format(source=from_new)}
+            ELSIF TG_OP = 'DELETE' THEN
+                {UTILIZATION_UPSERT.format(source=from_old)}
+            ELSE
+                {UTILIZATION_UPSERT.format(source=f"{from_new} UNION ALL {from_old}")}
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """
+
+
+def upgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.add_column('schedules', sa.Column('capacity', sa.Integer(), server_default=sa.text('1'), nullable=False))
+    op.create_table('schedule_slots',
+    sa.Column('doctor_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.String(), nullable=False),
+    sa.Column('slot_time', sa.String(), nullable=False),
+    sa.Column('clinic_id', sa.Integer(), nullable=False),
+    sa.Column('schedule_id', sa.Integer(), nullable=False),
+    sa.Column('capacity', sa.Integer(), nullable=False),
+    sa.Column('booked_count', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.CheckConstraint('booked_count >= 0', name='ck_schedule_slots_booked_count'),
+    sa.ForeignKeyConstraint(['schedule_id'], ['schedules.schedule_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('doctor_id', 'date', 'slot_time')
+    )
+    op.create_index('ix_schedule_slots_clinic_id_date', 'schedule_slots', ['clinic_id', 'date'], unique=False)
+    op.create_index(op.f('ix_schedule_slots_schedule_id'), 'schedule_slots', ['schedule_id'], unique=False)
+    # ### end Alembic commands ###
+
+    op.execute(SLOTS_FUNCTION)
+    for event in ('INSERT', 'UPDATE'):
+        op.execute(f"CREATE TRIGGER schedules_slots_{event.lower()} AFTER {event} ON schedules "
+                   f"REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION schedule_slots_from_schedules()")
+    op.execute(_utilization_function("cardinality(slots) * capacity"))
+
+    # Backfill from the existing schedules and bookings (every capacity is 1, so utilization is unchanged)
+    op.execute(UPSERT_SLOTS.format(source='schedules'))
+
+
+def downgrade() -> None:
+    op.execute(_utilization_function("cardinality(slots)"))
+    for event in ('INSERT', 'UPDATE'):
+        op.execute(f"DROP TRIGGER schedules_slots_{event.lower()} ON schedules")
+    op.execute("DROP FUNCTION schedule_slots_from_schedules()")
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_index(op.f('ix_schedule_slots_schedule_id'), table_name='schedule_slots')
+    op.drop_index('ix_schedule_slots_clinic_id_date', table_name='schedule_slots')
+    op.drop_table('schedule_slots')
+    op.drop_column('schedules', 'capacity')
+    # ### end Alembic commands ###
@@ -0,0 +1,98 @@
+"""Rebuild schedule_slots rows shared by overlapping schedules
+
+Revision ID: c8f1a4e6d392
+Revises: b5e9c2d7a413
+Create Date: 2026-10-19 23:58:42.091355
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8f1a4e6d392'
+down_revision = 'b5e9c2d7a413'
+branch_labels = None
+depends_on = None
+
+# Same statements as in c6e2f8a41d93. A slot offered by several schedules of a doctor and date has
+# one row, owned by the newest of them.
+UPSERT_SLOTS = """
+    INSERT INTO schedule_slots AS s (doctor_id, date, slot_time, clinic_id, schedule_id, capacity, booked_count)
+    SELECT DISTINCT ON (n.doctor_id, n.date, slot.slot_time)
+           n.doctor_id, n.date, slot.slot_time, n.clinic_id, n.schedule_id, n.capacity, coalesce(b.booked, 0)
+    FROM {source} AS n
+    CROSS JOIN LATERAL unnest(n.slots) AS slot (slot_time)
+    LEFT JOIN (
+        SELECT a.doctor_id, a.appointment_date, a.appointment_time, count(*) AS booked
+        FROM appointments AS a
+        WHERE a.appointment_status = 'booked'
+          AND (a.doctor_id, a.appointment_date) IN (SELECT doctor_id, date FROM {source})
+        GROUP BY a.doctor_id, a.appointment_date, a.appointment_time
+    ) AS b ON (b.doctor_id, b.appointment_date, b.appointment_time) = (n.doctor_id, n.date, slot.slot_time)
+    ORDER BY n.doctor_id, n.date, slot.slot_time, n.schedule_id DESC
+    ON CONFLICT (doctor_id, date, slot_time) DO UPDATE
+    SET clinic_id = excluded.clinic_id, schedule_id = excluded.schedule_id, capacity = excluded.capacity;
+"""
+
+DELETE_REMOVED = """
+    DELETE FROM schedule_slots AS s
+    USING new_rows AS n
+    WHERE s.schedule_id = n.schedule_id
+      AND ((s.doctor_id, s.date) <> (n.doctor_id, n.date) OR s.slot_time <> ALL (n.slots));
+"""
+
+# The rows a changed or deleted schedule owned are gone (deleted above, or through the foreign key),
+# including slots an older schedule of the same doctor and date still offers. Every remaining
+# schedule of the affected days is upserted again, which recreates those rows with their bookings.
+REUPSERT = "WITH covering AS (SELECT * FROM schedules WHERE (doctor_id, date) IN ({days}))" \
+           + UPSERT_SLOTS.format(source='covering')
+
+SLOTS_FUNCTION = f"""
+    CREATE OR REPLACE FUNCTION schedule_slots_from_schedules() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            {UPSERT_SLOTS.format(source='new_rows')}
+        ELSIF TG_OP = 'UPDATE' THEN
+            {DELETE_REMOVED}
+            {REUPSERT.format(days="SELECT doctor_id, date FROM old_rows UNION SELECT doctor_id, date FROM new_rows")}
+        ELSE
+            {REUPSERT.format(days="SELECT doctor_id, date FROM old_rows")}
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+# The function as created by c6e2f8a41d93
+PREVIOUS_SLOTS_FUNCTION = f"""
+    CREATE OR REPLACE FUNCTION schedule_slots_from_schedules() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            {DELETE_REMOVED}
+        END IF;
+        {UPSERT_SLOTS.format(source='new_rows')}
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    op.execute(SLOTS_FUNCTION)
+    # The update trigger also needs the old rows, for the days a schedule moved away from
+    op.execute("DROP TRIGGER schedules_slots_update ON schedules")
+    op.execute("CREATE TRIGGER schedules_slots_update AFTER UPDATE ON schedules REFERENCING OLD TABLE AS old_rows "
+               "NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION schedule_slots_from_schedules()")
+    op.execute("CREATE TRIGGER schedules_slots_delete AFTER DELETE ON schedules "
+               "REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION schedule_slots_from_schedules()")
+
+    # Recreate the rows lost so far: slots still offered by a schedule but missing from schedule_slots
+    op.execute(UPSERT_SLOTS.format(source='schedules'))
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER schedules_slots_delete ON schedules")
+    op.execute("DROP TRIGGER schedules_slots_update ON schedules")
+    op.execute("CREATE TRIGGER schedules_slots_update AFTER UPDATE ON schedules "
+               "REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION schedule_slots_from_schedules()")
+    op.execute(PREVIOUS_SLOTS_FUNCTION)
@@ -0,0 +1,101 @@
+"""Add utilization_daily summary table
+
+Revision ID: d4e8a3c71b59
+Revises: b72d94e1f3a6
+Create Date: 2026-10-19 15:55:31.402877
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4e8a3c71b59'
+down_revision = 'b72d94e1f3a6'
+branch_labels = None
+depends_on = None
+
+# Adds the per (doctor, clinic, date) deltas produced by `source` to the summary. Keys are
+# upserted in order, so concurrent statements lock summary rows in the same order.
+UPSERT = """
+    INSERT INTO utilization_daily AS u (doctor_id, clinic_id, date, available_slots, booked_slots)
+    SELECT doctor_id, clinic_id, day, sum(available), sum(booked)
+    FROM ({source}) AS delta (doctor_id, clinic_id, day, available, booked)
+    GROUP BY doctor_id, clinic_id, day
+    HAVING sum(available) <> 0 OR sum(booked) <> 0
+    ORDER BY doctor_id, clinic_id, day
+    ON CONFLICT (doctor_id, clinic_id, date) DO UPDATE
+    SET available_slots = u.available_slots + excluded.available_slots,
+        booked_slots = u.booked_slots + excluded.booked_slots,
+        updated_at = now();
+"""
+
+BOOKED_NEW = "SELECT doctor_id, clinic_id, appointment_date, 0, 1 FROM new_rows WHERE appointment_status = 'booked'"
+BOOKED_OLD = "SELECT doctor_id, clinic_id, appointment_date, 0, -1 FROM old_rows WHERE appointment_status = 'booked'"
+SLOTS_NEW = "SELECT doctor_id, clinic_id, date, cardinality(slots), 0 FROM new_rows"
+SLOTS_OLD = "SELECT doctor_id, clinic_id, date, -cardinality(slots), 0 FROM old_rows"
+
+
+# Statement level trigger function: a statement touching many rows (e.g. a COPY bulk load) updates
+# each summary row once. Transition tables allow a single event per trigger, so the function is
+# attached three times and picks the transition tables that exist for the event.
+def _trigger_function(name: str, from_new: str, from_old: str) -> str:
+    return f"""
+        CREATE FUNCTION {name}() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {UPSERT.format(source=from_new)}
+            ELSIF TG_OP = 'DELETE' THEN
+                {UPSERT.format(source=from_old)}
+            ELSE
+                {UPSERT.format(source=f"{from_new} UNION ALL {from_old}")}
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """
+
+
+TRIGGERS = {
+    'appointments': ('utilization_from_appointments', BOOKED_NEW, BOOKED_OLD),
+    'schedules': ('utilization_from_schedules', SLOTS_NEW, SLOTS_OLD),
+}
+TRANSITIONS = {'INSERT': 'NEW TABLE AS new_rows', 'DELETE': 'OLD TABLE AS old_rows',
+               'UPDATE': 'OLD TABLE AS old_rows NEW TABLE AS new_rows'}
+
+
+def upgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('utilization_daily',
+    sa.Column('doctor_id', sa.Integer(), nullable=False),
+    sa.Column('clinic_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.String(), nullable=False),
+    sa.Column('available_slots', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('booked_slots', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('doctor_id', 'clinic_id', 'date')
+    )
+    op.create_index(op.f('ix_utilization_daily_date'), 'utilization_daily', ['date'], unique=False)
+    # ### end Alembic commands ###
+
+    for table, (function, from_new, from_old) in TRIGGERS.items():
+        op.execute(_trigger_function(function, from_new, from_old))
+        for event, transition in TRANSITIONS.items():
+            op.execute(f"CREATE TRIGGER {table}_utilization_{event.lower()} AFTER {event} ON {table} "
+                       f"REFERENCING {transition} FOR EACH STATEMENT EXECUTE FUNCTION {function}()")
+
+    # Backfill from the existing schedules and bookings
+    op.execute(UPSERT.format(source=f"{SLOTS_NEW.replace('new_rows', 'schedules')} UNION ALL "
+                                    f"{BOOKED_NEW.replace('new_rows', 'appointments')}"))
+
+
+def downgrade() -> None:
+    for table, (function, _, _) in TRIGGERS.items():
+        for event in TRANSITIONS:
+            op.execute(f"DROP TRIGGER {table}_utilization_{event.lower()} ON {table}")
+        op.execute(f"DROP FUNCTION {function}()")
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_index(op.f('ix_utilization_daily_date'), table_name='utilization_daily')
+    op.drop_table('utilization_daily')
+    # ### end Alembic commands ###
@@ -0,0 +1,90 @@
+"""Add utilization_deltas, folded into utilization_daily off the booking path
+
+Revision ID: d7a2e9f4b186
+Revises: c8f1a4e6d392
+Create Date: 2026-10-20 00:22:17.305948
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a2e9f4b186'
+down_revision = 'c8f1a4e6d392'
+branch_labels = None
+depends_on = None
+
+BOOKED = "SELECT doctor_id, clinic_id, appointment_date, {seats} FROM {rows} WHERE appointment_status = 'booked'"
+
+# Bookings only append their changes to utilization_deltas, which locks no existing row, so
+# concurrent bookings of a doctor and day no longer queue on one utilization_daily row. The
+# deltas are folded into utilization_daily in the background (app/utilization.py).
+INSERT_DELTAS = """
+    INSERT INTO utilization_deltas (doctor_id, clinic_id, date, booked_slots)
+    SELECT doctor_id, clinic_id, day, sum(booked)
+    FROM ({source}) AS delta (doctor_id, clinic_id, day, booked)
+    GROUP BY doctor_id, clinic_id, day
+    HAVING sum(booked) <> 0;
+"""
+
+# Same as in d4e8a3c71b59
+UPSERT = """
+    INSERT INTO utilization_daily AS u (doctor_id, clinic_id, date, available_slots, booked_slots)
+    SELECT doctor_id, clinic_id, day, sum(available), sum(booked)
+    FROM ({source}) AS delta (doctor_id, clinic_id, day, available, booked)
+    GROUP BY doctor_id, clinic_id, day
+    HAVING sum(available) <> 0 OR sum(booked) <> 0
+    ORDER BY doctor_id, clinic_id, day
+    ON CONFLICT (doctor_id, clinic_id, date) DO UPDATE
+    SET available_slots = u.available_slots + excluded.available_slots,
+        booked_slots = u.booked_slots + excluded.booked_slots,
+        updated_at = now();
+"""
+
+
+# The appointments trigger function, applying `statement` to the booked rows; `seats` is the
+# column list one booked row adds (its negation is taken for the old rows)
+def _function(statement: str, seats: str) -> str:
+    from_new = BOOKED.format(seats=seats, rows="new_rows")
+    from_old = BOOKED.format(seats=seats.replace("1", "-1"), rows="old_rows")
+    return f"""
+        CREATE OR REPLACE FUNCTION utilization_from_appointments() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {statement.format(source=from_new)}
+            ELSIF TG_OP = 'DELETE' THEN
+                {statement.format(source=from_old)}
+            ELSE
+                {statement.format(source=f"{from_new} UNION ALL {from_old}")}
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """
+
+
+def upgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('utilization_deltas',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('doctor_id', sa.Integer(), nullable=False),
+    sa.Column('clinic_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.String(), nullable=False),
+    sa.Column('booked_slots', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # ### end Alembic commands ###
+
+    op.execute(_function(INSERT_DELTAS, "1"))
+
+
+def downgrade() -> None:
+    op.execute(_function(UPSERT, "0, 1"))
+    # Fold what is still pending before the table goes
+    op.execute(UPSERT.format(source="SELECT doctor_id, clinic_id, date, 0, booked_slots FROM utilization_deltas"))
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_table('utilization_deltas')
+    # ### end Alembic commands ###
@@ -0,0 +1,177 @@
+import ipaddress
+import math
+import time
+from collections import Counter
+
+from starlette.responses import JSONResponse
+
+from . import lifecycle, utils
+
+# Buckets that have been idle (and therefore refilled) this long are dropped
+BUCKET_IDLE_SECONDS = 300
+PRUNE_EVERY_REQUESTS = 10000
+
+
+# Classic token bucket: `rate` tokens per second, holding at most `burst` tokens. A rate of 0
+# disables the limit.
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: int):
+        if rate < 0:
+            raise ValueError(f"Rate limits must not be negative, got {rate}")
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # key -> [tokens, last_refill]
+
+    # Returns 0 when the request is admitted, otherwise the seconds until a token is available
+    def acquire(self, key, now: float) -> float:
+        if not self.rate:
+            return 0
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        return (1 - bucket[0]) / self.rate
+
+    def prune(self, now: float):
+        idle = [key for key, (_, last) in self.buckets.items() if now - last > BUCKET_IDLE_SECONDS]
+        for key in idle:
+            del self.buckets[key]
+
+
+# Requests are grouped into classes that get their own concurrency cap
+def route_class(method: str, path: str) -> str:
+    if method == "POST" and path.rstrip("/") == "/login":
+        return "login"
+    if method in ("POST", "PUT") and path.startswith("/appointments"):
+        return "booking"
+    return "default"
+
+
+def parse_networks(value: str):
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip()]
+
+
+def _in_networks(address: str, networks) -> bool:
+    try:
+        parsed = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(parsed in network for network in networks)
+
+
+# The client's address. Behind a load balancer or reverse proxy every connection comes from the
+# proxy, so when the peer is one of the trusted proxies the address is read from X-Forwarded-For:
+# the last entry not added by a trusted proxy (entries before it were sent by the client and can
+# be forged).
+def client_address(scope, trusted_proxies) -> str:
+    peer = scope["client"][0] if scope.get("client") else "unknown"
+    if not trusted_proxies or not _in_networks(peer, trusted_proxies):
+        return peer
+    forwarded = [part.strip() for name, value in scope.get("headers", []) if name == b"x-forwarded-for"
+                 for part in value.decode("latin-1").split(",") if part.strip()]
+    for address in reversed(forwarded):
+        if not _in_networks(address, trusted_proxies):
+            return address
+    return forwarded[0] if forwarded else peer
+
+
+# Identify the caller from the bearer token without touching the database. The signature is
+# verified so nobody can drain another user's bucket with a forged token.
+def _token_subject(scope):
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            return utils.bearer_subject(value.decode("latin-1"))
+    return None
+
+
+# Global metrics of admission decisions, keyed by (route class, outcome)
+metrics = Counter()
+
+
+########################### ASGI MIDDLEWARE ###########################
+
+# Rejects excess requests with 429 before any database or bcrypt work is started.
+class AdmissionControlMiddleware:
+    def __init__(self, app, settings):
+        self.app = app
+        self.ip_limiter = TokenBucketLimiter(settings.RATE_LIMIT_IP_PER_SECOND, settings.RATE_LIMIT_IP_BURST)
+        self.user_limiter = TokenBucketLimiter(settings.RATE_LIMIT_USER_PER_SECOND, settings.RATE_LIMIT_USER_BURST)
+        self.login_limiter = TokenBucketLimiter(settings.RATE_LIMIT_LOGIN_PER_SECOND, settings.RATE_LIMIT_LOGIN_BURST)
+        self.trusted_proxies = parse_networks(settings.ADMISSION_TRUSTED_PROXIES)
+        self.concurrency_limits = {
+            "login": settings.CONCURRENCY_LIMIT_LOGIN,
+            "booking": settings.CONCURRENCY_LIMIT_BOOKING,
+            "default": settings.CONCURRENCY_LIMIT_DEFAULT,
+        }
+        self.in_flight = Counter()
+        self.requests_seen = 0
+
+    async def __call__(self, scope, receive, send):
+        # Health probes are never limited, or an overloaded worker would look dead
+        if scope["type"] != "http" or scope["path"] in lifecycle.PROBE_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        now = time.monotonic()
+        self.requests_seen += 1
+        if self.requests_seen % PRUNE_EVERY_REQUESTS == 0:
+            for limiter in (self.ip_limiter, self.user_limiter, self.login_limiter):
+                limiter.prune(now)
+
+        request_class = route_class(scope["method"], scope["path"])
+        client_ip = client_address(scope, self.trusted_proxies)
+
+        # Rate limits: per IP for everything, per IP for login attempts, per user when authenticated
+        retry_after = self.ip_limiter.acquire(client_ip, now)
+        reason = "ip_rate"
+        if not retry_after and request_class == "login":
+            retry_after = self.login_limiter.acquire(client_ip, now)
+            reason = "login_rate"
+        if not retry_after:
+            subject = _token_subject(scope)
+            if subject is not None:
+                retry_after = self.user_limiter.acquire(subject, now)
+                reason = "user_rate"
+
+        if retry_after:
+            await self._reject(scope, receive, send, request_class, reason, retry_after)
+            return
+
+        # Concurrency cap per route class (0 means unlimited)
+        limit = self.concurrency_limits[request_class]
+        if limit and self.in_flight[request_class] >= limit:
+            await self._reject(scope, receive, send, request_class, "concurrency", 1)
+            return
+
+        metrics[(request_class, "admitted")] += 1
+        self.in_flight[request_class] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight[request_class] -= 1
+
+    async def _reject(self, scope, receive, send, request_class, reason, retry_after):
+        metrics[(request_class, f"rejected_{reason}")] += 1
+        response = JSONResponse({"detail": "Too many requests, please retry later"}, status_code=429,
+                                headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+        await response(scope, receive, send)
+
+
+def snapshot() -> dict:
+    result = {}
+    for (request_class, outcome), count in metrics.items():
+        result.setdefault(request_class, {})[outcome] = count
+    return result
+
+
+def install(app, settings):
+    if not settings.ADMISSION_CONTROL_ENABLED:
+        return
+
+    app.add_middleware(AdmissionControlMiddleware, settings=settings)
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import event, insert, inspect
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+
+from . import lifecycle, models
+from .config import app_settings
+from .database import SessionLocal
+
+logger = logging.getLogger("app.audit")
+
+# Write-behind audit trail of who created, changed or deleted which record. Handlers describe
+# each change on their session with created(), updated() or deleted(); when the session commits,
+# the records are put on a bounded per-worker queue and a background task writes them in batches
+# with multi-row INSERTs. A rolled back transaction drops its records, so only committed changes
+# are audited. A full queue blocks the committing request (backpressure) for up to
+# AUDIT_BLOCK_SECONDS, after which the request writes its records itself, so none are dropped.
+
+AuditLog = models.AuditLog.__table__
+
+# Columns left out of the recorded values: bookkeeping that changes on every write
+IGNORED_COLUMNS = {"created_at", "updated_at", "version"}
+REDACTED_COLUMNS = {"password"}
+REDACTED = "[redacted]"
+
+
+########################### DESCRIBING CHANGES ###########################
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [_value(item) for item in value]
+    return value
+
+
+def _values(instance) -> dict:
+    values = {}
+    for attribute in inspect(instance).mapper.column_attrs:
+        if attribute.key in IGNORED_COLUMNS:
+            continue
+        values[attribute.key] = REDACTED if attribute.key in REDACTED_COLUMNS else _value(getattr(instance, attribute.key))
+    return values
+
+
+def _record_id(instance) -> int:
+    return inspect(instance).mapper.primary_key_from_instance(instance)[0]
+
+
+def _append(db, user_id: Optional[int], action: str, table_name: str, record_id: int, changes: dict):
+    if not app_settings.AUDIT_ENABLED:
+        return
+    db.info.setdefault("audit", []).append((user_id, action, table_name, record_id, changes))
+
+
+def _add(db, user_id: Optional[int], action: str, instance, changes: dict):
+    _append(db, user_id, action, instance.__table__.name, _record_id(instance), changes)
+
+
+# The record's values as created (call after the INSERT was flushed, so the id is known)
+def created(db, user_id: Optional[int], instance):
+    _add(db, user_id, "create", instance, _values(instance))
+
+
+# The values of a loaded instance, taken before it is changed in place and passed to updated() as previous
+def snapshot(instance) -> dict:
+    return _values(instance)
+
+
+# The changed columns as {column: [old, new]}; an update that changed nothing is not recorded.
+# previous is the instance before the update (MutationResult.previous) or a snapshot() of it.
+def updated(db, user_id: Optional[int], previous, instance):
+    before = previous if isinstance(previous, dict) else _values(previous)
+    after = _values(instance)
+    changes = {key: [before[key], value] for key, value in after.items() if before.get(key) != value}
+    if changes:
+        _add(db, user_id, "update", instance, changes)
+
+
+# The record's values as they were before the delete
+def deleted(db, user_id: Optional[int], previous):
+    _add(db, user_id, "delete", previous, _values(previous))
+
+
+# One chunk of a purge job, as {table: rows deleted}, recorded against the soft-deleted record
+# the job purges (the rows themselves are not recorded one by one)
+def purged(db, user_id: Optional[int], table_name: str, record_id: int, counts: dict):
+    _append(db, user_id, "purge", table_name, record_id, counts)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _after_commit(session):
+    records = session.info.pop("audit", None)
+    if records:
+        writer.submit(records)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("audit", None)
+
+
+########################### WRITER ###########################
+
+class AuditWriter:
+    def __init__(self):
+        self.queue = queue.Queue(app_settings.AUDIT_QUEUE_SIZE)
+        self.metrics = Counter()
+        self.lock = threading.Lock()  # Guards metrics
+        self.flush_lock = threading.Lock()  # One flush at a time, so batches are written in queue order
+        self.retry = []  # A batch whose INSERT failed, written before anything newer
+        self.loop = None
+        self.wakeup = None
+        self.task = None
+
+    def _count(self, **increments):
+        with self.lock:
+            self.metrics.update(increments)
+
+    def _wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    # Called by a committing request thread with its records, stamped with the commit time
+    def submit(self, records):
+        started = time.perf_counter_ns()
+        occurred_at = datetime.now(timezone.utc)
+        rows = [{"occurred_at": occurred_at, "user_id": user_id, "action": action, "table_name": table_name,
+                 "record_id": record_id, "changes": changes}
+                for user_id, action, table_name, record_id, changes in records]
+
+        blocked = inline = 0
+        if self.task is None:
+            # No background writer (scripts, or the app is not running its lifespan)
+            self._write_inline(rows)
+            inline = len(rows)
+        else:
+            for index, row in enumerate(rows):
+                try:
+                    self.queue.put_nowait(row)
+                except queue.Full:
+                    blocked += 1
+                    self._wake()
+                    try:
+                        self.queue.put(row, timeout=app_settings.AUDIT_BLOCK_SECONDS)
+                    except queue.Full:
+                        self._write_inline(rows[index:])
+                        inline = len(rows) - index
+                        break
+            if self.queue.qsize() >= app_settings.AUDIT_BATCH_SIZE:
+                self._wake()
+
+        self._count(commits=1, records=len(rows), blocked=blocked, inline_records=inline,
+                    submit_ns=time.perf_counter_ns() - started)
+
+    def _write(self, rows):
+        with SessionLocal() as db:
+            db.execute(insert(AuditLog), rows)
+            db.commit()
+
+    def _write_inline(self, rows):
+        try:
+            self._write(rows)
+        except SQLAlchemyError:
+            # The change is already committed; keep the trail in the log rather than fail the request
+            logger.exception("Could not write audit records: %s", rows)
+            self._count(lost_records=len(rows))
+
+    # Writes everything queued so far, in batches of AUDIT_BATCH_SIZE rows
+    def flush(self):
+        with self.flush_lock:
+            while True:
+                batch, self.retry = self.retry, []
+                while len(batch) < app_settings.AUDIT_BATCH_SIZE:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    return
+
+                started = time.perf_counter_ns()
+                try:
+                    self._write(batch)
+                except SQLAlchemyError:
+                    self.retry = batch
+                    self._count(failed_flushes=1)
+                    raise
+                self._count(batches=1, flushed_records=len(batch), flush_ns=time.perf_counter_ns() - started)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), app_settings.AUDIT_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await run_in_threadpool(self.flush)
+            except SQLAlchemyError:
+                logger.exception("Could not flush audit records, retrying")
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    # Requests have been drained by now; whatever is still queued is written before the pools close
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task, self.loop = None, None
+        try:
+            await run_in_threadpool(self.flush)
+        except SQLAlchemyError:
+            logger.exception("Could not flush %d audit records on shutdown", self.queue.qsize() + len(self.retry))
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            metrics = dict(self.metrics)
+        commits, batches = metrics.get("commits", 0), metrics.get("batches", 0)
+        return {
+            "queued": self.queue.qsize() + len(self.retry),
+            "queue_size": self.queue.maxsize,
+            "commits": commits,
+            "records": metrics.get("records", 0),
+            "flushed_records": metrics.get("flushed_records", 0),
+            "batches": batches,
+            "blocked_records": metrics.get("blocked", 0),
+            "inline_records": metrics.get("inline_records", 0),
+            "lost_records": metrics.get("lost_records", 0),
+            "failed_flushes": metrics.get("failed_flushes", 0),
+            # Time a committing request spends handing its records over (the per-request overhead)
+            "mean_submit_us": round(metrics.get("submit_ns", 0) / commits / 1000, 2) if commits else None,
+            "mean_batch_records": round(metrics.get("flushed_records", 0) / batches, 1) if batches else None,
+            "mean_flush_ms": round(metrics.get("flush_ns", 0) / batches / 1e6, 3) if batches else None,
+        }
+
+
+writer = AuditWriter()
+
+
+def install(app, settings):
+    if not settings.AUDIT_ENABLED:
+        return
+
+    lifecycle.register(writer.start, writer.stop)
@@ -0,0 +1,352 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+from collections import defaultdict
+from typing import Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy import event as sqlalchemy_event
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import lifecycle
+from .config import app_settings
+from .database import SessionLocal
+
+logger = logging.getLogger("app.availability")
+
+# Postgres channel carrying availability events; every worker process listens on it and fans the
+# events out to its own WebSocket subscribers. Handlers describe events on their session, and they
+# are only handed to the publisher when the booking or schedule change commits. The publisher sends
+# them with NOTIFY from its own connection, outside the booking transactions: a NOTIFY takes a
+# database-wide lock at commit, which would otherwise make all booking commits wait on each other.
+CHANNEL = "slot_availability"
+RECONNECT_SECONDS = 1.0
+RESYNC = json.dumps({"event": "resync"})
+
+
+def _connect():
+    connection = psycopg2.connect(host=app_settings.DATABASE_HOSTNAME, port=app_settings.DATABASE_PORT,
+                                  user=app_settings.DATABASE_USERNAME, password=app_settings.DATABASE_PASSWORD,
+                                  database=app_settings.DATABASE_NAME)
+    connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    return connection
+
+
+########################### PUBLISHING ###########################
+
+def _publish(db: Session, event: dict):
+    if not app_settings.AVAILABILITY_STREAM_ENABLED:
+        return
+    db.info.setdefault("availability", []).append(json.dumps(event, separators=(",", ":")))
+
+
+@sqlalchemy_event.listens_for(SessionLocal, "after_commit")
+def _after_commit(session):
+    payloads = session.info.pop("availability", None)
+    if payloads:
+        publisher.submit(payloads)
+
+
+@sqlalchemy_event.listens_for(SessionLocal, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("availability", None)
+
+
+# `remaining` is the number of seats left in the slot after the change, when the caller knows it
+def _slot_event(event: str, appointment, remaining: Optional[int]) -> dict:
+    payload = {"event": event, "doctor_id": appointment.doctor_id, "clinic_id": appointment.clinic_id,
+               "date": appointment.appointment_date, "time": appointment.appointment_time}
+    if remaining is not None:
+        payload["remaining"] = remaining
+    return payload
+
+
+def slot_taken(db: Session, appointment, remaining: Optional[int] = None):
+    _publish(db, _slot_event("slot_taken", appointment, remaining))
+
+
+def slot_freed(db: Session, appointment, remaining: Optional[int] = None):
+    _publish(db, _slot_event("slot_freed", appointment, remaining))
+
+
+# Publish both deltas when an update moved a booked appointment to another slot
+def slot_moved(db: Session, previous, appointment):
+    if (previous.doctor_id, previous.appointment_date, previous.appointment_time) == \
+            (appointment.doctor_id, appointment.appointment_date, appointment.appointment_time):
+        return
+    if previous.appointment_status == 'booked':
+        slot_freed(db, previous)
+    if appointment.appointment_status == 'booked':
+        slot_taken(db, appointment)
+
+
+def schedule_changed(db: Session, schedule):
+    _publish(db, {"event": "schedule_changed", "doctor_id": schedule.doctor_id, "clinic_id": schedule.clinic_id,
+                  "date": schedule.date, "slots": list(schedule.slots), "capacity": schedule.capacity})
+
+
+def schedule_removed(db: Session, schedule):
+    _publish(db, {"event": "schedule_removed", "doctor_id": schedule.doctor_id, "clinic_id": schedule.clinic_id,
+                  "date": schedule.date})
+
+
+# Sends committed events from one autocommit connection per worker. Committing requests only put
+# their events on a queue, which a background task drains. Events that do not fit in the queue, or
+# whose NOTIFY failed, are dropped, and every client is then told to resync.
+class Publisher:
+    def __init__(self, queue_size: int = 10000):
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()  # Guards the connection, used by one flush at a time
+        self.connection = None
+        self.lost = False
+        self.loop = None
+        self.wakeup = None
+        self.task = None
+
+    # Called by a committing request thread
+    def submit(self, payloads):
+        if self.task is None:
+            # No background task (scripts, or the app is not running its lifespan)
+            self._send(payloads)
+            return
+        for payload in payloads:
+            try:
+                self.queue.put_nowait(payload)
+            except queue.Full:
+                self.lost = True
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    # Each event is its own NOTIFY: identical payloads in one transaction would be delivered once
+    def _send(self, payloads):
+        with self.lock:
+            try:
+                if self.connection is None:
+                    self.connection = _connect()
+                with self.connection.cursor() as cursor:
+                    for payload in payloads:
+                        cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+            except psycopg2.Error:
+                logger.exception("Could not publish %d availability events", len(payloads))
+                self.lost = True
+                self._close()
+
+    def flush(self):
+        payloads = []
+        while True:
+            try:
+                payloads.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if self.lost:
+            self.lost = False
+            payloads.append(RESYNC)
+        if payloads:
+            self._send(payloads)
+
+    def _close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    async def _run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            await run_in_threadpool(self.flush)
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    # Events of requests that committed before the drain are sent before the pools close
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task, self.loop = None, None
+        await run_in_threadpool(self.flush)
+        with self.lock:
+            self._close()
+
+
+publisher = Publisher()
+
+
+def topic(kind: str, value) -> str:
+    return f"{kind}:{value}"
+
+
+def event_topics(event: dict):
+    return (topic("doctor", event["doctor_id"]), topic("clinic", event["clinic_id"]), topic("date", event["date"]))
+
+
+########################### FAN-OUT ###########################
+
+# One connected client: a bounded queue of JSON frames and the topics it listens to
+class Subscriber:
+    __slots__ = ("queue", "topics", "overflowed")
+
+    def __init__(self, queue_size: int):
+        self.queue = asyncio.Queue(queue_size)
+        self.topics = set()
+        self.overflowed = False
+
+
+# Per-process fan-out of the availability channel. A single LISTEN connection is watched by the
+# event loop (no thread and no task per client), each payload is forwarded as-is, so it is
+# serialized once by the publisher, and only the subscribers of the event's topics are touched.
+class AvailabilityHub:
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self.subscribers = defaultdict(set)  # topic -> subscribers
+        self.connection = None
+        self.loop = None
+        self.retry = None  # Pending reconnect
+
+    ########## subscriptions ##########
+
+    def connect(self) -> Subscriber:
+        return Subscriber(self.queue_size)
+
+    def subscribe(self, subscriber: Subscriber, topic_name: str):
+        subscriber.topics.add(topic_name)
+        self.subscribers[topic_name].add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber, topic_name: str):
+        subscriber.topics.discard(topic_name)
+        listeners = self.subscribers.get(topic_name)
+        if listeners is not None:
+            listeners.discard(subscriber)
+            if not listeners:
+                del self.subscribers[topic_name]
+
+    def disconnect(self, subscriber: Subscriber):
+        for topic_name in list(subscriber.topics):
+            self.unsubscribe(subscriber, topic_name)
+
+    ########## delivery ##########
+
+    def dispatch(self, payload: str):
+        if payload == RESYNC:
+            self._broadcast_resync()
+            return
+        try:
+            event = json.loads(payload)
+            topics = event_topics(event)
+        except (ValueError, KeyError):
+            logger.warning("Ignoring malformed availability event: %s", payload)
+            return
+
+        recipients = set()
+        for topic_name in topics:
+            recipients.update(self.subscribers.get(topic_name, ()))
+
+        for subscriber in recipients:
+            self._deliver(subscriber, payload)
+
+    # A client that cannot keep up is cut off instead of buffering without bound; it
+    # reconnects and reloads the schedules, exactly as after a network failure.
+    def _deliver(self, subscriber: Subscriber, frame: str):
+        if subscriber.overflowed:
+            return
+        try:
+            subscriber.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            subscriber.overflowed = True
+            self.disconnect(subscriber)
+            subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(None)
+
+    # Events published while the listener was down are lost, so every client is told to reload
+    def _broadcast_resync(self):
+        frame = json.dumps({"event": "resync"})
+        for subscriber in set().union(*self.subscribers.values()):
+            self._deliver(subscriber, frame)
+
+    ########## LISTEN connection ##########
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        await self._listen()
+
+    async def stop(self):
+        if self.retry is not None:
+            self.retry.cancel()
+            self.retry = None
+        self._close()
+        self.loop = None
+
+    @staticmethod
+    def _connect_listener():
+        connection = _connect()
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        return connection
+
+    # Connects in a worker thread, so a database that is slow to answer never blocks the event loop
+    async def _listen(self):
+        self.retry = None
+        if self.loop is None:
+            return
+        try:
+            connection = await run_in_threadpool(self._connect_listener)
+        except psycopg2.Error:
+            logger.exception("Could not listen for availability events, retrying")
+            self._retry_later()
+            return
+        if self.loop is None:
+            # Stopped while connecting
+            connection.close()
+            return
+
+        self.connection = connection
+        self.loop.add_reader(connection.fileno(), self._on_readable)
+
+    def _retry_later(self):
+        self.retry = self.loop.call_later(RECONNECT_SECONDS, lambda: asyncio.ensure_future(self._listen()))
+
+    def _on_readable(self):
+        try:
+            self.connection.poll()
+        except psycopg2.Error:
+            logger.exception("Availability listener connection lost, reconnecting")
+            self._close()
+            self._broadcast_resync()
+            self._retry_later()
+            return
+
+        notifies = self.connection.notifies
+        while notifies:
+            self.dispatch(notifies.pop(0).payload)
+
+    def _close(self):
+        if self.connection is None:
+            return
+        try:
+            self.loop.remove_reader(self.connection.fileno())
+        except (ValueError, OSError, psycopg2.Error):
+            pass
+        self.connection.close()
+        self.connection = None
+
+
+hub = AvailabilityHub()
+
+
+def install(app, settings):
+    if not settings.AVAILABILITY_STREAM_ENABLED:
+        return
+
+    hub.queue_size = settings.AVAILABILITY_QUEUE_SIZE
+    publisher.queue = queue.Queue(settings.AVAILABILITY_PUBLISH_QUEUE_SIZE)
+    lifecycle.register(publisher.start, publisher.stop)
+    lifecycle.register(hub.start, hub.stop)
@@ -0,0 +1,85 @@
+"""
+Seat counters of schedule slots (schedule_slots.booked_count).
+
+The counters are kept by a statement trigger on appointments (migration b5e9c2d7a413): every
+statement that inserts, moves, cancels or deletes booked appointments, including deletes through
+foreign key cascades and bulk loads with COPY, adds its seat deltas to the slots it touched. A
+statement that would take more seats than a slot has fails with a check violation naming
+ck_schedule_slots_capacity. The slot row lock the trigger takes is held to commit, so callers
+write the appointment as the last statement of a booking. If a counter was ever changed by hand,
+recount it from the appointments:
+
+    python -m app.booking recount
+"""
+import argparse
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+
+SLOT_FULL = "ck_schedule_slots_capacity"
+
+SEATS_LEFT = """
+    SELECT capacity - booked_count FROM schedule_slots
+    WHERE doctor_id = :doctor_id AND date = :date AND slot_time = :slot_time
+"""
+SEATS_LEFT_READ = text(SEATS_LEFT)
+SEATS_LEFT_LOCKED = text(SEATS_LEFT + " FOR UPDATE")
+
+RECOUNT = text("""
+    UPDATE schedule_slots AS s SET booked_count = counts.booked
+    FROM (
+        SELECT slot.doctor_id, slot.date, slot.slot_time, count(a.appointments_id) AS booked
+        FROM schedule_slots AS slot
+        LEFT JOIN appointments AS a
+          ON (a.doctor_id, a.appointment_date, a.appointment_time) = (slot.doctor_id, slot.date, slot.slot_time)
+         AND a.appointment_status = 'booked'
+        GROUP BY slot.doctor_id, slot.date, slot.slot_time
+    ) AS counts
+    WHERE (s.doctor_id, s.date, s.slot_time) = (counts.doctor_id, counts.date, counts.slot_time)
+      AND s.booked_count <> counts.booked
+""")
+
+
+def _slot(doctor_id: int, appointment_date: str, appointment_time: str) -> dict:
+    return {"doctor_id": doctor_id, "date": appointment_date, "slot_time": appointment_time}
+
+
+# True when a booking failed because its slot is full
+def is_full(error: IntegrityError) -> bool:
+    diag = getattr(error.orig, "diag", None)
+    return getattr(diag, "constraint_name", None) == SLOT_FULL
+
+
+# Seats left in the slot, or None when the slot is not scheduled. With lock=True the slot row is
+# locked until commit, so the seats cannot be taken by another transaction in the meantime.
+def seats_left(db: Session, doctor_id: int, appointment_date: str, appointment_time: str,
+               lock: bool = False) -> Optional[int]:
+    return db.execute(SEATS_LEFT_LOCKED if lock else SEATS_LEFT_READ,
+                      _slot(doctor_id, appointment_date, appointment_time)).scalar()
+
+
+# Recompute every counter from the booked appointments in one statement
+def recount(db: Session) -> int:
+    rows = db.execute(RECOUNT).rowcount
+    db.commit()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the schedule slot seat counters")
+    parser.add_argument("command", choices=["recount"])
+    parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(f"recounted schedule_slots: {recount(db)} rows changed")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Deterministic high-volume synthetic data generator.
+
+    python -m app.bulk_seed --appointments 10000000 --seed 42 --truncate --defer-indexes
+
+Rows for users, patients, doctors, clinics, schedules and appointments are generated
+lazily from a seeded RNG and streamed into Postgres with COPY in foreign key order, so
+memory use does not depend on the number of rows. Every appointment falls on a free slot
+of its doctor's schedule and no slot is booked twice.
+"""
+import argparse
+import io
+import math
+import random
+import time
+from datetime import date, timedelta
+
+import psycopg2
+
+from . import partitions
+from .config import app_settings
+from .utils import get_password_hash
+
+FIRST_NAMES = ["Ama", "Kwame", "Efua", "Kofi", "Abena", "Yaw", "Akosua", "Kojo", "Adwoa", "Kwabena",
+               "Maria", "James", "Aisha", "Chen", "Olivia", "Mateo", "Fatima", "Noah", "Priya", "Lucas"]
+LAST_NAMES = ["Mensah", "Owusu", "Boateng", "Asante", "Osei", "Addo", "Danso", "Appiah", "Agyeman", "Darko",
+              "Smith", "Garcia", "Okafor", "Nguyen", "Khan", "Silva", "Muller", "Kim", "Haddad", "Novak"]
+SPECIALTIES = ["General Practice", "Cardiology", "Dermatology", "Pediatrics", "Gynecology", "Neurology",
+               "Orthopedics", "Ophthalmology", "Psychiatry", "Radiology", "Oncology", "ENT"]
+CLINIC_WORDS = ["Ridge", "Korle", "Airport", "Cantonments", "Osu", "Labone", "Tema", "Legon", "East", "West"]
+STREETS = ["Liberation Road", "Oxford Street", "Independence Avenue", "Ring Road", "Spintex Road", "Castle Road"]
+ACCRA = (5.6037, -0.1870)  # Clinics are scattered within about 20 km of this point
+
+# Insert order respects the foreign keys between the tables
+TABLES = ["users", "patients", "doctors", "clinics", "schedules", "appointments"]
+SERIAL_COLUMNS = {"users": "id", "patients": "id", "doctors": "id", "clinics": "id", "schedules": "schedule_id",
+                  "appointments": "appointments_id"}
+
+
+def slot_label(index: int) -> str:
+    minutes = 8 * 60 + index * 15
+    hour, minute = divmod(minutes, 60)
+    suffix = "AM" if hour < 12 else "PM"
+    return f"{(hour - 1) % 12 + 1:02d}:{minute:02d} {suffix}"
+
+
+# File-like object that COPY reads from; lines are pulled from a generator on demand,
+# so only one buffer's worth of rows is ever held in memory.
+class RowStream(io.TextIOBase):
+    def __init__(self, rows):
+        self.rows = rows
+        self.buffer = ""
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            try:
+                row = next(self.rows)
+            except StopIteration:
+                break
+            line = "\t".join(row) + "\n"
+            chunks.append(line)
+            length += len(line)
+            self.count += 1
+
+        data = "".join(chunks)
+        if size < 0:
+            self.buffer = ""
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+
+# Sizes of the data set and the deterministic mappings between the generated rows.
+class DataSet:
+    def __init__(self, args):
+        self.seed = args.seed
+        self.users = args.users
+        self.patients_per_user = args.patients_per_user
+        self.patients = self.users * self.patients_per_user
+        self.doctors = args.doctors
+        self.clinics = args.clinics
+        self.appointments = args.appointments
+        self.slots = [slot_label(index) for index in range(args.slots_per_schedule)]
+        self.booked_per_schedule = max(1, min(len(self.slots), round(len(self.slots) * args.fill)))
+        self.schedules = max(self.doctors, math.ceil(self.appointments / self.booked_per_schedule))
+        self.start_date = date.fromisoformat(args.start_date)
+        self.end_date = self.start_date + timedelta(days=(self.schedules - 1) // self.doctors)
+        self.password_hash = get_password_hash(args.password)
+
+        # Each doctor works at a home clinic; a list of `doctors` ints is the only per-row state kept
+        rng = self.rng("clinics")
+        self.doctor_clinic = [rng.randint(1, self.clinics) for _ in range(self.doctors)]
+
+    def rng(self, table: str) -> random.Random:
+        return random.Random(f"{self.seed}:{table}")
+
+    def name(self, rng, row_id: int) -> tuple:
+        return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), row_id
+
+    # Schedule j belongs to doctor (j mod doctors) on day (j div doctors), so (doctor, date) is unique
+    def schedule(self, schedule_id: int):
+        index = schedule_id - 1
+        doctor_id = index % self.doctors + 1
+        schedule_date = (self.start_date + timedelta(days=index // self.doctors)).isoformat()
+        return doctor_id, self.doctor_clinic[doctor_id - 1], schedule_date
+
+    ########################### ROW GENERATORS ###########################
+
+    def user_rows(self):
+        rng = self.rng("users")
+        for user_id in range(1, self.users + 1):
+            first, last, _ = self.name(rng, user_id)
+            role = "admin" if user_id == 1 else "patient"
+            yield (str(user_id), f"{first.lower()}.{last.lower()}{user_id}", self.password_hash,
+                   f"{first.lower()}.{last.lower()}{user_id}@example.com", role)
+
+    def patient_rows(self):
+        rng = self.rng("patients")
+        for patient_id in range(1, self.patients + 1):
+            first, last, _ = self.name(rng, patient_id)
+            dob = date(1940, 1, 1) + timedelta(days=rng.randint(0, 30000))
+            user_id = (patient_id - 1) // self.patients_per_user + 1
+            yield (str(patient_id), f"{first} {last} {patient_id}", dob.isoformat(),
+                   rng.choice(["female", "male"]), f"+233{200000000 + patient_id}", str(user_id))
+
+    def doctor_rows(self):
+        rng = self.rng("doctors")
+        for doctor_id in range(1, self.doctors + 1):
+            first, last, _ = self.name(rng, doctor_id)
+            yield str(doctor_id), f"Dr. {first} {last} {doctor_id}", rng.choice(SPECIALTIES)
+
+    def clinic_rows(self):
+        rng = self.rng("clinics-rows")
+        for clinic_id in range(1, self.clinics + 1):
+            yield (str(clinic_id), f"{rng.choice(CLINIC_WORDS)} Clinic {clinic_id}",
+                   f"{rng.randint(1, 400)} {rng.choice(STREETS)}, Accra", f"+233300{clinic_id:06d}",
+                   f"{ACCRA[0] + rng.uniform(-0.2, 0.2):.6f}", f"{ACCRA[1] + rng.uniform(-0.2, 0.2):.6f}")
+
+    def schedule_rows(self):
+        slots = "{" + ",".join(f'"{slot}"' for slot in self.slots) + "}"
+        for schedule_id in range(1, self.schedules + 1):
+            doctor_id, clinic_id, schedule_date = self.schedule(schedule_id)
+            yield (str(schedule_id), str(doctor_id), str(clinic_id), schedule_date, slots,
+                   str(doctor_id), str(clinic_id))
+
+    def appointment_rows(self):
+        rng = self.rng("appointments")
+        appointment_id = 0
+        for schedule_id in range(1, self.schedules + 1):
+            doctor_id, clinic_id, schedule_date = self.schedule(schedule_id)
+            remaining = self.appointments - appointment_id
+            if remaining <= 0:
+                return
+
+            booked = rng.sample(range(len(self.slots)), min(self.booked_per_schedule, remaining))
+            for slot_index in sorted(booked):
+                appointment_id += 1
+                patient_id = rng.randint(1, self.patients)
+                user_id = (patient_id - 1) // self.patients_per_user + 1
+                yield (str(appointment_id), str(patient_id), str(doctor_id), str(clinic_id),
+                       str(user_id), str(patient_id), str(doctor_id), str(clinic_id),
+                       schedule_date, self.slots[slot_index], "booked")
+
+
+COLUMNS = {
+    "users": "id, username, password, email, role",
+    "patients": "id, name, dob, gender, phone, user_id",
+    "doctors": "id, name, specialty",
+    "clinics": "id, name, address, phone, latitude, longitude",
+    "schedules": "schedule_id, doctor_id, clinic_id, date, slots, doctor_fkey, clinic_fkey",
+    "appointments": "appointments_id, patient_id, doctor_id, clinic_id, user_fkey, patient_fkey, "
+                    "doctor_fkey, clinic_fkey, appointment_date, appointment_time, appointment_status",
+}
+
+
+########################### LOADING ###########################
+
+def connect():
+    return psycopg2.connect(host=app_settings.DATABASE_HOSTNAME, port=app_settings.DATABASE_PORT,
+                            user=app_settings.DATABASE_USERNAME, password=app_settings.DATABASE_PASSWORD,
+                            database=app_settings.DATABASE_NAME)
+
+
+# Secondary indexes (not backing a PK/unique constraint) on the seeded tables
+def secondary_indexes(cursor):
+    cursor.execute("""
+        SELECT i.indexname, i.indexdef
+        FROM pg_indexes i
+        WHERE i.schemaname = current_schema()
+          AND i.tablename = ANY(%s)
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname)
+    """, (TABLES,))
+    return cursor.fetchall()
+
+
+def copy_table(cursor, table: str, rows):
+    stream = RowStream(rows)
+    started = time.perf_counter()
+    cursor.copy_expert(f"COPY {table} ({COLUMNS[table]}) FROM STDIN", stream, size=1 << 16)
+    elapsed = time.perf_counter() - started
+    print(f"  {table:<13} {stream.count:>12,} rows  {elapsed:8.1f}s  {stream.count / max(elapsed, 1e-9):>12,.0f} rows/s")
+
+
+def load(data: DataSet, truncate: bool, defer_indexes: bool):
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET synchronous_commit TO off")
+
+            if truncate:
+                cursor.execute(f"TRUNCATE {', '.join(TABLES)}, utilization_daily, utilization_deltas RESTART IDENTITY CASCADE")
+
+            # Every generated month gets its own appointments partition instead of landing in the default one
+            for action in partitions.create_range(cursor, data.start_date, data.end_date):
+                print(f"  {action}")
+
+            deferred = secondary_indexes(cursor) if defer_indexes else []
+            for index_name, _ in deferred:
+                cursor.execute(f'DROP INDEX "{index_name}"')
+
+            copy_table(cursor, "users", data.user_rows())
+            copy_table(cursor, "patients", data.patient_rows())
+            copy_table(cursor, "doctors", data.doctor_rows())
+            copy_table(cursor, "clinics", data.clinic_rows())
+            copy_table(cursor, "schedules", data.schedule_rows())
+            copy_table(cursor, "appointments", data.appointment_rows())
+
+            for index_name, index_definition in deferred:
+                started = time.perf_counter()
+                # Indexes of a partitioned table are reported as "ON ONLY", which would not build them on the partitions
+                cursor.execute(index_definition.replace(" ON ONLY ", " ON "))
+                print(f"  rebuilt {index_name} in {time.perf_counter() - started:.1f}s")
+
+            for table, column in SERIAL_COLUMNS.items():
+                cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                               f"COALESCE((SELECT max({column}) FROM {table}), 0) + 1, false)")
+        conn.commit()
+
+        # ANALYZE outside the load transaction so the planner sees the new row counts
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"ANALYZE {', '.join(TABLES)}, schedule_slots")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate and bulk load synthetic healthcare data")
+    parser.add_argument("--appointments", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=None, help="Defaults to appointments / 10")
+    parser.add_argument("--patients-per-user", type=int, default=2)
+    parser.add_argument("--doctors", type=int, default=None, help="Defaults to appointments / 2000")
+    parser.add_argument("--clinics", type=int, default=None, help="Defaults to doctors / 10")
+    parser.add_argument("--slots-per-schedule", type=int, default=32, help="15 minute slots from 08:00 AM (max 64)")
+    parser.add_argument("--fill", type=float, default=0.75, help="Fraction of each schedule's slots that are booked")
+    parser.add_argument("--start-date", default="2024-01-01")
+    parser.add_argument("--password", default="password", help="Password shared by all generated users")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncate", action="store_true", help="Empty the tables before loading")
+    parser.add_argument("--defer-indexes", action="store_true",
+                        help="Drop secondary indexes before loading and rebuild them afterwards")
+    args = parser.parse_args()
+
+    if not 1 <= args.slots_per_schedule <= 64:
+        parser.error("--slots-per-schedule must be between 1 and 64")
+    args.users = args.users or max(10, args.appointments // 10)
+    args.doctors = args.doctors or max(10, args.appointments // 2000)
+    args.clinics = args.clinics or max(3, args.doctors // 10)
+
+    data = DataSet(args)
+    print(f"Loading {data.users:,} users, {data.patients:,} patients, {data.doctors:,} doctors, "
+          f"{data.clinics:,} clinics, {data.schedules:,} schedules, {data.appointments:,} appointments "
+          f"into {app_settings.DATABASE_NAME} (seed {args.seed})")
+
+    started = time.perf_counter()
+    load(data, args.truncate, args.defer_indexes)
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
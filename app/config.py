@@ -10,6 +10,125 @@ class AppSettings(BaseSettings):
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
 
+    # Refresh tokens and revocation (access tokens carry the user's id and role; revoked ids are kept in a Bloom filter)
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    REVOCATION_SYNC_SECONDS: float = 5.0  # How often each worker picks up revocations made through other workers
+    REVOCATION_REBUILD_SECONDS: int = 3600  # The filter is rebuilt without expired entries, which are then deleted
+    REVOCATION_FILTER_CAPACITY: int = 100000  # Revoked token ids the filter is sized for (it grows when exceeded)
+    REVOCATION_FILTER_ERROR_RATE: float = 0.001  # False positives are confirmed against the table
+
+    # Connection pools (one per engine; filled with DATABASE_POOL_SIZE connections at startup)
+    DATABASE_POOL_SIZE: int = 5
+    DATABASE_MAX_OVERFLOW: int = 10
+
+    # Startup, probes and graceful shutdown (/healthz, /readyz)
+    READINESS_TIMEOUT_SECONDS: float = 2.0  # /readyz fails when the database does not answer within this
+    SHUTDOWN_DRAIN_SECONDS: float = 20.0  # How long shutdown waits for in-flight requests (keep below the server's graceful timeout)
+
+    # Read replicas (read-only GET handlers use get_read_db and are routed to a replica when possible)
+    DATABASE_REPLICA_URLS: str = ""  # Comma separated SQLAlchemy URLs of streaming replicas
+    REPLICA_MAX_LAG_SECONDS: float = 5.0  # Replicas further behind are skipped until they catch up
+    REPLICA_LAG_CHECK_SECONDS: float = 1.0  # Minimum interval between lag measurements of a replica
+    READ_YOUR_WRITES_SECONDS: float = 10.0  # After a write the caller reads from the primary this long (keep > max lag)
+
+    # SQL profiling (off by default; no listeners or middleware are installed when disabled)
+    SQL_PROFILING_ENABLED: bool = False
+    SQL_PROFILING_HEADER: bool = True  # Add the X-SQL-Profile summary header to responses
+    SQL_SLOW_QUERY_MS: float = 100.0  # Statements slower than this are flagged as slow
+    SQL_N_PLUS_ONE_THRESHOLD: int = 5  # Same statement repeated this often in one request is flagged as N+1
+
+    # Request profiling (off by default; when enabled, admins add ?__profile=1 or an X-Profile: 1 header to get a collapsed-stack profile)
+    PROFILING_ENABLED: bool = False
+    PROFILE_INTERVAL_MS: float = 5.0  # Stack sampling interval
+    PROFILE_SAMPLE_EVERY: int = 0  # Profile 1 in N requests to PROFILE_OUTPUT_DIR (0 disables)
+    PROFILE_OUTPUT_DIR: str = "profiles"
+
+    # Idempotency-Key support for the create endpoints
+    IDEMPOTENCY_TTL_SECONDS: int = 86400  # How long a stored response can be replayed
+    IDEMPOTENCY_CACHE_SIZE: int = 10000  # Completed responses kept in the in-process front cache
+    IDEMPOTENCY_SWEEP_SECONDS: int = 300  # Minimum interval between deletes of expired keys
+    IDEMPOTENCY_IN_PROGRESS_TIMEOUT_SECONDS: int = 60  # After this an unfinished key (crashed worker) can be reclaimed
+
+    # Admission control (token buckets and per route class concurrency caps, checked before any DB or bcrypt work)
+    ADMISSION_CONTROL_ENABLED: bool = True
+    # Comma separated IPs or CIDRs of the load balancers / reverse proxies in front of the API. Requests
+    # from them are limited per X-Forwarded-For client instead of per proxy; required behind a proxy.
+    ADMISSION_TRUSTED_PROXIES: str = ""
+    RATE_LIMIT_IP_PER_SECOND: float = 50.0  # All requests from one IP (a rate of 0 disables a limit)
+    RATE_LIMIT_IP_BURST: int = 100
+    RATE_LIMIT_USER_PER_SECOND: float = 20.0  # All requests from one authenticated user
+    RATE_LIMIT_USER_BURST: int = 40
+    RATE_LIMIT_LOGIN_PER_SECOND: float = 1.0  # Login attempts from one IP
+    RATE_LIMIT_LOGIN_BURST: int = 5
+    CONCURRENCY_LIMIT_LOGIN: int = 4  # Concurrent logins per worker (bcrypt bound); 0 means unlimited
+    CONCURRENCY_LIMIT_BOOKING: int = 32  # Concurrent POST/PUT /appointments per worker
+    CONCURRENCY_LIMIT_DEFAULT: int = 0  # Everything else
+
+    # Monthly partitions of the appointments table (maintained by `python -m app.partitions maintain`)
+    APPOINTMENT_PARTITION_MONTHS_AHEAD: int = 12  # Partitions created ahead of the current month
+    APPOINTMENT_RETENTION_MONTHS: int = 24  # Partitions that ended longer ago than this are detached
+    APPOINTMENT_ARCHIVE_SCHEMA: str = "archive"  # Schema detached partitions are moved to
+
+    # Slot availability push channel (/ws/availability)
+    AVAILABILITY_STREAM_ENABLED: bool = True
+    AVAILABILITY_QUEUE_SIZE: int = 256  # Undelivered events per client before it is disconnected
+    AVAILABILITY_PUBLISH_QUEUE_SIZE: int = 10000  # Committed events waiting to be sent per worker (beyond: clients resync)
+
+    # Delta sync (?since= on GET /schedules, /doctors, /clinics)
+    SYNC_OVERLAP_SECONDS: int = 60  # Changes re-sent before the token, covering transactions still in flight at sync time
+    SYNC_TOMBSTONE_RETENTION_DAYS: int = 30  # Older sync tokens get 410 and must do a full download
+    SYNC_PRUNE_SECONDS: int = 3600  # Minimum interval between deletes of expired tombstones
+
+    # Search and autocomplete (/search); the doctor and clinic catalogs are kept in an in-process prefix trie
+    SEARCH_TRIE_ENABLED: bool = True
+    SEARCH_TRIE_TTL_SECONDS: int = 60  # Rebuilt after this, so changes made through other workers show up
+    SEARCH_TRIE_MAX_ENTRIES: int = 50000  # Larger catalogs are autocompleted from the trigram indexes instead
+
+    # Nearest clinic lookup (/clinics/nearest), served from an in-process k-d tree of clinic locations
+    CLINIC_LOCATOR_TTL_SECONDS: int = 60  # Rebuilt after this, so clinics changed through other workers show up
+
+    # Batch fetch by id (?ids=1,2,3 on the list endpoints) and request-scoped loaders (app/loaders.py)
+    BATCH_MAX_IDS: int = 100  # Most ids per request, and per IN query when a loader dispatches
+
+    # iCalendar feeds (/doctors/{id}/calendar.ics, /clinics/{id}/calendar.ics, /users/{id}/calendar.ics)
+    CALENDAR_PAST_DAYS: int = 30  # Default window: from this many days ago ...
+    CALENDAR_FUTURE_DAYS: int = 180  # ... to this many days ahead (clients may pass date_from/date_to)
+    CALENDAR_MAX_DAYS: int = 400  # Longest window a client may ask for
+    CALENDAR_EVENT_MINUTES: int = 30  # Length of an appointment event (slots carry a start time only)
+    CALENDAR_MAX_AGE_SECONDS: int = 3600  # Feeds are rebuilt at least this often, picking up renamed records
+    CALENDAR_CACHE_SIZE: int = 1000  # Serialized feeds kept per worker
+    CALENDAR_CACHE_MAX_FEED_BYTES: int = 1048576  # Larger feeds are streamed from the database on every change
+    CALENDAR_TOKEN_EXPIRE_DAYS: int = 365  # Feed tokens (?token=) for calendar apps that cannot send headers
+
+    # Write-behind audit log of created, updated and deleted records (audit_log table, GET /audit)
+    AUDIT_ENABLED: bool = True
+    AUDIT_QUEUE_SIZE: int = 10000  # Records buffered per worker before committing requests block
+    AUDIT_BATCH_SIZE: int = 500  # Rows per multi-row INSERT; a queue this long is flushed right away
+    AUDIT_FLUSH_SECONDS: float = 1.0  # Otherwise the queue is flushed this often
+    AUDIT_BLOCK_SECONDS: float = 5.0  # Longest a request waits on a full queue before writing its records itself
+
+    # Deleted doctors, clinics and users are hidden at once and purged in the background (GET /purge-jobs/{id})
+    PURGE_ENABLED: bool = True  # Run a purger in every worker (otherwise: python -m app.purge run)
+    PURGE_CHUNK_SIZE: int = 500  # Rows deleted per transaction
+    PURGE_PAUSE_SECONDS: float = 0.05  # Pause between chunks, so bookings waiting on the same locks go first
+    PURGE_POLL_SECONDS: float = 1.0  # How often an idle purger looks for new jobs
+    PURGE_LOCK_TIMEOUT_MS: int = 2000  # A chunk waiting longer than this for a row lock is retried later
+    PURGE_LEASE_SECONDS: int = 60  # A job whose purger stopped renewing its lease is taken over by another worker
+    PURGE_RETRY_SECONDS: int = 30  # Wait before a job is retried after an error ...
+    PURGE_MAX_ATTEMPTS: int = 5  # ... and give up (status 'failed') after this many errors
+
+    # Booked counts reach utilization_daily (GET /stats/utilization) through utilization_deltas
+    UTILIZATION_FOLD_ENABLED: bool = True  # Fold deltas in every worker (otherwise: python -m app.utilization fold)
+    UTILIZATION_FOLD_SECONDS: float = 1.0  # How often pending deltas are folded, i.e. how far statistics may lag
+    UTILIZATION_FOLD_BATCH_SIZE: int = 5000  # Deltas folded per transaction
+
+    # Request deadlines, applied to each transaction of the request as statement_timeout (503/504 when exceeded)
+    REQUEST_TIMEOUT_ENABLED: bool = True
+    REQUEST_TIMEOUT_MS: int = 10000  # Budget of routes without a rule below (0: no deadline)
+    # Comma separated "[METHOD ]path pattern=ms" rules (fnmatch patterns, first match wins)
+    REQUEST_TIMEOUT_ROUTES: str = "POST /appointments*=3000,PUT /appointments*=3000,GET /stats*=30000," \
+                                  "GET /audit*=30000,GET */calendar.ics=30000"
+
     class Config:
         env_file = ".env"  # Specify the path to your .env file
 
@@ -1,35 +1,68 @@
-from sqlalchemy import create_engine
+from fastapi import Depends, Request
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from sqlalchemy.orm import sessionmaker
-from datetime import time
+from sqlalchemy.orm import Session, sessionmaker
+from . import replicas
 from .config import app_settings
 
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{app_settings.DATABASE_USERNAME}:{app_settings.DATABASE_PASSWORD}@{app_settings.DATABASE_HOSTNAME}/{app_settings.DATABASE_NAME}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Connections are opened and warmed by the lifespan in app/lifecycle.py, not at import time
+engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_size=app_settings.DATABASE_POOL_SIZE,
+                       max_overflow=app_settings.DATABASE_MAX_OVERFLOW)
+# Objects stay loaded after commit, so rows returned by UPDATE ... RETURNING are not re-selected
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
 
-# Dependency
-def get_db():
-    db = SessionLocal()
+# Streaming replicas serving the read-only endpoints (none configured: everything reads the primary)
+replica_engines = [create_engine(url.strip(), pool_size=app_settings.DATABASE_POOL_SIZE,
+                                 max_overflow=app_settings.DATABASE_MAX_OVERFLOW, pool_pre_ping=True)
+                   for url in app_settings.DATABASE_REPLICA_URLS.split(",") if url.strip()]
+ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False)
+replica_set = replicas.ReplicaSet(replica_engines, max_lag=app_settings.REPLICA_MAX_LAG_SECONDS,
+                                  check_interval=app_settings.REPLICA_LAG_CHECK_SECONDS)
+sticky_writers = replicas.StickyWriters(window=app_settings.READ_YOUR_WRITES_SECONDS)
+
+
+# A commit through a write session makes its caller read from the primary for a while
+@event.listens_for(SessionLocal, "after_commit")
+def _after_commit(session):
+    key = session.info.get("sticky_key")
+    if key is not None:
+        sticky_writers.wrote(key)
+
+
+# Dependency for handlers that write: a session on the primary. Its transactions are bounded by
+# the request deadline (app/deadlines.py), when there is one.
+def get_write_db(request: Request):
+    db = SessionLocal(info={"sticky_key": replicas.StickyWriters.key(request.headers.get("authorization")),
+                            "deadline": getattr(request.state, "deadline", None)})
     try:
         yield db
     finally:
         db.close()
 
 
-# postgres database connection
-while True:
+# Dependency for read-only handlers: a session on a replica that is within the lag limit, or on
+# the primary when there is none, inside a write request (whose reads must see its own writes) and
+# for callers that wrote within READ_YOUR_WRITES_SECONDS. The primary session is shared with
+# get_write_db and, like every session, only takes a connection when first used.
+def get_read_db(request: Request, primary: Session = Depends(get_write_db)):
+    if request.method not in ("GET", "HEAD") or \
+            sticky_writers.is_sticky(replicas.StickyWriters.key(request.headers.get("authorization"))):
+        yield primary
+        return
+
+    replica_engine = replica_set.choose()
+    if replica_engine is None:
+        yield primary
+        return
+
+    db = ReplicaSessionLocal(bind=replica_engine,
+                             info={"replica": True, "deadline": getattr(request.state, "deadline", None)})
     try:
-        conn = psycopg2.connect(host=app_settings.DATABASE_HOSTNAME, user=app_settings.DATABASE_USERNAME, password=app_settings.DATABASE_PASSWORD, database=app_settings.DATABASE_NAME, 
-                                cursor_factory=RealDictCursor)
-        cursor = conn.cursor()
-        print("Connecting to healthcare-appointment database Successful✅")
-        break
-    except:
-        print("Connection to healthcare-appointment database failed❌")
-        time.sleep(2)
+        yield db
+    finally:
+        db.close()
+
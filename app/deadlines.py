@@ -0,0 +1,181 @@
+import asyncio
+import fnmatch
+import logging
+import math
+import threading
+import time
+from typing import Optional
+
+import psycopg2
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from starlette.responses import JSONResponse
+
+from . import lifecycle
+from .database import ReplicaSessionLocal, SessionLocal, engine, replica_engines
+
+logger = logging.getLogger("app.deadlines")
+
+# Every request gets a time budget (REQUEST_TIMEOUT_MS, or the first matching REQUEST_TIMEOUT_ROUTES
+# rule), and its deadline is stored in the request state, from where get_write_db and get_read_db
+# put it on their sessions. Each transaction such a session begins sets statement_timeout to the
+# time left, so Postgres itself cancels a statement that runs past the deadline. When the deadline
+# passes while a request still holds connections, the statements running on them are cancelled
+# right away (a later statement of a long transaction would otherwise get the full timeout taken at
+# BEGIN). A cancelled statement becomes 504; a request whose budget ran out before it got to the
+# database (waiting for a pooled connection) becomes 503.
+
+QUERY_CANCELED = "57014"  # SQLSTATE of a statement cancelled by statement_timeout or a cancel request
+TIMEOUT_HEADER = "x-request-timeout-ms"  # Callers may shorten (never extend) the budget with this header
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+########################### DEADLINES ###########################
+
+_lock = threading.Lock()  # Guards _owners, and keeps a connection from being checked in while it is cancelled
+_owners = {}  # DBAPI connection -> Deadline of the request whose transaction is using it
+
+
+class Deadline:
+    def __init__(self, budget_ms: int):
+        self.budget_ms = budget_ms
+        self.at = time.monotonic() + budget_ms / 1000
+        self.expired = False
+
+    def remaining_ms(self) -> int:
+        return math.floor((self.at - time.monotonic()) * 1000)
+
+    # Called once the deadline has passed: cancels whatever the request's connections are running.
+    # A connection is only cancelled while it is checked out to this request, so the cancel can
+    # never hit another request's statement.
+    def expire(self):
+        with _lock:
+            self.expired = True
+            for connection in [connection for connection, owner in _owners.items() if owner is self]:
+                try:
+                    connection.cancel()
+                except psycopg2.Error:
+                    logger.exception("Could not cancel a statement past its deadline")
+
+
+@event.listens_for(SessionLocal, "after_begin")
+@event.listens_for(ReplicaSessionLocal, "after_begin")
+def _after_begin(session, transaction, connection):
+    deadline = session.info.get("deadline")
+    if deadline is None:
+        return
+    remaining = deadline.remaining_ms()
+    if remaining < 1 or deadline.expired:
+        # A statement_timeout of 0 would disable the timeout instead
+        raise DeadlineExceeded()
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {remaining}")
+    with _lock:
+        _owners[connection.connection.dbapi_connection] = deadline
+
+
+def _checkin(dbapi_connection, connection_record):
+    with _lock:
+        _owners.pop(dbapi_connection, None)
+
+
+for _engine in (engine, *replica_engines):
+    event.listen(_engine, "checkin", _checkin)
+
+
+########################### BUDGETS ###########################
+
+# "[METHOD ]path pattern=ms" rules, e.g. "GET /stats*=30000,GET */calendar.ics=30000"
+def parse_rules(value: str):
+    rules = []
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        pattern, _, budget = item.rpartition("=")
+        method, _, path = pattern.strip().rpartition(" ")
+        rules.append((method.strip().upper() or None, path, int(budget)))
+    return rules
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class DeadlineMiddleware:
+    def __init__(self, app, settings):
+        self.app = app
+        self.default_ms = settings.REQUEST_TIMEOUT_MS
+        self.rules = parse_rules(settings.REQUEST_TIMEOUT_ROUTES)
+
+    # Budget of the route in milliseconds (0: no deadline); the first matching rule wins
+    def budget(self, scope) -> int:
+        budget = self.default_ms
+        for method, path, rule_ms in self.rules:
+            if (method is None or method == scope["method"]) and fnmatch.fnmatchcase(scope["path"], path):
+                budget = rule_ms
+                break
+
+        requested = _header(scope, TIMEOUT_HEADER.encode())
+        if requested is not None and requested.strip().isdigit() and int(requested) > 0:
+            budget = min(budget, int(requested)) if budget else int(requested)
+        return budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in lifecycle.PROBE_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        budget = self.budget(scope)
+        if not budget:
+            await self.app(scope, receive, send)
+            return
+
+        deadline = Deadline(budget)
+        scope.setdefault("state", {})["deadline"] = deadline
+        # The cancel requests are sent from a thread: each one opens a connection to the server
+        loop = asyncio.get_running_loop()
+        timer = loop.call_later(budget / 1000, lambda: loop.run_in_executor(None, deadline.expire))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            timer.cancel()
+
+
+########################### ERRORS ###########################
+
+def _rejected(request, status_code: int, reason: str, headers=None) -> JSONResponse:
+    deadline = getattr(request.state, "deadline", None)
+    logger.warning("%s %s: %s (budget %s ms)", request.method, request.url.path, reason,
+                   deadline.budget_ms if deadline is not None else None)
+    return JSONResponse({"detail": "Request deadline exceeded"}, status_code=status_code, headers=headers)
+
+
+# The budget was spent before the request got a connection: the worker is overloaded
+async def _deadline_exceeded(request, error):
+    return _rejected(request, 503, "deadline passed before the database was reached", {"Retry-After": "1"})
+
+
+async def _pool_timeout(request, error):
+    return _rejected(request, 503, "timed out waiting for a pooled connection", {"Retry-After": "1"})
+
+
+# A statement cancelled by its statement_timeout or by the deadline; any other error is left to the default handler
+async def _operational_error(request, error):
+    if getattr(error.orig, "pgcode", None) != QUERY_CANCELED:
+        raise error
+    return _rejected(request, 504, "statement cancelled")
+
+
+def install(app, settings):
+    if not settings.REQUEST_TIMEOUT_ENABLED:
+        return
+
+    app.add_middleware(DeadlineMiddleware, settings=settings)
+    app.add_exception_handler(DeadlineExceeded, _deadline_exceeded)
+    app.add_exception_handler(PoolTimeoutError, _pool_timeout)
+    app.add_exception_handler(OperationalError, _operational_error)
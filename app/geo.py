@@ -0,0 +1,188 @@
+import heapq
+import math
+import threading
+import time
+from datetime import date, datetime
+from typing import Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from . import models, utils
+from .config import app_settings
+
+# Nearest clinic lookup for GET /clinics/nearest. Clinic locations are kept in an in-process k-d
+# tree over 3D unit vectors: straight-line (chord) distance between unit vectors orders points
+# exactly like great-circle distance, with no special cases at the poles or the antimeridian.
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def unit_vector(latitude: float, longitude: float):
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def chord_to_km(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def km_to_chord(km: float) -> float:
+    return 2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)
+
+
+########################### K-D TREE ###########################
+
+# Static k-d tree of (point, value) pairs; nodes are (point, value, axis, left, right) tuples
+class KDTree:
+    __slots__ = ("root", "size")
+
+    def __init__(self, items):
+        self.size = len(items)
+        self.root = self._build(list(items), 0)
+
+    def _build(self, items, depth):
+        if not items:
+            return None
+        axis = depth % 3
+        items.sort(key=lambda item: item[0][axis])
+        median = len(items) // 2
+        return (items[median][0], items[median][1], axis,
+                self._build(items[:median], depth + 1), self._build(items[median + 1:], depth + 1))
+
+    # The k values closest to `point` (and within max_distance) as (distance, value), closest first
+    def nearest(self, point, k: int, max_distance: float = math.inf):
+        heap = []  # Max-heap of the best k so far, as (-squared distance, value)
+        bound = max_distance * max_distance
+
+        def visit(node):
+            if node is None:
+                return
+            node_point, value, axis, left, right = node
+            squared = sum((a - b) * (a - b) for a, b in zip(point, node_point))
+            if squared <= bound:
+                if len(heap) < k:
+                    heapq.heappush(heap, (-squared, value))
+                elif squared < -heap[0][0]:
+                    heapq.heapreplace(heap, (-squared, value))
+
+            offset = point[axis] - node_point[axis]
+            near, far = (left, right) if offset < 0 else (right, left)
+            visit(near)
+            # The far side can only hold a closer point if the splitting plane is within reach
+            reach = bound if len(heap) < k else min(bound, -heap[0][0])
+            if offset * offset <= reach:
+                visit(far)
+
+        visit(self.root)
+        return sorted((math.sqrt(-negated), value) for negated, value in heap)
+
+
+########################### CLINIC LOCATOR ###########################
+
+# k-d tree of the clinics with coordinates, rebuilt after CLINIC_LOCATOR_TTL_SECONDS or when this
+# worker changes a clinic (the clinic set is small, so a rebuild is a single cheap query)
+class ClinicLocator:
+    def __init__(self):
+        self.tree = None
+        self.loaded_at = None  # Monotonic time the current tree's query started
+        self.invalidated_at = 0.0
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        self.invalidated_at = time.monotonic()
+
+    def _fresh(self) -> bool:
+        return (self.loaded_at is not None and self.loaded_at > self.invalidated_at
+                and time.monotonic() - self.loaded_at < app_settings.CLINIC_LOCATOR_TTL_SECONDS)
+
+    def current(self, db: Session) -> KDTree:
+        if self._fresh():
+            return self.tree
+        with self.lock:
+            if self._fresh():
+                return self.tree
+
+            started = time.monotonic()
+            rows = db.query(models.Clinic.id, models.Clinic.latitude, models.Clinic.longitude) \
+                .filter(models.Clinic.latitude.isnot(None), models.Clinic.longitude.isnot(None)).all()
+            self.tree = KDTree([(unit_vector(latitude, longitude), clinic_id) for clinic_id, latitude, longitude in rows])
+            self.loaded_at = started
+            return self.tree
+
+
+locator = ClinicLocator()
+
+
+# Called by the clinics router after a write; other workers catch up within the TTL
+def invalidate():
+    locator.invalidate()
+
+
+########################### AVAILABILITY ###########################
+
+# Earliest free slot per clinic on `day` as {clinic_id: (minutes, slot, doctor_id, free_slots)}.
+# A slot is free while its seat counter is below its capacity (bookings at any clinic count), and
+# slots before `after_minutes` (the current time, when searching today) are skipped.
+def free_slots(db: Session, clinic_ids, day: str, after_minutes: int = -1):
+    slots = db.query(models.ScheduleSlot.doctor_id, models.ScheduleSlot.clinic_id, models.ScheduleSlot.slot_time) \
+        .filter(models.ScheduleSlot.clinic_id.in_(clinic_ids), models.ScheduleSlot.date == day,
+                models.ScheduleSlot.booked_count < models.ScheduleSlot.capacity).all()
+
+    found = {}
+    for doctor_id, clinic_id, slot in slots:
+        minutes = utils.slot_minutes(slot)
+        if minutes is None or minutes < after_minutes:
+            continue
+        earliest = found.get(clinic_id)
+        if earliest is None:
+            found[clinic_id] = (minutes, slot, doctor_id, 1)
+        else:
+            found[clinic_id] = min(earliest[:3], (minutes, slot, doctor_id)) + (earliest[3] + 1,)
+    return found
+
+
+# Closest clinics with a free slot on `day` (default today), ranked by distance, then earliest slot.
+# The k nearest clinics are checked for availability in one round trip; k grows until enough
+# clinics with free slots are found or every clinic in range has been checked.
+def nearest_available(db: Session, latitude: float, longitude: float, day: Optional[str], limit: int,
+                      max_distance_km: Optional[float] = None):
+    today = date.today()
+    if day is None:
+        day = today.isoformat()
+    try:
+        requested = date.fromisoformat(day)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="date must be in YYYY-MM-DD format")
+    if requested < today:
+        return []
+    now = datetime.now()
+    after_minutes = now.hour * 60 + now.minute if requested == today else -1
+
+    tree = locator.current(db)
+    point = unit_vector(latitude, longitude)
+    max_chord = km_to_chord(max_distance_km) if max_distance_km is not None else math.inf
+
+    ranked, checked = [], set()
+    k = min(tree.size, max(4 * limit, 16))
+    while k > 0:
+        candidates = [(chord, clinic_id) for chord, clinic_id in tree.nearest(point, k, max_chord)
+                      if clinic_id not in checked]
+        available = free_slots(db, [clinic_id for _, clinic_id in candidates], day, after_minutes)
+        checked.update(clinic_id for _, clinic_id in candidates)
+        for chord, clinic_id in candidates:
+            if clinic_id in available:
+                ranked.append((chord_to_km(chord), available[clinic_id], clinic_id))
+
+        if len(ranked) >= limit or len(checked) < k or k >= tree.size:
+            break
+        k = min(tree.size, k * 4)
+
+    ranked.sort(key=lambda entry: (entry[0], entry[1][0]))
+    ranked = ranked[:limit]
+    clinics = {clinic.id: clinic for clinic in
+               db.query(models.Clinic).filter(models.Clinic.id.in_([clinic_id for _, _, clinic_id in ranked])).all()}
+
+    return [{"clinic": clinics[clinic_id], "distance_km": round(distance, 3), "doctor_id": doctor_id,
+             "earliest_slot": slot, "free_slots": count}
+            for distance, (_, slot, doctor_id, count), clinic_id in ranked if clinic_id in clinics]
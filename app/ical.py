@@ -0,0 +1,226 @@
+import hashlib
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select, true
+from sqlalchemy.orm import Session
+
+from . import models, utils
+from .config import app_settings
+from .idempotency import ResponseCache
+
+# iCalendar (RFC 5545) feeds of booked appointments and schedules, polled by calendar apps. The
+# ETag is derived from an aggregate over the feed's date window (row count, id and version sums),
+# which any insert, update or delete changes; a poll whose ETag still matches gets 304 without the
+# feed being read. Serialized feeds are cached per worker under their ETag, and a feed that is not
+# cached is streamed from the database while it is serialized.
+
+MEDIA_TYPE = "text/calendar"  # Starlette appends the utf-8 charset
+PRODID = "-//healthcare-appointment//calendar feed//EN"
+CHUNK_BYTES = 1 << 16  # Events are sent in chunks of about this size
+FETCH_ROWS = 500  # Rows fetched per round trip while streaming
+
+feeds = ResponseCache(app_settings.CALENDAR_CACHE_SIZE)
+
+Appointment, Schedule = models.Appointment, models.DoctorSchedule
+
+# Feed scope -> (appointment column, schedule column or None when schedules are not part of the feed)
+SCOPES = {
+    "doctor": (Appointment.doctor_id, Schedule.doctor_id),
+    "clinic": (Appointment.clinic_id, Schedule.clinic_id),
+    "user": (Appointment.user_fkey, None),
+}
+
+
+########################### SERIALIZATION ###########################
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+# Content lines longer than 75 octets are folded onto continuation lines starting with a space
+def _line(name: str, value: str) -> str:
+    line = f"{name}:{value}".encode()
+    if len(line) <= 75:
+        return line.decode() + "\r\n"
+    parts, start = [], 0
+    while start < len(line):
+        end = min(len(line), start + (75 if start == 0 else 74))
+        while end < len(line) and (line[end] & 0xC0) == 0x80:  # Never split a UTF-8 sequence
+            end -= 1
+        parts.append(line[start:end].decode())
+        start = end
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _utc(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+# Slot times carry no time zone, so events use floating local times; unparseable slots become all-day events
+def _span(day: str, start_minutes: Optional[int], end_minutes: Optional[int]):
+    compact = day.replace("-", "")
+    if start_minutes is None or end_minutes is None:
+        following = (date.fromisoformat(day) + timedelta(days=1)).strftime("%Y%m%d")
+        return ("DTSTART;VALUE=DATE", compact), ("DTEND;VALUE=DATE", following)
+    start_hour, start_minute = divmod(start_minutes, 60)
+    end_hour, end_minute = divmod(min(end_minutes, 24 * 60 - 1), 60)
+    return (("DTSTART", f"{compact}T{start_hour:02d}{start_minute:02d}00"),
+            ("DTEND", f"{compact}T{end_hour:02d}{end_minute:02d}00"))
+
+
+def _event(uid: str, stamp: datetime, sequence: int, span, summary: str, location: str, busy: bool) -> str:
+    lines = ["BEGIN:VEVENT\r\n", _line("UID", uid), _line("DTSTAMP", _utc(stamp)), _line("SEQUENCE", str(sequence - 1))]
+    lines += [_line(name, value) for name, value in span]
+    lines += [_line("SUMMARY", _escape(summary)), _line("LOCATION", _escape(location)),
+              _line("TRANSP", "OPAQUE" if busy else "TRANSPARENT"), _line("STATUS", "CONFIRMED"), "END:VEVENT\r\n"]
+    return "".join(lines)
+
+
+def appointment_event(row) -> str:
+    start = utils.slot_minutes(row.appointment_time)
+    span = _span(row.appointment_date, start,
+                 None if start is None else start + app_settings.CALENDAR_EVENT_MINUTES)
+    return _event(f"appointment-{row.appointments_id}@healthcare-appointment", row.updated_at, row.version, span,
+                  f"{row.patient_name} with {row.doctor_name}", f"{row.clinic_name}, {row.clinic_address}", True)
+
+
+# One event per schedule, from its first slot to the end of its last
+def schedule_event(row) -> str:
+    minutes = [utils.slot_minutes(slot) for slot in row.slots]
+    minutes = [value for value in minutes if value is not None]
+    span = _span(row.date, min(minutes) if minutes else None,
+                 max(minutes) + app_settings.CALENDAR_EVENT_MINUTES if minutes else None)
+    return _event(f"schedule-{row.schedule_id}@healthcare-appointment", row.updated_at, row.version, span,
+                  f"{row.doctor_name} available", f"{row.clinic_name}, {row.clinic_address}", False)
+
+
+def _header(name: str) -> str:
+    return "".join(["BEGIN:VCALENDAR\r\n", _line("VERSION", "2.0"), _line("PRODID", PRODID),
+                    _line("CALSCALE", "GREGORIAN"), _line("METHOD", "PUBLISH"), _line("X-WR-CALNAME", _escape(name))])
+
+
+FOOTER = "END:VCALENDAR\r\n"
+
+
+########################### QUERIES ###########################
+
+# The date window of a feed, as inclusive YYYY-MM-DD strings (dates are stored as strings)
+def window(date_from: Optional[str], date_to: Optional[str]):
+    today = date.today()
+    try:
+        start = date.fromisoformat(date_from) if date_from else today - timedelta(days=app_settings.CALENDAR_PAST_DAYS)
+        end = date.fromisoformat(date_to) if date_to else today + timedelta(days=app_settings.CALENDAR_FUTURE_DAYS)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="date_from and date_to must be in YYYY-MM-DD format")
+    if end < start:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="date_to must not be before date_from")
+    if (end - start).days > app_settings.CALENDAR_MAX_DAYS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"A feed covers at most {app_settings.CALENDAR_MAX_DAYS} days")
+    return start.isoformat(), end.isoformat()
+
+
+def _appointment_filter(scope: str, owner_id: int, start: str, end: str):
+    return (SCOPES[scope][0] == owner_id, Appointment.appointment_date.between(start, end),
+            Appointment.appointment_status == 'booked')
+
+
+def _schedule_filter(scope: str, owner_id: int, start: str, end: str):
+    return SCOPES[scope][1] == owner_id, Schedule.date.between(start, end)
+
+
+# Changes with every insert, update (the version column is bumped) and delete of a row in the
+# window, read from the feed indexes in one round trip. Feeds are also rebuilt at least every
+# CALENDAR_MAX_AGE_SECONDS, which picks up renamed patients, doctors and clinics.
+def etag(db: Session, scope: str, owner_id: int, start: str, end: str) -> str:
+    appointments = select(func.count(), func.coalesce(func.sum(Appointment.appointments_id), 0),
+                          func.coalesce(func.sum(Appointment.version), 0)) \
+        .where(*_appointment_filter(scope, owner_id, start, end)).subquery()
+    query = select(appointments)
+    if SCOPES[scope][1] is not None:
+        schedules = select(func.count(), func.coalesce(func.sum(Schedule.schedule_id), 0),
+                           func.coalesce(func.sum(Schedule.version), 0)) \
+            .where(*_schedule_filter(scope, owner_id, start, end)).subquery()
+        query = select(appointments, schedules).select_from(appointments.join(schedules, true()))
+    state = db.execute(query).one()
+    epoch = int(time.time() // app_settings.CALENDAR_MAX_AGE_SECONDS)
+    digest = hashlib.sha256(repr((scope, owner_id, start, end, epoch, tuple(state))).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def _events(db: Session, scope: str, owner_id: int, start: str, end: str):
+    if SCOPES[scope][1] is not None:
+        schedules = select(Schedule.schedule_id, Schedule.date, Schedule.slots, Schedule.version, Schedule.updated_at,
+                           models.Doctor.name.label("doctor_name"), models.Clinic.name.label("clinic_name"),
+                           models.Clinic.address.label("clinic_address")) \
+            .join(models.Doctor, models.Doctor.id == Schedule.doctor_id) \
+            .join(models.Clinic, models.Clinic.id == Schedule.clinic_id) \
+            .where(*_schedule_filter(scope, owner_id, start, end)).order_by(Schedule.date, Schedule.schedule_id)
+        for row in db.execute(schedules.execution_options(yield_per=FETCH_ROWS)):
+            yield schedule_event(row)
+
+    appointments = select(Appointment.appointments_id, Appointment.appointment_date, Appointment.appointment_time,
+                          Appointment.version, Appointment.updated_at, models.Patient.name.label("patient_name"),
+                          models.Doctor.name.label("doctor_name"), models.Clinic.name.label("clinic_name"),
+                          models.Clinic.address.label("clinic_address")) \
+        .join(models.Patient, models.Patient.id == Appointment.patient_id) \
+        .join(models.Doctor, models.Doctor.id == Appointment.doctor_id) \
+        .join(models.Clinic, models.Clinic.id == Appointment.clinic_id) \
+        .where(*_appointment_filter(scope, owner_id, start, end)) \
+        .order_by(Appointment.appointment_date, Appointment.appointments_id)
+    for row in db.execute(appointments.execution_options(yield_per=FETCH_ROWS)):
+        yield appointment_event(row)
+
+
+# Serializes the feed in chunks while it is sent, and caches it once complete if it is small enough
+def _stream(db: Session, key, tag: str, name: str, scope: str, owner_id: int, start: str, end: str):
+    sent, size, pending = [], 0, [_header(name)]
+    pending_size = len(pending[0])
+    for event in _events(db, scope, owner_id, start, end):
+        pending.append(event)
+        pending_size += len(event)
+        if pending_size >= CHUNK_BYTES:
+            chunk = "".join(pending).encode()
+            sent.append(chunk)
+            size += len(chunk)
+            pending, pending_size = [], 0
+            yield chunk
+    pending.append(FOOTER)
+    chunk = "".join(pending).encode()
+    sent.append(chunk)
+    size += len(chunk)
+    yield chunk
+
+    if size <= app_settings.CALENDAR_CACHE_MAX_FEED_BYTES:
+        feeds.put(key, {"etag": tag, "body": b"".join(sent),
+                        "expires_at": time.time() + app_settings.CALENDAR_MAX_AGE_SECONDS})
+
+
+def _matches(request: Request, tag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == tag for candidate in candidates)
+
+
+########################### RESPONSE ###########################
+
+def feed_response(request: Request, db: Session, scope: str, owner_id: int, name: str,
+                  date_from: Optional[str], date_to: Optional[str]) -> Response:
+    start, end = window(date_from, date_to)
+    tag = etag(db, scope, owner_id, start, end)
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    if _matches(request, tag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    key = (scope, owner_id, start, end)
+    cached = feeds.get(key)
+    if cached is not None and cached["etag"] == tag:
+        return Response(cached["body"], media_type=MEDIA_TYPE, headers=headers)
+    return StreamingResponse(_stream(db, key, tag, name, scope, owner_id, start, end),
+                             media_type=MEDIA_TYPE, headers=headers)
@@ -0,0 +1,266 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException
+from sqlalchemy import delete, or_, select, text
+from sqlalchemy.dialects.postgresql import insert
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
+
+from . import models, oauth2, utils
+from .database import SessionLocal
+
+logger = logging.getLogger("app.idempotency")
+
+IdempotencyKey = models.IdempotencyKey.__table__
+
+# Create endpoints that honour the Idempotency-Key header
+IDEMPOTENT_PATHS = {"/users", "/patients", "/appointments", "/doctors", "/clinics", "/schedules"}
+
+
+def _header(scope, name: bytes) -> bytes:
+    for header_name, value in scope.get("headers", []):
+        if header_name == name:
+            return value
+    return b""
+
+
+# The client's key is only meaningful for the same caller and endpoint. The caller is the user id
+# of the bearer token, so a retry sent after the access token was refreshed is still recognized.
+def _scoped_key(scope, client_key: bytes) -> str:
+    subject = utils.bearer_subject(_header(scope, b"authorization").decode("latin-1")) or ""
+    digest = hashlib.sha256()
+    for part in (scope["method"].encode(), scope["path"].encode(), subject.encode(), client_key):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+# Only responses the handler produced are stored. Errors raised before it runs (401/403 from
+# authentication, 422 validation, 429 admission) and server errors are not, so a client that fixes
+# its token or body, or waits out a rate limit, can retry with the same key.
+def _stored(status_code: int) -> bool:
+    return 200 <= status_code < 300
+
+
+# A stored response is only replayed to a caller whose bearer token is still valid (not expired or
+# revoked), as the handler would have required; requests without one (registration) are replayed as is.
+def _token_rejected(scope) -> bool:
+    authorization = _header(scope, b"authorization").decode("latin-1")
+    if not authorization:
+        return False
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer":
+        return True
+    try:
+        oauth2.verify_access_token(token, HTTPException(status_code=401))
+    except HTTPException:
+        return True
+    return False
+
+
+# Bounded LRU of completed responses, so replays of hot keys never touch the database.
+class ResponseCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires_at"] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+########################### DATABASE STORE ###########################
+
+# Claim the key for this request. Exactly one concurrent request wins the INSERT; an expired
+# key, or one left in progress past the timeout by a crashed worker, can be claimed again.
+def claim(key: str, request_hash: str, ttl_seconds: int, in_progress_timeout: int):
+    now = datetime.now(timezone.utc)
+    statement = insert(IdempotencyKey).values(
+        key=key, request_hash=request_hash, created_at=now, expires_at=now + timedelta(seconds=ttl_seconds),
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[IdempotencyKey.c.key],
+        set_={"request_hash": statement.excluded.request_hash, "status_code": None, "content_type": None,
+              "response_body": None, "created_at": statement.excluded.created_at,
+              "expires_at": statement.excluded.expires_at},
+        where=or_(
+            IdempotencyKey.c.expires_at < now,
+            (IdempotencyKey.c.status_code.is_(None)) & (IdempotencyKey.c.created_at < now - timedelta(seconds=in_progress_timeout)),
+        ),
+    ).returning(IdempotencyKey.c.key)
+
+    db = SessionLocal()
+    try:
+        claimed = db.execute(statement).first() is not None
+        existing = None
+        if not claimed:
+            existing = db.execute(select(IdempotencyKey).where(IdempotencyKey.c.key == key)).first()
+        db.commit()
+        return claimed, existing
+    finally:
+        db.close()
+
+
+def complete(key: str, status_code: int, content_type: str, body: bytes):
+    db = SessionLocal()
+    try:
+        db.execute(IdempotencyKey.update().where(IdempotencyKey.c.key == key)
+                   .values(status_code=status_code, content_type=content_type, response_body=body))
+        db.commit()
+    finally:
+        db.close()
+
+
+# Frees the key of a response that is not stored (see _stored), so the client may retry with it
+def release(key: str):
+    db = SessionLocal()
+    try:
+        db.execute(delete(IdempotencyKey).where(IdempotencyKey.c.key == key))
+        db.commit()
+    finally:
+        db.close()
+
+
+def sweep_expired() -> int:
+    db = SessionLocal()
+    try:
+        deleted = db.execute(delete(IdempotencyKey).where(IdempotencyKey.c.expires_at < text("now()"))).rowcount
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+########################### ASGI MIDDLEWARE ###########################
+
+class IdempotencyMiddleware:
+    def __init__(self, app, ttl_seconds: int = 86400, cache_size: int = 10000,
+                 sweep_seconds: int = 300, in_progress_timeout: int = 60):
+        self.app = app
+        self.ttl_seconds = ttl_seconds
+        self.sweep_seconds = sweep_seconds
+        self.in_progress_timeout = in_progress_timeout
+        self.cache = ResponseCache(cache_size)
+        self.last_sweep = time.monotonic()
+
+    async def __call__(self, scope, receive, send):
+        client_key = _header(scope, b"idempotency-key") if scope["type"] == "http" else b""
+        if not client_key or scope["method"] != "POST" or scope["path"].rstrip("/") not in IDEMPOTENT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        # Buffer the request body so it can be hashed and then replayed to the handler
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        request_hash = hashlib.sha256(body).hexdigest()
+        key = _scoped_key(scope, client_key)
+
+        async def replay_receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        cached = self.cache.get(key)
+        if cached is None:
+            claimed, existing = await run_in_threadpool(claim, key, request_hash, self.ttl_seconds, self.in_progress_timeout)
+            if claimed:
+                await self._run_and_store(scope, replay_receive, send, key, request_hash)
+                await self._maybe_sweep()
+                return
+
+            if existing is None or existing.status_code is None:
+                response = JSONResponse({"detail": "A request with this Idempotency-Key is still in progress"},
+                                        status_code=409, headers={"Retry-After": "1"})
+                await response(scope, replay_receive, send)
+                return
+
+            cached = {"request_hash": existing.request_hash, "status_code": existing.status_code,
+                      "content_type": existing.content_type, "body": existing.response_body,
+                      "expires_at": existing.expires_at.timestamp()}
+            self.cache.put(key, cached)
+
+        if _token_rejected(scope):
+            response = JSONResponse({"detail": "Could not validate credentials"}, status_code=401,
+                                    headers={"WWW-Authenticate": "Bearer"})
+        elif cached["request_hash"] != request_hash:
+            response = JSONResponse({"detail": "Idempotency-Key was already used with a different request body"},
+                                    status_code=422)
+        else:
+            response = Response(cached["body"], status_code=cached["status_code"], media_type=cached["content_type"],
+                                headers={"Idempotent-Replayed": "true"})
+        await response(scope, replay_receive, send)
+
+    async def _run_and_store(self, scope, receive, send, key, request_hash):
+        status_code = 500
+        content_type = None
+        body_chunks = []
+
+        async def capture(message):
+            nonlocal status_code, content_type
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                for name, value in message.get("headers", []):
+                    if name == b"content-type":
+                        content_type = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                body_chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        except Exception:
+            await run_in_threadpool(release, key)
+            raise
+
+        if not _stored(status_code):
+            await run_in_threadpool(release, key)
+            return
+
+        response_body = b"".join(body_chunks)
+        await run_in_threadpool(complete, key, status_code, content_type, response_body)
+        self.cache.put(key, {"request_hash": request_hash, "status_code": status_code, "content_type": content_type,
+                             "body": response_body, "expires_at": time.time() + self.ttl_seconds})
+
+    # Expired keys are deleted at most once per sweep interval, piggybacking on a request
+    async def _maybe_sweep(self):
+        if time.monotonic() - self.last_sweep < self.sweep_seconds:
+            return
+        self.last_sweep = time.monotonic()
+        try:
+            deleted = await run_in_threadpool(sweep_expired)
+            logger.info("Swept %d expired idempotency keys", deleted)
+        except Exception:
+            logger.exception("Idempotency key sweep failed")
+
+
+def install(app, settings):
+    app.add_middleware(
+        IdempotencyMiddleware,
+        ttl_seconds=settings.IDEMPOTENCY_TTL_SECONDS,
+        cache_size=settings.IDEMPOTENCY_CACHE_SIZE,
+        sweep_seconds=settings.IDEMPOTENCY_SWEEP_SECONDS,
+        in_progress_timeout=settings.IDEMPOTENCY_IN_PROGRESS_TIMEOUT_SECONDS,
+    )
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+# Taken when app.main starts importing (this module is its first import), so the reported
+# import-to-ready time covers the imports, the engine and app setup and the lifespan startup.
+IMPORT_STARTED = time.perf_counter()
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from . import geo, search
+from .config import app_settings
+from .database import SessionLocal, engine, replica_engines, replica_set
+
+logger = logging.getLogger("app.lifecycle")
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+PROBE_PATHS = {"/healthz", "/readyz"}
+STARTUP_RETRY_SECONDS = 2.0
+
+
+# Process state shared by the lifespan, the drain middleware and the probes
+class State:
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+        self.in_flight = 0
+        self.import_seconds = None  # Import of app.main until the lifespan started
+        self.startup_seconds = None  # Lifespan startup (pool and cache warm-up, background services)
+        self.migration_head = None  # Newest alembic revision shipped with this code (None if unknown)
+        self.startup_hooks = []
+        self.shutdown_hooks = []
+
+
+state = State()
+
+
+# Background services started after warm-up and stopped before the pools are drained
+def register(start, stop):
+    state.startup_hooks.append(start)
+    state.shutdown_hooks.insert(0, stop)
+
+
+########################### STARTUP ###########################
+
+def _migration_head():
+    if not ALEMBIC_INI.exists():
+        return None
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option("script_location", str(ALEMBIC_INI.parent / "alembic"))
+    return ScriptDirectory.from_config(config).get_current_head()
+
+
+# Fill the engine's pool with pool_size open connections, so the first requests do not pay for
+# the TCP/TLS handshake and authentication
+def _warm_pool(target_engine):
+    connections = []
+    try:
+        for _ in range(target_engine.pool.size()):
+            connection = target_engine.connect()
+            connections.append(connection)
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def _warm_caches():
+    with SessionLocal() as db:
+        for catalog in search.catalogs.values():
+            catalog.current(db)
+        geo.locator.current(db)
+
+
+# Blocks until the primary accepts connections, as the old connect loop in database.py did
+async def _startup():
+    while True:
+        try:
+            await run_in_threadpool(_warm_pool, engine)
+            break
+        except SQLAlchemyError:
+            logger.exception("Database is not reachable yet, retrying in %.0fs", STARTUP_RETRY_SECONDS)
+            await asyncio.sleep(STARTUP_RETRY_SECONDS)
+
+    # A replica that is down only means reads go to the primary
+    for replica_engine in replica_engines:
+        try:
+            await run_in_threadpool(_warm_pool, replica_engine)
+        except SQLAlchemyError:
+            logger.warning("Could not warm the pool of read replica %s", replica_engine.url)
+
+    state.migration_head = await run_in_threadpool(_migration_head)
+    await run_in_threadpool(_warm_caches)
+
+    for start in state.startup_hooks:
+        await start()
+
+
+########################### SHUTDOWN ###########################
+
+# Wait for in-flight requests (new ones are refused while draining), stop the background
+# services, then close the pooled connections so the database sees a clean disconnect.
+async def _shutdown():
+    state.ready = False
+    state.draining = True
+
+    deadline = time.monotonic() + app_settings.SHUTDOWN_DRAIN_SECONDS
+    while state.in_flight and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    if state.in_flight:
+        logger.warning("Shutting down with %d requests still in flight", state.in_flight)
+
+    for stop in state.shutdown_hooks:
+        await stop()
+
+    for target_engine in (engine, *replica_engines):
+        target_engine.dispose()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    started = time.perf_counter()
+    state.import_seconds = started - IMPORT_STARTED
+    state.draining = False
+    await _startup()
+    state.startup_seconds = time.perf_counter() - started
+    state.ready = True
+    # Printed like the database connection message it replaces, so it shows without logging configured
+    print(f"healthcare-appointment API ready in {time.perf_counter() - IMPORT_STARTED:.3f}s "
+          f"(import {state.import_seconds:.3f}s, startup {state.startup_seconds:.3f}s)✅")
+    try:
+        yield
+    finally:
+        await _shutdown()
+
+
+########################### DRAINING ###########################
+
+# Counts in-flight HTTP requests and, once shutdown has started, refuses new ones with 503 and
+# Connection: close so clients and load balancers retry them on another worker.
+class DrainMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in PROBE_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        if state.draining:
+            response = JSONResponse({"detail": "Server is shutting down, please retry"}, status_code=503,
+                                    headers={"Retry-After": "1", "Connection": "close"})
+            await response(scope, receive, send)
+            return
+
+        state.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            state.in_flight -= 1
+
+
+########################### PROBES ###########################
+
+def _database_revision():
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT version_num FROM alembic_version")).scalar()
+
+
+# Liveness: the event loop is running; never touches the database
+async def healthz():
+    return {"status": "ok"}
+
+
+# Readiness: startup finished, not draining, a pooled connection works and the schema is at the
+# migration head this code was written for
+async def readyz():
+    body = {"status": "ready", "import_seconds": state.import_seconds, "startup_seconds": state.startup_seconds,
+            "in_flight": state.in_flight, "migration_head": state.migration_head}
+    if not state.ready:
+        body["status"] = "draining" if state.draining else "starting"
+        return JSONResponse(body, status_code=503)
+
+    try:
+        revision = await asyncio.wait_for(run_in_threadpool(_database_revision),
+                                          timeout=app_settings.READINESS_TIMEOUT_SECONDS)
+    except (SQLAlchemyError, asyncio.TimeoutError):
+        logger.exception("Readiness check failed")
+        body["status"] = "database_unavailable"
+        return JSONResponse(body, status_code=503)
+
+    body["database_revision"] = revision
+    body["replicas"] = replica_set.status()
+    if state.migration_head is not None and revision != state.migration_head:
+        body["status"] = "migrations_pending"
+        return JSONResponse(body, status_code=503)
+    return body
+
+
+def install(app, settings):
+    app.add_middleware(DrainMiddleware)
+    app.add_api_route("/healthz", healthz, methods=["GET"], include_in_schema=False)
+    app.add_api_route("/readyz", readyz, methods=["GET"], include_in_schema=False)
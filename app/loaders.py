@@ -0,0 +1,134 @@
+from typing import List, Optional
+
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .config import app_settings
+from .database import get_read_db
+
+# Batched lookups by id. The ?ids=1,2,3 variants of the list endpoints resolve all ids with one
+# IN query, and server-side code coalesces single-entity lookups through a request-scoped Loader:
+# keys are queued with load() and fetched together the first time any of their values is needed.
+
+
+# Parses ?ids=1,2,3 into unique ids in the order given
+def parse_ids(ids: str) -> List[int]:
+    try:
+        parsed = list(dict.fromkeys(int(part) for part in ids.split(",") if part.strip()))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="ids must be a comma separated list of integers")
+    if not parsed:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids must not be empty")
+    if len(parsed) > app_settings.BATCH_MAX_IDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {app_settings.BATCH_MAX_IDS} ids can be fetched at once")
+    return parsed
+
+
+# Rows of `query` whose `column` is in `ids`, in the order of `ids` (ids with no row are left out)
+def fetch_by_ids(query, column, ids: List[int]):
+    found = {getattr(row, column.key): row for row in query.filter(column.in_(ids)).all()}
+    return [found[key] for key in ids if key in found]
+
+
+########################### LOADERS ###########################
+
+# A value promised by Loader.load(); reading .value fetches every key queued so far
+class Deferred:
+    __slots__ = ("loader", "key")
+
+    def __init__(self, loader: "Loader", key):
+        self.loader = loader
+        self.key = key
+
+    @property
+    def value(self):
+        if self.key in self.loader.pending:
+            self.loader.dispatch()
+        return self.loader.cache[self.key]
+
+
+# Loads rows of one model by a unique column, coalescing queued keys into one IN query per
+# dispatch. Results (None for missing keys) are cached for the rest of the request. Like the
+# relationship loads they stand in for, loaders see soft-deleted rows (see app/purge.py), so an
+# appointment not yet purged keeps its doctor and clinic.
+class Loader:
+    def __init__(self, db: Session, column):
+        self.db = db
+        self.column = column
+        self.model = column.class_
+        self.cache = {}
+        self.pending = {}  # Keys to fetch, in insertion order
+
+    def load(self, key) -> Deferred:
+        if key not in self.cache:
+            self.pending[key] = None
+        return Deferred(self, key)
+
+    def load_many(self, keys) -> list:
+        for key in keys:
+            if key not in self.cache:
+                self.pending[key] = None
+        self.dispatch()
+        return [self.cache[key] for key in keys]
+
+    def get(self, key):
+        return self.load(key).value
+
+    def prime(self, key, value):
+        self.cache[key] = value
+        self.pending.pop(key, None)
+
+    def dispatch(self):
+        if not self.pending:
+            return
+        keys, self.pending = list(self.pending), {}
+        for start in range(0, len(keys), app_settings.BATCH_MAX_IDS):
+            chunk = keys[start:start + app_settings.BATCH_MAX_IDS]
+            query = self.db.query(self.model).filter(self.column.in_(chunk)).execution_options(include_deleted=True)
+            for row in query.all():
+                self.cache[getattr(row, self.column.key)] = row
+            for key in chunk:
+                self.cache.setdefault(key, None)
+
+
+# The loaders of one session (one per key column). Sessions are per request, so are the loaders.
+class Loaders:
+    def __init__(self, db: Session):
+        self.db = db
+        self.loaders = {}
+
+    def __getitem__(self, column) -> Loader:
+        loader = self.loaders.get(column)
+        if loader is None:
+            loader = self.loaders[column] = Loader(self.db, column)
+        return loader
+
+    # Fills many-to-one relationships (e.g. Appointment.patient) of `objects` with one query per
+    # relationship instead of one lazy load per distinct related row
+    def prefetch(self, objects, *relationships):
+        for relationship in relationships:
+            (local, remote), = relationship.property.local_remote_pairs
+            loader = self[inspect(relationship.property.mapper).get_property_by_column(remote).class_attribute]
+            local_key = inspect(relationship.parent).get_property_by_column(local).key
+            for obj in objects:
+                loader.load(getattr(obj, local_key))
+            loader.dispatch()
+            for obj in objects:
+                set_committed_value(obj, relationship.key, loader.cache[getattr(obj, local_key)])
+        return objects
+
+
+def for_session(db: Session) -> Loaders:
+    loaders = db.info.get("loaders")
+    if loaders is None:
+        loaders = db.info["loaders"] = Loaders(db)
+    return loaders
+
+
+# Dependency: the loaders of the request's read session
+def get_loaders(db: Session = Depends(get_read_db)) -> Loaders:
+    return for_session(db)
@@ -1,23 +1,63 @@
-# Import required modules and components
+# Import required modules and components (lifecycle first: it records when the import started)
+from . import lifecycle
 from fastapi import FastAPI
-from . import models
+from . import models, admission, audit, availability, deadlines, idempotency, profiler, purge, revocation, sqlprofile, \
+    utilization
 from .config import app_settings
-from .database import engine
+from .database import engine, replica_engines
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import doctors, users, auth, patients, clinics, schedules, appointments
+from .routers import doctors, users, auth, patients, clinics, schedules, appointments, admission as admission_router, \
+    availability as availability_router, audit as audit_router, purge_jobs, stats, search, waitlist
 
 # Create database tables based on models defined in 'models'
 # models.Base.metadata.create_all(bind=engine)
 
-# Create a FastAPI application instance
-app = FastAPI()
+# Create a FastAPI application instance; the lifespan warms the pools and caches before traffic is
+# accepted and drains in-flight requests and connections on shutdown
+app = FastAPI(lifespan=lifecycle.lifespan)
 
+# Replay stored responses for retried create requests carrying an Idempotency-Key header
+idempotency.install(app, app_settings)
+
+# Per-request SQL profiling (opt-in via SQL_PROFILING_ENABLED)
+sqlprofile.install(app, [engine, *replica_engines], app_settings)
+
+# On-demand (admin) and sampled request profiling
+profiler.install(app, app_settings)
+
+# Keep this worker's copy of the revoked tokens in sync with the revoked_tokens table
+revocation.install(app, app_settings)
+
+# Write audit records of committed changes in batches from a background task
+audit.install(app, app_settings)
+
+# Purge deleted doctors, clinics and users in the background, in short chunked transactions
+purge.install(app, app_settings)
+
+# Fold the booked seat changes appended by bookings into the utilization summary
+utilization.install(app, app_settings)
+
+# Push slot availability changes to WebSocket subscribers (one LISTEN connection per worker)
+availability.install(app, app_settings)
+
+# /healthz and /readyz probes, and refusal of new requests while shutting down
+lifecycle.install(app, app_settings)
+
+# Per-route request deadlines, enforced on the database as statement_timeout
+deadlines.install(app, app_settings)
+
+# Rate limits and concurrency caps; the outermost middleware but for CORS, so it rejects before any other work
+admission.install(app, app_settings)
+
+# Added last so it wraps every other middleware: their rejections (429, 503) carry the CORS headers too,
+# and browsers can read Retry-After from them
 app.add_middleware(
     CORSMiddleware,
     allow_origins="*",
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
 ###################### INCLUDE ROUTERS * #####################
@@ -45,6 +85,27 @@ app.include_router(schedules.router)
 # Include the 'appointments' router for appointment scheduling endpoints
 app.include_router(appointments.router)
 
+# Include the 'waitlist' router for the appointment waitlist
+app.include_router(waitlist.router)
+
+# Include the 'stats' router for utilization statistics
+app.include_router(stats.router)
+
+# Include the 'search' router for search and autocomplete endpoints
+app.include_router(search.router)
+
+# Include the 'audit' router for the audit log
+app.include_router(audit_router.router)
+
+# Include the 'purge_jobs' router for the progress of purges of deleted records
+app.include_router(purge_jobs.router)
+
+# Include the 'admission' router for admission control metrics
+app.include_router(admission_router.router)
+
+# Include the 'availability' router for the slot availability WebSocket
+app.include_router(availability_router.router)
+
 # Define a root endpoint that responds to HTTP GET requests at the base URL ("/")
 
 @app.get("/")
@@ -1,4 +1,6 @@
-from sqlalchemy import ARRAY, TIMESTAMP, Column, ForeignKey, Integer, String, text
+from sqlalchemy import ARRAY, TIMESTAMP, BigInteger, CheckConstraint, Column, Float, ForeignKey, Index, Integer, LargeBinary, String, \
+    text
+from sqlalchemy.dialects.postgresql import JSONB
 from .database import Base
 from sqlalchemy.orm import relationship
 
@@ -6,7 +8,7 @@ from sqlalchemy.orm import relationship
 class Appointment(Base):
     __tablename__ = "appointments"
 
-    appointments_id = Column(Integer, primary_key=True, index=True, nullable=False)  # Unique identifier for the appointment
+    appointments_id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)  # Unique identifier for the appointment
     patient_id = Column(Integer, nullable=False)
     doctor_id = Column(Integer, nullable=False)
     clinic_id = Column(Integer, nullable=False)
@@ -21,10 +23,31 @@ class Appointment(Base):
     doctor = relationship("Doctor")
     clinic = relationship("Clinic")
 
-    appointment_date = Column(String, nullable=False) # appointment date format [ YY-MM-DD - hh:mm:ss ]
+    appointment_date = Column(String, primary_key=True, nullable=False) # appointment date format [ YYYY-MM-DD ], partition key
     appointment_time = Column(String, nullable=False) # appointment time format [ HH:MM AM/PM ]
     appointment_status = Column(String, nullable=False, default='booked')  # appointment status
     created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Creation timestamp
+    version = Column(Integer, server_default=text("1"), nullable=False)  # Incremented on every update (optimistic concurrency)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Set by a trigger on every update
+
+    # The table is range partitioned by month on appointment_date (see app/partitions.py), so the
+    # date has to be part of the table's primary key; the ORM still identifies rows by appointments_id.
+    __table_args__ = (
+        Index("ix_appointments_booked_slot", "doctor_id", "appointment_date", "appointment_time",
+              postgresql_where=text("appointment_status = 'booked'")),  # Slot conflict checks, active bookings only
+        Index("ix_appointments_clinic_calendar", "clinic_id", "appointment_date",
+              postgresql_where=text("appointment_status = 'booked'")),  # Clinic calendar feeds (doctor feeds use the slot index)
+        Index("ix_appointments_user_calendar", "user_fkey", "appointment_date",
+              postgresql_where=text("appointment_status = 'booked'")),  # User calendar feeds
+        # Foreign keys, so the purger finds a deleted record's appointments in chunks and the final
+        # cascade of the parent row does not scan every partition
+        Index("ix_appointments_doctor_fkey", "doctor_fkey"),
+        Index("ix_appointments_clinic_fkey", "clinic_fkey"),
+        Index("ix_appointments_patient_fkey", "patient_fkey"),
+        Index("ix_appointments_user_fkey", "user_fkey"),
+        {"postgresql_partition_by": "RANGE (appointment_date)"},
+    )
+    __mapper_args__ = {"primary_key": [appointments_id]}
 
 
 # Class representing doctor availability schedule
@@ -37,6 +60,7 @@ class DoctorSchedule(Base):
     clinic_id = Column(Integer, nullable=False)  # ID of the associated clinic
     date = Column(String, nullable=False)  # Date of the availability schedule
     slots = Column(ARRAY(String), nullable=False)  # Time slots for appointments
+    capacity = Column(Integer, server_default=text("1"), nullable=False)  # Appointments bookable per slot
 
     doctor_fkey = Column(Integer, ForeignKey("doctors.id", ondelete="CASCADE"), nullable=False)
     clinic_fkey = Column(Integer, ForeignKey("clinics.id", ondelete="CASCADE"), nullable=False)
@@ -45,6 +69,15 @@ class DoctorSchedule(Base):
     clinic = relationship("Clinic")
     
     created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Creation timestamp
+    version = Column(Integer, server_default=text("1"), nullable=False)  # Incremented on every update (optimistic concurrency)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), index=True, nullable=False)  # Set by a trigger on every update, drives ?since= sync
+
+    __table_args__ = (
+        Index("ix_schedules_doctor_id_date", "doctor_id", "date"),  # Doctor and clinic calendar feeds
+        Index("ix_schedules_clinic_id_date", "clinic_id", "date"),
+        Index("ix_schedules_doctor_fkey", "doctor_fkey"),  # Purges of deleted doctors and clinics
+        Index("ix_schedules_clinic_fkey", "clinic_fkey"),
+    )
 
 
 # Class representing user information
@@ -57,6 +90,9 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)  # User's email address
     role = Column(String, index=True, nullable=False)  # Role of the user (e.g., patient, doctor, admin)
     created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Creation timestamp
+    version = Column(Integer, server_default=text("1"), nullable=False)  # Incremented on every update (optimistic concurrency)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Set by a trigger on every update
+    deleted_at = Column(TIMESTAMP(timezone=True), nullable=True)  # Set by DELETE; the row is hidden from reads until the purger removes it (app/purge.py)
 
 
 # Class representing patient information
@@ -68,8 +104,15 @@ class Patient(Base):
     dob = Column(String, index=True, nullable=False)  # Date of birth
     gender = Column(String, index=True, nullable=False)  # Gender of the patient
     phone = Column(String, index=True, nullable=False)  # Contact phone number
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)  # Associated user ID
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=False)  # Associated user ID
     created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Creation timestamp
+    version = Column(Integer, server_default=text("1"), nullable=False)  # Incremented on every update (optimistic concurrency)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Set by a trigger on every update
+
+    __table_args__ = (
+        Index("ix_patients_name_trgm", "name", postgresql_using="gin",
+              postgresql_ops={"name": "gin_trgm_ops"}),  # Partial and fuzzy name search (/search/patients)
+    )
 
 
 # Class representing doctor information
@@ -80,6 +123,16 @@ class Doctor(Base):
     name = Column(String, unique=True, index=True, nullable=False)  # Doctor's name
     specialty = Column(String, index=True, nullable=False)  # Medical specialty of the doctor
     created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Creation timestamp
+    version = Column(Integer, server_default=text("1"), nullable=False)  # Incremented on every update (optimistic concurrency)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), index=True, nullable=False)  # Set by a trigger on every update, drives ?since= sync
+    deleted_at = Column(TIMESTAMP(timezone=True), nullable=True)  # Set by DELETE; the row is hidden from reads until the purger removes it (app/purge.py)
+
+    __table_args__ = (
+        Index("ix_doctors_name_trgm", "name", postgresql_using="gin",
+              postgresql_ops={"name": "gin_trgm_ops"}),  # Partial and fuzzy name search (/search/doctors)
+        Index("ix_doctors_specialty_trgm", "specialty", postgresql_using="gin",
+              postgresql_ops={"specialty": "gin_trgm_ops"}),
+    )
 
 
 # Class representing clinic information
@@ -90,4 +143,181 @@ class Clinic(Base):
     name = Column(String, unique=True, index=True, nullable=False)  # Clinic's name
     address = Column(String, nullable=False)  # Address of the clinic
     phone = Column(String, unique=True, nullable=False)  # Contact phone number for the clinic
-    created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Creation timestamp
\ No newline at end of file
+    latitude = Column(Float, nullable=True)  # WGS84 degrees; clinics without coordinates are not in /clinics/nearest
+    longitude = Column(Float, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Creation timestamp
+    version = Column(Integer, server_default=text("1"), nullable=False)  # Incremented on every update (optimistic concurrency)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), index=True, nullable=False)  # Set by a trigger on every update, drives ?since= sync
+    deleted_at = Column(TIMESTAMP(timezone=True), nullable=True)  # Set by DELETE; the row is hidden from reads until the purger removes it (app/purge.py)
+
+    __table_args__ = (
+        Index("ix_clinics_name_trgm", "name", postgresql_using="gin",
+              postgresql_ops={"name": "gin_trgm_ops"}),  # Partial and fuzzy name search (/search/clinics)
+        CheckConstraint("(latitude IS NULL) = (longitude IS NULL) AND latitude BETWEEN -90 AND 90 "
+                        "AND longitude BETWEEN -180 AND 180", name="ck_clinics_coordinates"),
+    )
+
+
+# Class representing a stored response for an Idempotency-Key header
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True, nullable=False)  # Hash of the client key scoped to method, path and credentials
+    request_hash = Column(String, nullable=False)  # Hash of the request body, to detect a key reused for another request
+    status_code = Column(Integer, nullable=True)  # NULL while the original request is still in progress
+    content_type = Column(String, nullable=True)
+    response_body = Column(LargeBinary, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Creation timestamp
+    expires_at = Column(TIMESTAMP(timezone=True), index=True, nullable=False)  # Swept after this time
+
+
+# Class representing a deleted record of a synced table, so ?since= syncs can report deletions
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+
+    id = Column(BigInteger, primary_key=True, nullable=False)
+    table_name = Column(String, nullable=False)  # Table the record was deleted from
+    record_id = Column(Integer, nullable=False)  # Primary key of the deleted record
+    deleted_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Written by a delete trigger
+
+    __table_args__ = (
+        Index("ix_tombstones_table_deleted_at", "table_name", "deleted_at"),
+    )
+
+
+# Class representing a patient waiting for a slot with a doctor on a date. Entries are matched to a
+# freed or newly scheduled slot through the partial index below: the queue of one doctor, date and
+# time window is read in priority order from its first index entry, however long it is.
+class WaitlistEntry(Base):
+    __tablename__ = "waitlist_entries"
+
+    id = Column(BigInteger, primary_key=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)  # Who joined (owns the booking)
+    patient_id = Column(Integer, ForeignKey("patients.id", ondelete="CASCADE"), nullable=False)
+    doctor_id = Column(Integer, ForeignKey("doctors.id", ondelete="CASCADE"), nullable=False)
+    date = Column(String, nullable=False)  # Date wanted [ YYYY-MM-DD ]
+    time_window = Column(String, nullable=False)  # 'morning', 'afternoon', 'evening' or 'any'
+    priority = Column(Integer, server_default=text("0"), nullable=False)  # Higher is served first, then first come
+    status = Column(String, server_default=text("'waiting'"), nullable=False)  # 'waiting' or 'booked'
+    appointment_id = Column(Integer, nullable=True)  # The appointment booked for the entry
+    created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)  # Creation timestamp
+    booked_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_waitlist_entries_queue", "doctor_id", "date", "time_window", text("priority DESC"), "id",
+              postgresql_where=text("status = 'waiting'")),
+        Index("ix_waitlist_entries_waiting_patient", "patient_id", "doctor_id", "date", "time_window", unique=True,
+              postgresql_where=text("status = 'waiting'")),  # A patient waits at most once per queue
+        Index("ix_waitlist_entries_user_id", "user_id"),
+        Index("ix_waitlist_entries_patient_id", "patient_id"),  # Purges of deleted users and doctors
+        Index("ix_waitlist_entries_doctor_id", "doctor_id"),
+    )
+
+
+# Class representing a revoked token (token_id set) or all tokens of a user issued before revoked_at
+# (user_id set, on logout everywhere, role change or deletion). Rows are deleted once the tokens expire.
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    id = Column(BigInteger, primary_key=True, nullable=False)
+    token_id = Column(String, index=True, nullable=True)  # The jti claim of the revoked token
+    user_id = Column(Integer, nullable=True)  # Subject whose earlier tokens are all revoked
+    revoked_at = Column(TIMESTAMP(timezone=True), index=True, nullable=False)  # Set by the API, compared with the iat claim
+    expires_at = Column(TIMESTAMP(timezone=True), index=True, nullable=False)  # When the revoked tokens expire anyway
+
+    __table_args__ = (
+        CheckConstraint("(token_id IS NULL) <> (user_id IS NULL)", name="ck_revoked_tokens_target"),
+    )
+
+
+# Class representing one bookable slot of a schedule and its seat counter. Rows are written by a
+# statement trigger on schedules; booked_count by a statement trigger on appointments, which adds
+# the seat deltas of every write (see app/booking.py), so a booking never counts appointments.
+class ScheduleSlot(Base):
+    __tablename__ = "schedule_slots"
+
+    doctor_id = Column(Integer, primary_key=True, nullable=False)
+    date = Column(String, primary_key=True, nullable=False)
+    slot_time = Column(String, primary_key=True, nullable=False)  # One of the schedule's slots
+    clinic_id = Column(Integer, nullable=False)
+    schedule_id = Column(Integer, ForeignKey("schedules.schedule_id", ondelete="CASCADE"), index=True, nullable=False)
+    capacity = Column(Integer, nullable=False)  # Copied from the schedule
+    booked_count = Column(Integer, server_default=text("0"), nullable=False)  # Appointments with status 'booked'
+
+    __table_args__ = (
+        CheckConstraint("booked_count >= 0", name="ck_schedule_slots_booked_count"),
+        Index("ix_schedule_slots_clinic_id_date", "clinic_id", "date"),  # Free slots per clinic (/clinics/nearest)
+    )
+
+
+# Class representing one audited change: who created, updated or deleted which record. Rows are
+# written in batches by the background writer in app/audit.py, never by the request that made the change.
+class AuditLog(Base):
+    __tablename__ = "audit_log"
+
+    id = Column(BigInteger, primary_key=True, nullable=False)
+    occurred_at = Column(TIMESTAMP(timezone=True), nullable=False)  # Commit time of the change
+    user_id = Column(Integer, nullable=True)  # Who made the change (no foreign key: the trail outlives users); NULL for the system
+    action = Column(String, nullable=False)  # 'create', 'update', 'delete' or 'purge' (one chunk of a purge job)
+    table_name = Column(String, nullable=False)
+    record_id = Column(Integer, nullable=False)
+    changes = Column(JSONB, nullable=False)  # Values on create and delete, {column: [old, new]} on update, {table: rows} on purge
+
+    __table_args__ = (
+        Index("ix_audit_log_record", "table_name", "record_id", "id"),  # History of one record
+        Index("ix_audit_log_user_id", "user_id", "id"),  # Changes made by one user
+        Index("ix_audit_log_occurred_at", "occurred_at"),
+    )
+
+
+# Class representing the background removal of a deleted doctor, clinic or user. The DELETE request
+# only hides the record (deleted_at) and queues a job; the purger (app/purge.py) then deletes the
+# rows that depend on it in small chunks, one short transaction each, and finally the record itself.
+class PurgeJob(Base):
+    __tablename__ = "purge_jobs"
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    table_name = Column(String, nullable=False)  # 'doctors', 'clinics' or 'users'
+    record_id = Column(Integer, nullable=False)
+    status = Column(String, server_default=text("'pending'"), nullable=False)  # 'pending', 'running', 'done' or 'failed'
+    step = Column(String, nullable=True)  # Table the purger is currently deleting from
+    deleted_rows = Column(JSONB, server_default=text("'{}'::jsonb"), nullable=False)  # Rows deleted so far, per step
+    requested_by = Column(Integer, nullable=True)  # User who deleted the record
+    attempts = Column(Integer, server_default=text("0"), nullable=False)  # Runs that ended in an error
+    error = Column(String, nullable=True)  # Last error
+    lease_owner = Column(String, nullable=True)  # Purger running the job ...
+    leased_until = Column(TIMESTAMP(timezone=True), nullable=True)  # ... renewed with every chunk; another worker takes over once it lapses
+    created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)
+    started_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    finished_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_purge_jobs_open", "id", postgresql_where=text("status IN ('pending', 'running')")),  # Jobs to claim
+    )
+
+
+# Class representing booked vs. available slots per doctor, clinic and day. Kept up to date by
+# statement triggers on schedules and, through utilization_deltas, on appointments, so statistics
+# never scan those tables.
+class UtilizationDaily(Base):
+    __tablename__ = "utilization_daily"
+
+    doctor_id = Column(Integer, primary_key=True, nullable=False)
+    clinic_id = Column(Integer, primary_key=True, nullable=False)
+    date = Column(String, primary_key=True, index=True, nullable=False)
+    available_slots = Column(Integer, server_default=text("0"), nullable=False)  # Bookable seats (slots x capacity) for the day
+    booked_slots = Column(Integer, server_default=text("0"), nullable=False)  # Appointments with status 'booked'
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)
+
+
+# Class representing booked seat changes not yet folded into utilization_daily. The appointments
+# trigger only appends here, so bookings take no lock on a shared summary row.
+class UtilizationDelta(Base):
+    __tablename__ = "utilization_deltas"
+
+    id = Column(BigInteger, primary_key=True, nullable=False)
+    doctor_id = Column(Integer, nullable=False)
+    clinic_id = Column(Integer, nullable=False)
+    date = Column(String, nullable=False)
+    booked_slots = Column(Integer, nullable=False)  # Change in booked appointments
+    created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False)
@@ -0,0 +1,138 @@
+import enum
+from typing import Any, NamedTuple, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, false, inspect, literal, select, true, update
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+
+class MutationOutcome(enum.Enum):
+    OK = "ok"
+    NOT_FOUND = "not_found"
+    FORBIDDEN = "forbidden"
+    VERSION_CONFLICT = "version_conflict"
+
+
+# Result of a single statement mutation: the outcome, the row after an update (attached to the
+# session) and the row as it was before the update or delete (a detached, read-only copy).
+class MutationResult(NamedTuple):
+    outcome: MutationOutcome
+    instance: Any = None
+    previous: Any = None
+
+
+# Permission predicate evaluated inside the statement: admins (allowed=True) may always write,
+# everybody else only when `owner_column` matches `owner_id`.
+def _permission(allowed: bool, owner_column, owner_id):
+    if allowed:
+        return true()
+    if owner_column is None:
+        return false()
+    return owner_column == owner_id
+
+
+# The row matching the primary key; a soft-deleted row (deleted_at set) counts as not found
+def _match(table, pk, ident):
+    if "deleted_at" in table.c:
+        return [pk == ident, table.c.deleted_at.is_(None)]
+    return [pk == ident]
+
+
+# The row as it was before the statement, plus whether the caller may modify it. Reading it in a
+# sibling CTE lets a single round trip tell "not found", "forbidden" and "stale version" apart.
+def _target(table, pk, ident, permission):
+    return select(
+        permission.label("target_allowed"),
+        *[column.label(f"previous_{column.name}") for column in table.c],
+    ).where(*_match(table, pk, ident)).cte("target")
+
+
+# Result columns are looked up by name: the compiled statement is cached, and Column objects of the
+# CTEs built for this call need not match those the cached statement was compiled from.
+def _instance(model, row, column_key):
+    return model(**{attr.key: row._mapping[column_key(attr.columns[0])] for attr in inspect(model).column_attrs})
+
+
+def _outcome(row, modified_pk) -> MutationOutcome:
+    if row is None:
+        return MutationOutcome.NOT_FOUND
+    if not row.target_allowed:
+        return MutationOutcome.FORBIDDEN
+    if row._mapping[modified_pk] is None:
+        return MutationOutcome.VERSION_CONFLICT
+    return MutationOutcome.OK
+
+
+# UPDATE ... WHERE pk = :ident AND <permission> [AND version = :expected] RETURNING *, in one statement.
+# The version column is bumped on every successful update. On success the returned row is attached
+# to the session as a clean persistent instance, so no refresh query is needed.
+def update_returning(db: Session, model, ident, values: dict, *, allowed: bool = True, owner_column=None,
+                     owner_id=None, expected_version: Optional[int] = None) -> MutationResult:
+    table = model.__table__
+    pk = inspect(model).primary_key[0]
+    permission = _permission(allowed, owner_column, owner_id)
+    target = _target(table, pk, ident, permission)
+
+    conditions = [*_match(table, pk, ident), permission]
+    if expected_version is not None:
+        conditions.append(table.c.version == expected_version)
+
+    updated = (update(table).where(*conditions)
+               .values(**values, version=table.c.version + 1)
+               .returning(*table.c)
+               .cte("updated"))
+    row = db.execute(select(target, updated).select_from(target.outerjoin(updated, literal(True)))).first()
+
+    outcome = _outcome(row, pk.name)
+    if outcome is not MutationOutcome.OK:
+        return MutationResult(outcome)
+
+    instance = _instance(model, row, lambda column: column.name)
+    make_transient_to_detached(instance)
+    previous = _instance(model, row, lambda column: f"previous_{column.name}")
+    return MutationResult(outcome, db.merge(instance, load=False), previous)
+
+
+# DELETE ... WHERE pk = :ident AND <permission> [AND version = :expected] RETURNING pk, in one statement.
+def delete_returning(db: Session, model, ident, *, allowed: bool = True, owner_column=None, owner_id=None,
+                     expected_version: Optional[int] = None) -> MutationResult:
+    table = model.__table__
+    pk = inspect(model).primary_key[0]
+    permission = _permission(allowed, owner_column, owner_id)
+    target = _target(table, pk, ident, permission)
+
+    conditions = [*_match(table, pk, ident), permission]
+    if expected_version is not None:
+        conditions.append(table.c.version == expected_version)
+
+    deleted = delete(table).where(*conditions).returning(pk).cte("deleted")
+    row = db.execute(select(target, deleted).select_from(target.outerjoin(deleted, literal(True)))).first()
+
+    outcome = _outcome(row, pk.name)
+    if outcome is not MutationOutcome.OK:
+        return MutationResult(outcome)
+    return MutationResult(outcome, previous=_instance(model, row, lambda column: f"previous_{column.name}"))
+
+
+# Turn an unsuccessful outcome into the matching HTTP error
+def check_outcome(outcome: MutationOutcome, not_found_detail: str, forbidden_detail: str):
+    if outcome is MutationOutcome.NOT_FOUND:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=not_found_detail)
+
+    if outcome is MutationOutcome.FORBIDDEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=forbidden_detail)
+
+    if outcome is MutationOutcome.VERSION_CONFLICT:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                            detail="The record was modified by another request, reload it and try again")
+
+
+# Parse an optional If-Match header carrying the version the client last saw (e.g. 3 or "3")
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    if if_match is None:
+        return None
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="If-Match must contain the record version")
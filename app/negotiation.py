@@ -0,0 +1,103 @@
+from typing import Optional
+
+import msgpack
+from fastapi.routing import APIRoute
+from starlette.responses import JSONResponse, Response
+
+# Accept based response formats for the API routers. The endpoint's response_model validates and
+# serializes the result exactly as for JSON; only the final encoding of that serialized content
+# differs, so every format carries the same fields as the schemas in app/schemas.py.
+
+MSGPACK = "application/msgpack"
+COLUMNAR_MSGPACK = "application/vnd.healthcare.columnar+msgpack"
+COLUMNAR_JSON = "application/vnd.healthcare.columnar+json"
+
+
+# Lists of objects become one array per field: [{"id": 1, ...}, {"id": 2, ...}] is sent as
+# {"id": [1, 2], ...}. In an object (e.g. a delta sync response) each list of objects is converted.
+def columnar(content):
+    if isinstance(content, list):
+        if not content or not all(isinstance(row, dict) for row in content):
+            return content
+        fields = dict.fromkeys(key for row in content for key in row)
+        return {field: [row.get(field) for row in content] for field in fields}
+    if isinstance(content, dict):
+        return {key: columnar(value) if isinstance(value, list) else value for key, value in content.items()}
+    return content
+
+
+class MsgPackResponse(Response):
+    media_type = MSGPACK
+
+    def render(self, content) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+
+class ColumnarMsgPackResponse(MsgPackResponse):
+    media_type = COLUMNAR_MSGPACK
+
+    def render(self, content) -> bytes:
+        return super().render(columnar(content))
+
+
+class ColumnarJSONResponse(JSONResponse):
+    media_type = COLUMNAR_JSON
+
+    def render(self, content) -> bytes:
+        return super().render(columnar(content))
+
+
+FORMATS = {
+    MSGPACK: MsgPackResponse,
+    "application/x-msgpack": MsgPackResponse,
+    COLUMNAR_MSGPACK: ColumnarMsgPackResponse,
+    COLUMNAR_JSON: ColumnarJSONResponse,
+}
+
+
+# The supported media type the client prefers, or None for the JSON default. Anything not
+# offered (including */* and a missing header) gets JSON, as before negotiation was added.
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    if not accept:
+        return None
+    best, best_quality = None, 0.0
+    for entry in accept.split(","):
+        media_type, *params = [part.strip() for part in entry.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = media_type.lower()
+        if media_type == "application/json" and quality > best_quality:
+            best, best_quality = None, quality
+        elif media_type in FORMATS and quality > best_quality:
+            best, best_quality = media_type, quality
+    return best
+
+
+# Route class for the API routers: one request handler is built per format, with that format's
+# response class, and each request is dispatched on its Accept header. Responses an endpoint
+# builds itself and error responses are unaffected.
+class NegotiatedRoute(APIRoute):
+    def get_route_handler(self):
+        default_handler = super().get_route_handler()
+        default_class = self.response_class
+        handlers = {}
+        try:
+            for media_type, response_class in FORMATS.items():
+                self.response_class = response_class
+                handlers[media_type] = super().get_route_handler()
+        finally:
+            self.response_class = default_class
+
+        async def negotiated_handler(request) -> Response:
+            handler = handlers.get(negotiate(request.headers.get("accept")), default_handler)
+            response = await handler(request)
+            response.headers.append("Vary", "Accept")
+            return response
+
+        return negotiated_handler
@@ -1,63 +1,111 @@
-from datetime import datetime, timedelta
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
 from fastapi import Depends, HTTPException, status
-from . import schemas, models
-from . database import get_db
+from . import schemas
+from .config import app_settings
+from .revocation import revocations
 from fastapi.security import OAuth2PasswordBearer
 
 # Define the secret key for encoding and decoding JWT tokens.
-SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
+SECRET_KEY = app_settings.SECRET_KEY
 
 # Specify the algorithm used for encoding and decoding JWT tokens.
-ALGORITHM = "HS256"
+ALGORITHM = app_settings.ALGORITHM
 
-# Define the expiration time for access tokens, in minutes.
-ACCESS_TOKEN_EXPIRE_MINUTES = 120
+# Define the expiration time for access tokens, in minutes. Access tokens are short lived: they
+# are accepted without a database lookup, so a role change reaches them through revocation only.
+ACCESS_TOKEN_EXPIRE_MINUTES = app_settings.ACCESS_TOKEN_EXPIRE_MINUTES
+
+# Refresh tokens (returned by POST /login) get new access tokens from POST /login/refresh.
+REFRESH_TOKEN_EXPIRE_DAYS = app_settings.REFRESH_TOKEN_EXPIRE_DAYS
+
+# Feed tokens (from POST /login/calendar-token) authorize the .ics feeds only, passed as ?token=
+# by calendar apps that cannot send an Authorization header. They are revoked with the user's tokens.
+CALENDAR_TOKEN_EXPIRE_DAYS = app_settings.CALENDAR_TOKEN_EXPIRE_DAYS
 
 # Create an OAuth2 scheme for password bearer token authentication.
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-# Function to create an access token by encoding a payload with expiration time.
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+# The same scheme for endpoints that also accept another credential; a missing header is not an error here.
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
+
+
+# Encodes the claims of a user's token: subject (user id), role, token type, a unique token id
+# (jti, used for revocation), issue and expiry time.
+def _create_token(user_id: int, role: str, token_type: str, lifetime_seconds: float):
+    issued_at = time.time()
+    claims = {"sub": str(user_id), "role": role, "type": token_type, "jti": uuid.uuid4().hex,
+              "iat": issued_at, "exp": issued_at + lifetime_seconds}
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+
+# Function to create an access token carrying the claims routers authorize with.
+def create_access_token(user_id: int, role: str):
+    return _create_token(user_id, role, "access", ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
 
-# Function to verify an access token and extract user data from it.
-def verify_access_token(token: str, credentials_exception):
+# Function to create a refresh token; it is only accepted by the refresh and logout endpoints.
+def create_refresh_token(user_id: int, role: str):
+    return _create_token(user_id, role, "refresh", REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+
+
+# Function to create a feed token for the calendar endpoints.
+def create_calendar_token(user_id: int, role: str):
+    return _create_token(user_id, role, "calendar", CALENDAR_TOKEN_EXPIRE_DAYS * 86400)
+
+
+# Function to verify a token of the given type and extract its claims; revoked tokens are rejected.
+def verify_token(token: str, token_type: str, credentials_exception) -> schemas.TokenData:
     try:
         # Decode the JWT token using the provided secret key and algorithm.
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("username")
-        
-        # If username is missing in the token, raise an exception.
-        if username is None:
+        if payload.get("type") != token_type:
             raise credentials_exception
-        
-        # Create a TokenData object containing the username.
-        token_data = schemas.TokenData(username=username)
-    except JWTError:
-        # If decoding fails, raise an exception.
+        token_data = schemas.TokenData(id=payload["sub"], role=payload["role"], token_id=payload["jti"],
+                                       issued_at=payload["iat"], expires_at=payload["exp"])
+    except (JWTError, KeyError, ValueError):
+        # If decoding fails or a claim is missing, raise an exception.
+        raise credentials_exception
+
+    if revocations.is_revoked(token_data.token_id, token_data.id, token_data.issued_at):
         raise credentials_exception
     return token_data
 
-# Function to get the current user based on the provided access token and database session.
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+
+def verify_access_token(token: str, credentials_exception) -> schemas.TokenData:
+    return verify_token(token, "access", credentials_exception)
+
+
+def token_expiry(token_data: schemas.TokenData) -> datetime:
+    return datetime.fromtimestamp(token_data.expires_at, timezone.utc)
+
+
+# Function to get the current user (id, role and token id) from the access token alone; no
+# database session is opened, so authorization costs a signature check and a filter lookup.
+def get_current_user(token: str = Depends(oauth2_scheme)) -> schemas.TokenData:
     # Create an exception to handle unauthorized access.
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
-    # Verify the access token and get token data (username).
-    token = verify_access_token(token, credentials_exception)
-    
-    # Query the database to get the user associated with the username.
-    user = db.query(models.User).filter(models.User.username == token.username).first()
-    
-    # Return the user object.
-    return user
+    return verify_access_token(token, credentials_exception)
+
+
+# Function to get the current user of a calendar feed request: an access token in the
+# Authorization header, or a feed token in the `token` query parameter.
+def get_calendar_user(token: Optional[str] = None,
+                      bearer: Optional[str] = Depends(optional_oauth2_scheme)) -> schemas.TokenData:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    if bearer is not None:
+        return verify_access_token(bearer, credentials_exception)
+    if token is not None:
+        return verify_token(token, "calendar", credentials_exception)
+    raise credentials_exception
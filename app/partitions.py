@@ -0,0 +1,174 @@
+"""
+Maintenance of the monthly partitions of the appointments table.
+
+    python -m app.partitions maintain            # create partitions ahead, archive expired ones
+    python -m app.partitions maintain --drop     # drop expired partitions instead of archiving them
+    python -m app.partitions status
+
+`appointments` is range partitioned on appointment_date (ISO "YYYY-MM-DD" strings) with one
+partition per month named appointments_pYYYY_MM, plus appointments_default for dates outside
+every monthly range. Run `maintain` from cron (daily is plenty): it creates the partitions for
+the current month and APPOINTMENT_PARTITION_MONTHS_AHEAD months ahead, and detaches partitions
+that ended more than APPOINTMENT_RETENTION_MONTHS months ago, moving them to the
+APPOINTMENT_ARCHIVE_SCHEMA schema where they stay queryable as plain tables.
+"""
+import argparse
+import re
+from datetime import date
+
+from .config import app_settings
+
+PARENT = "appointments"
+DEFAULT_PARTITION = "appointments_default"
+PARTITION_NAME = re.compile(r"^appointments_p(\d{4})_(\d{2})$")
+
+
+def connect():
+    # Imported lazily so app.bulk_seed can use the helpers below on its own connection
+    from .database import engine
+    return engine.raw_connection()
+
+
+def month_start(day: date, offset: int = 0) -> date:
+    months = day.year * 12 + day.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_p{month.year:04d}_{month.month:02d}"
+
+
+# Monthly partitions currently attached to the parent, as {name: first day of the month}
+def attached_partitions(cursor) -> dict:
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, (PARENT,))
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[name] = date(int(match.group(1)), int(match.group(2)), 1)
+    return partitions
+
+
+# Create the partition for one month. Rows for that month may already sit in the default
+# partition (Postgres refuses to create the partition then), so the partition is built as a
+# plain table, those rows are moved into it and it is attached afterwards.
+def create_partition(cursor, month: date) -> str:
+    name = partition_name(month)
+    lower, upper = month.isoformat(), month_start(month, 1).isoformat()
+
+    cursor.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE appointment_date >= %(lower)s AND appointment_date < %(upper)s
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, {"lower": lower, "upper": upper})
+    moved = cursor.rowcount
+    cursor.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (lower, upper))
+    return f"created {name} [{lower}, {upper})" + (f", moved {moved} rows from {DEFAULT_PARTITION}" if moved else "")
+
+
+# Create the missing monthly partitions for every month from first_day to last_day
+def create_range(cursor, first_day: date, last_day: date) -> list:
+    existing = attached_partitions(cursor)
+    actions = []
+    month = month_start(first_day)
+    while month <= last_day:
+        if partition_name(month) not in existing:
+            actions.append(create_partition(cursor, month))
+        month = month_start(month, 1)
+    return actions
+
+
+def create_ahead(cursor, today: date, months_ahead: int) -> list:
+    return create_range(cursor, today, month_start(today, months_ahead))
+
+
+# Detach every partition whose month ended before the retention window, then archive or drop it
+def expire(cursor, today: date, retention_months: int, archive_schema: str, drop: bool) -> list:
+    cutoff = month_start(today, -retention_months)
+    actions = []
+    for name, month in sorted(attached_partitions(cursor).items(), key=lambda item: item[1]):
+        if month_start(month, 1) > cutoff:
+            continue
+        cursor.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name}")
+        if drop:
+            cursor.execute(f"DROP TABLE {name}")
+            actions.append(f"dropped {name}")
+        else:
+            cursor.execute(f'CREATE SCHEMA IF NOT EXISTS "{archive_schema}"')
+            cursor.execute(f'ALTER TABLE {name} SET SCHEMA "{archive_schema}"')
+            actions.append(f"archived {name} to {archive_schema}.{name}")
+    return actions
+
+
+def maintain(today: date = None, months_ahead: int = None, retention_months: int = None,
+             archive_schema: str = None, drop: bool = False) -> list:
+    today = today or date.today()
+    months_ahead = app_settings.APPOINTMENT_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    retention_months = app_settings.APPOINTMENT_RETENTION_MONTHS if retention_months is None else retention_months
+    archive_schema = archive_schema or app_settings.APPOINTMENT_ARCHIVE_SCHEMA
+
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            actions = create_ahead(cursor, today, months_ahead)
+            actions += expire(cursor, today, retention_months, archive_schema, drop)
+        conn.commit()
+        return actions
+    finally:
+        conn.close()
+
+
+def status() -> list:
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint,
+                       pg_size_pretty(pg_total_relation_size(c.oid))
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = %s::regclass
+                ORDER BY c.relname
+            """, (PARENT,))
+            return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the monthly partitions of the appointments table")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    maintain_parser = commands.add_parser("maintain", help="Create future partitions and archive expired ones")
+    maintain_parser.add_argument("--months-ahead", type=int, default=None)
+    maintain_parser.add_argument("--retention-months", type=int, default=None)
+    maintain_parser.add_argument("--archive-schema", default=None)
+    maintain_parser.add_argument("--drop", action="store_true", help="Drop expired partitions instead of archiving")
+    maintain_parser.add_argument("--today", type=date.fromisoformat, default=None, help="Override the current date")
+
+    commands.add_parser("status", help="List the partitions with estimated rows and size")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for name, bounds, rows, size in status():
+            print(f"{name:<28} {bounds:<60} {max(rows, 0):>12,} rows  {size:>10}")
+        return
+
+    actions = maintain(args.today, args.months_ahead, args.retention_months, args.archive_schema, args.drop)
+    for action in actions:
+        print(action)
+    if not actions:
+        print("partitions are up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import contextvars
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import PlainTextResponse
+
+from . import oauth2
+
+logger = logging.getLogger("app.profiler")
+
+# Set while a request is profiled; copied into the worker threads that run the request's sync code
+_profiled = contextvars.ContextVar("profiled_request", default=None)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+# Periodically samples the Python stacks of the threads running one request and counts identical
+# stacks. Other threads, including other requests on the same event loop or threadpool, are never
+# recorded, so a profile only shows the profiled request's own code. The output is in the
+# collapsed-stack format read by flamegraph.pl, speedscope and inferno.
+class StackSampler:
+    def __init__(self, interval_ms: float, request_frame):
+        self.interval = interval_ms / 1000
+        self.request_frame = request_frame  # The profiling middleware's frame, found in the request's loop stacks
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> float:
+        self._stop.set()
+        self._thread.join()
+        return (time.perf_counter() - self.started_at) * 1000
+
+    # True for a frame showing that its thread works for this request: the middleware's frame on
+    # the event loop thread, or the loop of an anyio worker thread running a call made in the
+    # request's context (each call is run as context.run(func) by the worker's run()).
+    def _owns(self, frame) -> bool:
+        if frame is self.request_frame:
+            return True
+        if frame.f_code.co_name == "run" and frame.f_globals.get("__name__", "").startswith("anyio."):
+            context = frame.f_locals.get("context")
+            return isinstance(context, contextvars.Context) and context.get(_profiled) is self
+        return False
+
+    # Root-to-leaf "a;b;c" stack string, or None when the thread is not running this request
+    def _collapse(self, frame):
+        names = []
+        owned = False
+        while frame is not None:
+            owned = owned or self._owns(frame)
+            names.append(_frame_name(frame))
+            frame = frame.f_back
+
+        if not owned:
+            return None
+        names.reverse()
+        return ";".join(names)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for frame in sys._current_frames().values():
+                stack = self._collapse(frame)
+                if stack is not None:
+                    self.samples[stack] += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+
+########################### ADMIN CHECK ###########################
+
+# Verify the bearer token through oauth2.get_current_user and report whether it carries the admin role.
+def _is_admin(authorization: str) -> bool:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+
+    try:
+        user = oauth2.get_current_user(token=token)
+    except HTTPException:
+        return False
+
+    return user.role == "admin"
+
+
+def _profile_requested(scope) -> bool:
+    query = scope.get("query_string", b"")
+    if b"__profile=1" in query.split(b"&"):
+        return True
+    for name, value in scope.get("headers", []):
+        if name == b"x-profile" and value == b"1":
+            return True
+    return False
+
+
+def _authorization_header(scope) -> str:
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            return value.decode("latin-1")
+    return ""
+
+
+def _write_profile(output_dir: str, method: str, path: str, collapsed: str):
+    os.makedirs(output_dir, exist_ok=True)
+    safe_path = path.strip("/").replace("/", "_") or "root"
+    filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time_ns() % 1_000_000)}-{method}-{safe_path}.collapsed"
+    with open(os.path.join(output_dir, filename), "w") as profile_file:
+        profile_file.write(collapsed)
+
+
+########################### ASGI MIDDLEWARE ###########################
+
+# Two modes:
+#   * on demand: an admin adds ?__profile=1 (or X-Profile: 1) and gets the collapsed-stack
+#     profile back instead of the normal response body;
+#   * background: 1 in `sample_every` requests is profiled and written to `output_dir`.
+class ProfilerMiddleware:
+    def __init__(self, app, interval_ms: float = 5.0, sample_every: int = 0, output_dir: str = "profiles"):
+        self.app = app
+        self.interval_ms = interval_ms
+        self.sample_every = sample_every
+        self.output_dir = output_dir
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if _profile_requested(scope) and await run_in_threadpool(_is_admin, _authorization_header(scope)):
+            await self._profile_to_response(scope, receive, send)
+        elif self.sample_every > 0 and random.random() < 1 / self.sample_every:
+            await self._profile_to_disk(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _profile_to_response(self, scope, receive, send):
+        status_code = 500
+
+        # Swallow the real response; only its status code is reported
+        async def discard(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+        sampler = StackSampler(self.interval_ms, sys._getframe())
+        token = _profiled.set(sampler)
+        sampler.start()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            elapsed_ms = sampler.stop()
+            _profiled.reset(token)
+
+        response = PlainTextResponse(sampler.collapsed(), headers={
+            "X-Profile-Samples": str(sum(sampler.samples.values())),
+            "X-Profile-Elapsed-Ms": f"{elapsed_ms:.2f}",
+            "X-Profile-Status": str(status_code),
+        })
+        await response(scope, receive, send)
+
+    async def _profile_to_disk(self, scope, receive, send):
+        sampler = StackSampler(self.interval_ms, sys._getframe())
+        token = _profiled.set(sampler)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            sampler.stop()
+            _profiled.reset(token)
+            if sampler.samples:
+                try:
+                    await run_in_threadpool(_write_profile, self.output_dir, scope["method"],
+                                            scope["path"], sampler.collapsed())
+                except OSError:
+                    logger.exception("Could not write request profile")
+
+
+def install(app, settings):
+    if not settings.PROFILING_ENABLED:
+        return
+
+    app.add_middleware(
+        ProfilerMiddleware,
+        interval_ms=settings.PROFILE_INTERVAL_MS,
+        sample_every=settings.PROFILE_SAMPLE_EVERY,
+        output_dir=settings.PROFILE_OUTPUT_DIR,
+    )
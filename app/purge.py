@@ -0,0 +1,347 @@
+"""
+Soft deletes of doctors, clinics and users, and the background purger that removes them.
+
+DELETE /doctors/{id}, /clinics/{id} and /users/{id} only set the record's deleted_at, remove a
+doctor's or clinic's schedules (a few rows per day, so its slots stop being offered at once) and
+queue a purge job, so the request never cascades through every appointment in one long
+transaction. From then on the record, and the patients, appointments and waitlist entries that
+depend on it, are hidden from all ORM reads. The purger running in every worker claims a job with
+a lease, deletes the rows that depend on the record in chunks of PURGE_CHUNK_SIZE (one short
+transaction each, recording progress and an audit record in the same transaction), and finally
+deletes the record itself. Seats freed by the deleted appointments are announced to availability
+subscribers and offered to the waitlist, as for a cancellation. A job can be followed with
+GET /purge-jobs/{id}. Jobs can also be drained without the API:
+
+    python -m app.purge run
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import delete, event, exists, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, with_loader_criteria
+from starlette.concurrency import run_in_threadpool
+
+from . import audit, availability, booking, lifecycle, models, waitlist
+from .config import app_settings
+from .database import ReplicaSessionLocal, SessionLocal
+
+logger = logging.getLogger("app.purge")
+
+LOCK_NOT_AVAILABLE = "55P03"  # SQLSTATE of a lock_timeout
+
+
+########################### HIDING SOFT-DELETED RECORDS ###########################
+
+SOFT_DELETED = (models.User, models.Doctor, models.Clinic)
+
+# The subqueries below read the Core tables, which the criteria do not apply to, so they see the deleted rows
+_users, _doctors, _clinics, _patients = (model.__table__ for model in (*SOFT_DELETED, models.Patient))
+
+
+def _deleted(table, column):
+    return exists().where(table.c.id == column, table.c.deleted_at.is_not(None))
+
+
+def _patient_of_deleted_user(column):
+    return exists().where(_patients.c.id == column, _deleted(_users, _patients.c.user_id))
+
+
+# Rows that depend on a soft-deleted record are hidden with it until the purger deletes them
+HIDE_DEPENDANTS = {
+    models.Patient: ~_deleted(_users, models.Patient.user_id),
+    models.Appointment: ~_deleted(_users, models.Appointment.user_fkey)
+                        & ~_deleted(_doctors, models.Appointment.doctor_fkey)
+                        & ~_deleted(_clinics, models.Appointment.clinic_fkey)
+                        & ~_patient_of_deleted_user(models.Appointment.patient_fkey),
+    models.WaitlistEntry: ~_deleted(_users, models.WaitlistEntry.user_id)
+                          & ~_deleted(_doctors, models.WaitlistEntry.doctor_id)
+                          & ~_patient_of_deleted_user(models.WaitlistEntry.patient_id),
+}
+
+HIDE_DELETED = [with_loader_criteria(model, model.deleted_at.is_(None), include_aliases=True) for model in SOFT_DELETED] \
+    + [with_loader_criteria(model, criteria, include_aliases=True) for model, criteria in HIDE_DEPENDANTS.items()]
+
+
+# Every ORM SELECT (queries, joins, the search and clinic caches) skips soft-deleted rows and the
+# patients, appointments and waitlist entries that depend on them, so a deleted user's bookings or
+# a deleted doctor's appointments disappear with the record and are never backfilled or booked
+# again. Relationship loads and the loaders that batch them (app/loaders.py) are left alone; pass
+# execution_options(include_deleted=True) to see deleted rows.
+def _hide_deleted(orm_execute_state):
+    if (not orm_execute_state.is_select or orm_execute_state.is_relationship_load
+            or orm_execute_state.is_column_load or orm_execute_state.execution_options.get("include_deleted", False)):
+        return
+    orm_execute_state.statement = orm_execute_state.statement.options(*HIDE_DELETED)
+
+
+for _sessionmaker in (SessionLocal, ReplicaSessionLocal):
+    event.listen(_sessionmaker, "do_orm_execute", _hide_deleted)
+
+
+# Queue the purge of a record the caller has just soft-deleted; it starts once the caller commits
+def enqueue(db: Session, table_name: str, record_id: int, requested_by: int) -> models.PurgeJob:
+    job = models.PurgeJob(table_name=table_name, record_id=record_id, requested_by=requested_by)
+    db.add(job)
+    db.flush()
+    return job
+
+
+# Deletes the schedules of a doctor or clinic the caller has just soft-deleted (`column` is
+# DoctorSchedule.doctor_fkey or .clinic_fkey), in the same transaction; their slot rows go with them.
+# Each schedule is audited and announced like one deleted through the API.
+def remove_schedules(db: Session, column, record_id: int, user_id: int):
+    schedules = db.scalars(delete(models.DoctorSchedule).where(column == record_id)
+                           .returning(models.DoctorSchedule)).all()
+    for schedule in schedules:
+        audit.deleted(db, user_id, schedule)
+        availability.schedule_removed(db, schedule)
+
+
+########################### PURGE PLANS ###########################
+
+# Deletes one chunk of appointments; the appointments trigger gives their seats back, so the
+# counters of slots that outlive the purge (e.g. a deleted user's bookings) stay right. Returns
+# one row per slot, with the rows deleted and the booked seats freed in it.
+APPOINTMENTS = """
+    WITH gone AS (
+        DELETE FROM appointments
+        WHERE (appointments_id, appointment_date) IN (
+            SELECT appointments_id, appointment_date FROM appointments WHERE {where} LIMIT :limit
+        )
+        RETURNING doctor_id, clinic_id, appointment_date, appointment_time, appointment_status
+    )
+    SELECT doctor_id, clinic_id, appointment_date, appointment_time,
+           count(*) AS deleted, count(*) FILTER (WHERE appointment_status = 'booked') AS freed
+    FROM gone
+    GROUP BY doctor_id, clinic_id, appointment_date, appointment_time
+    ORDER BY doctor_id, clinic_id, appointment_date, appointment_time
+"""
+
+ROWS = """
+    WITH gone AS (
+        DELETE FROM {table} WHERE {key} IN (SELECT {key} FROM {table} WHERE {where} LIMIT :limit)
+        RETURNING 1
+    )
+    SELECT count(*) FROM gone
+"""
+
+USER_PATIENTS = "(SELECT id FROM patients WHERE user_id = :record_id)"
+
+
+def _rows(table: str, key: str, where: str):
+    return text(ROWS.format(table=table, key=key, where=where))
+
+
+def _appointments(where: str):
+    return text(APPOINTMENTS.format(where=where))
+
+
+# Steps of a purge, in order: (step name, statement deleting one chunk and returning its row count,
+# or its slots for appointments). The schedules were removed with the soft delete; the step only
+# finds those of jobs queued before that. Every statement selects through a foreign key index.
+PLANS = {
+    "doctors": [
+        ("schedules", _rows("schedules", "schedule_id", "doctor_fkey = :record_id")),
+        ("waitlist_entries", _rows("waitlist_entries", "id", "doctor_id = :record_id")),
+        ("appointments", _appointments("doctor_fkey = :record_id")),
+    ],
+    "clinics": [
+        ("schedules", _rows("schedules", "schedule_id", "clinic_fkey = :record_id")),
+        ("appointments", _appointments("clinic_fkey = :record_id")),
+    ],
+    "users": [
+        ("waitlist_entries", _rows("waitlist_entries", "id",
+                                   f"user_id = :record_id OR patient_id IN {USER_PATIENTS}")),
+        ("appointments", _appointments(f"user_fkey = :record_id OR patient_fkey IN {USER_PATIENTS}")),
+        ("patients", _rows("patients", "id", "user_id = :record_id")),
+    ],
+}
+
+# Last step: the record itself. Anything booked against it while the purge ran goes with it through
+# the foreign keys, which by now is at most a few rows.
+FINAL = {table: _rows(table, "id", "id = :record_id AND deleted_at IS NOT NULL") for table in PLANS}
+
+
+########################### JOBS ###########################
+
+CLAIM = text("""
+    UPDATE purge_jobs
+    SET status = 'running', lease_owner = :owner, leased_until = now() + make_interval(secs => :lease),
+        started_at = coalesce(started_at, now())
+    WHERE id = (
+        SELECT id FROM purge_jobs
+        WHERE status IN ('pending', 'running') AND (leased_until IS NULL OR leased_until < now())
+        ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, table_name, record_id, requested_by
+""")
+
+# Recorded in the chunk's transaction, so the counts match what was deleted. Matches no row once
+# the lease was lost to another purger, and the chunk is then rolled back.
+PROGRESS = text("""
+    UPDATE purge_jobs
+    SET step = :step, leased_until = now() + make_interval(secs => :lease),
+        deleted_rows = jsonb_set(deleted_rows, ARRAY[:step], to_jsonb(coalesce((deleted_rows ->> :step)::int, 0) + :rows))
+    WHERE id = :id AND lease_owner = :owner
+""")
+
+FINISH = text("""
+    UPDATE purge_jobs SET status = 'done', step = NULL, finished_at = now(), lease_owner = NULL, leased_until = NULL
+    WHERE id = :id AND lease_owner = :owner
+""")
+
+# An error leaves the job to be retried after PURGE_RETRY_SECONDS, by this or another worker
+FAIL = text("""
+    UPDATE purge_jobs
+    SET attempts = attempts + :counted, error = :error, lease_owner = NULL,
+        leased_until = now() + make_interval(secs => :retry),
+        status = CASE WHEN attempts + :counted >= :max_attempts THEN 'failed' ELSE status END,
+        finished_at = CASE WHEN attempts + :counted >= :max_attempts THEN now() END
+    WHERE id = :id AND lease_owner = :owner
+""")
+
+RELEASE = text("UPDATE purge_jobs SET lease_owner = NULL, leased_until = NULL WHERE id = :id AND lease_owner = :owner")
+
+
+class LeaseLost(Exception):
+    pass
+
+
+# Announces the seats a chunk of deleted appointments freed and books them for the first patients
+# waiting, in the chunk's transaction. Slots that are no longer offered (a deleted doctor's or
+# clinic's) are skipped.
+def _release(db: Session, slots):
+    for slot in slots:
+        remaining = booking.seats_left(db, slot.doctor_id, slot.appointment_date, slot.appointment_time)
+        if remaining is None:
+            continue
+        availability.slot_freed(db, slot, remaining)
+        for _ in range(slot.freed):
+            if waitlist.backfill(db, slot.doctor_id, slot.clinic_id, slot.appointment_date, slot.appointment_time) is None:
+                break
+
+
+class Purger:
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stopping = threading.Event()
+        self.task = None
+
+    def _job_update(self, statement, **params):
+        with SessionLocal() as db:
+            db.execute(statement, {"owner": self.owner, **params})
+            db.commit()
+
+    # Deletes one chunk of a step and records it; returns the number of rows deleted
+    def _chunk(self, job, step: str, statement) -> int:
+        with SessionLocal() as db:
+            db.execute(text(f"SET LOCAL lock_timeout = {int(app_settings.PURGE_LOCK_TIMEOUT_MS)}"))
+            result = db.execute(statement, {"record_id": job.record_id, "limit": app_settings.PURGE_CHUNK_SIZE})
+            if step == "appointments":
+                slots = result.all()
+                rows = sum(slot.deleted for slot in slots)
+                _release(db, [slot for slot in slots if slot.freed])
+            else:
+                rows = result.scalar()
+            renewed = db.execute(PROGRESS, {"id": job.id, "owner": self.owner, "step": step, "rows": rows,
+                                            "lease": app_settings.PURGE_LEASE_SECONDS}).rowcount
+            if not renewed:
+                db.rollback()
+                raise LeaseLost()
+            if rows:
+                audit.purged(db, job.requested_by, job.table_name, job.record_id, {step: rows})
+            db.commit()
+        return rows
+
+    # Runs a claimed job to completion. Steps done by an earlier, interrupted run find nothing left
+    # to delete and are passed in one chunk each.
+    def _purge(self, job):
+        for step, statement in PLANS[job.table_name] + [(job.table_name, FINAL[job.table_name])]:
+            while True:
+                if self.stopping.is_set():
+                    self._job_update(RELEASE, id=job.id)
+                    return
+                if self._chunk(job, step, statement) < app_settings.PURGE_CHUNK_SIZE:
+                    break
+                time.sleep(app_settings.PURGE_PAUSE_SECONDS)
+        self._job_update(FINISH, id=job.id)
+        logger.info("Purged %s %d (job %d)", job.table_name, job.record_id, job.id)
+
+    # Claims and runs the oldest job that is due; returns False when there was none
+    def run_once(self) -> bool:
+        with SessionLocal() as db:
+            job = db.execute(CLAIM, {"owner": self.owner, "lease": app_settings.PURGE_LEASE_SECONDS}).first()
+            db.commit()
+        if job is None:
+            return False
+
+        try:
+            self._purge(job)
+        except LeaseLost:
+            logger.warning("Lost the lease on purge job %d to another worker", job.id)
+        except SQLAlchemyError as error:
+            # Waiting on rows locked by bookings is expected under load and does not count as a failed attempt
+            counted = 0 if getattr(getattr(error, "orig", None), "pgcode", None) == LOCK_NOT_AVAILABLE else 1
+            if counted:
+                logger.exception("Purge job %d failed", job.id)
+            self._job_update(FAIL, id=job.id, counted=counted, error=str(getattr(error, "orig", error))[:1000],
+                             retry=app_settings.PURGE_RETRY_SECONDS, max_attempts=app_settings.PURGE_MAX_ATTEMPTS)
+        return True
+
+    async def _run(self):
+        while not self.stopping.is_set():
+            try:
+                claimed = await run_in_threadpool(self.run_once)
+            except SQLAlchemyError:
+                logger.exception("Could not claim a purge job")
+                claimed = False
+            if not claimed:
+                await asyncio.sleep(app_settings.PURGE_POLL_SECONDS)
+
+    async def start(self):
+        self.stopping.clear()
+        self.task = asyncio.create_task(self._run())
+
+    # A job in progress stops after its current chunk and is released, so the next worker to poll resumes it
+    async def stop(self):
+        if self.task is None:
+            return
+        self.stopping.set()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+
+purger = Purger()
+
+
+def install(app, settings):
+    if not settings.PURGE_ENABLED:
+        return
+
+    lifecycle.register(purger.start, purger.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Purge soft-deleted doctors, clinics and users")
+    parser.add_argument("command", choices=["run"])
+    parser.parse_args()
+
+    purged = 0
+    while purger.run_once():
+        purged += 1
+    print(f"ran {purged} purge jobs")
+
+
+if __name__ == "__main__":
+    main()
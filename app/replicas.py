@@ -0,0 +1,104 @@
+import itertools
+import logging
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import utils
+
+logger = logging.getLogger("app.replicas")
+
+# Replay lag of a streaming replica in seconds. A replica that has replayed everything it received
+# is idle rather than behind, even if its last replayed transaction is old. On a server that is not
+# in recovery (e.g. a primary listed as a replica in development) the lag is 0.
+LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+# One replica engine and its last measured lag (None while unreachable)
+class Replica:
+    __slots__ = ("engine", "lag", "checked_at")
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lag = None
+        self.checked_at = None
+
+
+# Replicas eligible for reads: reachable and at most `max_lag` seconds behind. Lag is measured at
+# most once per `check_interval` per replica, inline by whichever request finds it stale.
+class ReplicaSet:
+    def __init__(self, engines, max_lag: float, check_interval: float):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.turn = itertools.count()
+        self.lock = threading.Lock()
+
+    def _check(self, replica: Replica):
+        now = time.monotonic()
+        if replica.checked_at is not None and now - replica.checked_at < self.check_interval:
+            return
+        if not self.lock.acquire(blocking=False):
+            return  # Another request is measuring; use the previous measurement meanwhile
+        try:
+            replica.checked_at = now
+            with replica.engine.connect() as connection:
+                replica.lag = float(connection.execute(LAG_QUERY).scalar())
+        except SQLAlchemyError:
+            if replica.lag is not None:
+                logger.warning("Read replica %s is unreachable, reading from the primary", replica.engine.url)
+            replica.lag = None
+        finally:
+            self.lock.release()
+
+    # The next eligible replica engine in round-robin order, or None to read from the primary
+    def choose(self):
+        if not self.replicas:
+            return None
+        start = next(self.turn)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            self._check(replica)
+            if replica.lag is not None and replica.lag <= self.max_lag:
+                return replica.engine
+        return None
+
+    def status(self):
+        return [{"url": replica.engine.url.render_as_string(hide_password=True), "lag_seconds": replica.lag}
+                for replica in self.replicas]
+
+
+# Read-your-writes: callers that just committed a write read from the primary for `window` seconds,
+# after which any replica within the lag limit has their write. Keyed by the user id of the bearer
+# token, so the caller stays on the primary when its access token is refreshed.
+class StickyWriters:
+    def __init__(self, window: float, max_size: int = 100000):
+        self.window = window
+        self.max_size = max_size
+        self.until = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(authorization: Optional[str]) -> Optional[str]:
+        return utils.bearer_subject(authorization)
+
+    def wrote(self, key: str):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.until) >= self.max_size:
+                self.until = {k: until for k, until in self.until.items() if until > now}
+            self.until[key] = now + self.window
+
+    def is_sticky(self, key: Optional[str]) -> bool:
+        if key is None:
+            return False
+        until = self.until.get(key)
+        return until is not None and until > time.monotonic()
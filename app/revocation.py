@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import lifecycle, models
+from .config import app_settings
+from .database import SessionLocal
+
+logger = logging.getLogger("app.revocation")
+
+# Revoked tokens, checked on every authenticated request without a database round trip. Each
+# worker keeps the revoked token ids in a Bloom filter and the per-user cutoffs in a dict, loaded
+# from the revoked_tokens table at startup and kept in sync with it by a background task. A token
+# id the filter reports is confirmed against the table, so a false positive never rejects a token.
+
+# Rows revoked this long before the previous sync are read again, covering clock skew between
+# workers and revocations whose transaction was still open at the previous sync
+SYNC_OVERLAP_SECONDS = 60
+
+
+########################### BLOOM FILTER ###########################
+
+# Bit array with `hashes` positions per key, derived from one digest by double hashing
+class BloomFilter:
+    __slots__ = ("size", "hashes", "bits", "count")
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(1, capacity)
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+########################### REVOCATION LIST ###########################
+
+class RevocationList:
+    def __init__(self):
+        self.filter = BloomFilter(app_settings.REVOCATION_FILTER_CAPACITY, app_settings.REVOCATION_FILTER_ERROR_RATE)
+        self.capacity = app_settings.REVOCATION_FILTER_CAPACITY
+        self.user_cutoffs = {}  # user id -> epoch seconds; tokens issued before are revoked
+        self.synced_at = None  # When the last sync or load started
+        self.lock = threading.Lock()
+        self.task = None
+
+    def _apply(self, token_id: Optional[str], user_id: Optional[int], revoked_at: datetime):
+        if token_id is not None:
+            self.filter.add(token_id)
+        else:
+            cutoff = revoked_at.timestamp()
+            if cutoff > self.user_cutoffs.get(user_id, 0):
+                self.user_cutoffs[user_id] = cutoff
+
+    # Rebuilds the filter and cutoffs from the unexpired rows, so expired entries drop out
+    def load(self, db: Session):
+        with self.lock:
+            started = datetime.now(timezone.utc)
+            rows = db.execute(select(models.RevokedToken.token_id, models.RevokedToken.user_id,
+                                     models.RevokedToken.revoked_at)
+                              .where(models.RevokedToken.expires_at > started)).all()
+            token_count = sum(1 for token_id, _, _ in rows if token_id is not None)
+            capacity = max(app_settings.REVOCATION_FILTER_CAPACITY, 2 * token_count)
+
+            current = self.filter, self.user_cutoffs
+            self.filter = BloomFilter(capacity, app_settings.REVOCATION_FILTER_ERROR_RATE)
+            self.user_cutoffs = {}
+            try:
+                for row in rows:
+                    self._apply(*row)
+            except Exception:
+                self.filter, self.user_cutoffs = current
+                raise
+            self.capacity, self.synced_at = capacity, started
+
+    # Applies the rows revoked since the previous sync (with some overlap; re-applying is harmless)
+    def sync(self, db: Session):
+        if self.synced_at is None:
+            self.load(db)
+            return
+        with self.lock:
+            started = datetime.now(timezone.utc)
+            rows = db.execute(select(models.RevokedToken.token_id, models.RevokedToken.user_id,
+                                     models.RevokedToken.revoked_at)
+                              .where(models.RevokedToken.revoked_at >=
+                                     self.synced_at - timedelta(seconds=SYNC_OVERLAP_SECONDS))).all()
+            for row in rows:
+                self._apply(*row)
+            self.synced_at = started
+            full = self.filter.count > self.capacity
+        if full:
+            self.load(db)
+
+    def _record(self, db: Session, token_id: Optional[str], user_id: Optional[int], expires_at: datetime):
+        revoked_at = datetime.now(timezone.utc)
+        db.add(models.RevokedToken(token_id=token_id, user_id=user_id, revoked_at=revoked_at, expires_at=expires_at))
+        db.commit()
+        with self.lock:
+            self._apply(token_id, user_id, revoked_at)
+
+    # Revokes one token (logout); takes effect in this worker at once, in the others within a sync
+    def revoke_token(self, db: Session, token_id: str, expires_at: datetime):
+        self._record(db, token_id, None, expires_at)
+
+    # Revokes every token the user holds (role change, deletion); new logins are unaffected. The
+    # cutoff is kept until the longest lived of those tokens (access, refresh or calendar feed) expires.
+    def revoke_user(self, db: Session, user_id: int):
+        lifetime = max(timedelta(minutes=app_settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+                       timedelta(days=app_settings.REFRESH_TOKEN_EXPIRE_DAYS),
+                       timedelta(days=app_settings.CALENDAR_TOKEN_EXPIRE_DAYS))
+        self._record(db, None, user_id, datetime.now(timezone.utc) + lifetime)
+
+    def is_revoked(self, token_id: str, user_id: int, issued_at: float) -> bool:
+        cutoff = self.user_cutoffs.get(user_id)
+        if cutoff is not None and issued_at < cutoff:
+            return True
+        if token_id not in self.filter:
+            return False
+        # Possibly revoked: confirm on the primary, which has the row even if it was just written
+        with SessionLocal() as db:
+            return db.query(models.RevokedToken.id).filter(models.RevokedToken.token_id == token_id).first() is not None
+
+    def _prune(self, db: Session):
+        db.query(models.RevokedToken).filter(models.RevokedToken.expires_at <= datetime.now(timezone.utc)) \
+            .delete(synchronize_session=False)
+        db.commit()
+
+    def _refresh(self, rebuild: bool):
+        with SessionLocal() as db:
+            if rebuild:
+                self.load(db)
+                self._prune(db)
+            else:
+                self.sync(db)
+
+    async def _run(self):
+        rebuilt = time.monotonic()
+        while True:
+            await asyncio.sleep(app_settings.REVOCATION_SYNC_SECONDS)
+            rebuild = time.monotonic() - rebuilt >= app_settings.REVOCATION_REBUILD_SECONDS
+            try:
+                await run_in_threadpool(self._refresh, rebuild)
+            except SQLAlchemyError:
+                logger.exception("Could not sync revoked tokens, retrying")
+                continue
+            if rebuild:
+                rebuilt = time.monotonic()
+
+    async def start(self):
+        try:
+            await run_in_threadpool(self._refresh, False)
+        except SQLAlchemyError:
+            logger.exception("Could not load revoked tokens, retrying in the background")
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+revocations = RevocationList()
+
+
+def install(app, settings):
+    lifecycle.register(revocations.start, revocations.stop)
@@ -0,0 +1,18 @@
+from fastapi import Depends, HTTPException, APIRouter, status
+
+from .. import admission, oauth2
+
+router = APIRouter(
+    prefix='/admission'
+)
+
+########################### ADMISSION CONTROL METRICS [ READ ] ###########################
+
+# Endpoint to retrieve admitted/rejected request counts per route class. Requires an authenticated admin user.
+@router.get("/metrics")
+def get_admission_metrics(current_user: dict = Depends(oauth2.get_current_user)):
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Only admin can view admission metrics.")
+
+    return admission.snapshot()
@@ -1,12 +1,15 @@
-from typing import List
-from fastapi import Depends, Response, HTTPException, APIRouter, status
+from typing import List, Optional
+from fastapi import Depends, Header, Response, HTTPException, APIRouter, status
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from .. import models, schemas, oauth2
-from ..database import get_db
+from .. import models, schemas, oauth2, booking, mutations, availability, loaders, waitlist, audit
+from ..database import get_read_db, get_write_db
+from ..negotiation import NegotiatedRoute
 
 router = APIRouter(
-    prefix='/appointments'
+    prefix='/appointments',
+    route_class=NegotiatedRoute
 )
 
 """
@@ -14,7 +17,7 @@ router = APIRouter(
     
     Args:
         appointment_data (schemas.AppointmentCreate): Data for the new appointment.
-        db (Session, optional): Database session. Defaults to Depends(get_db).
+        db (Session, optional): Database session. Defaults to Depends(get_write_db).
         current_user (dict, optional): Currently logged-in user. Defaults to Depends(oauth2.get_current_user).
     
     Returns:
@@ -22,22 +25,12 @@ router = APIRouter(
 """
 ########################### ADD NEW APPOINTMENT [ CREATE ] ###########################
 @router.post("/", response_model=schemas.AppointmentResponseData, status_code=status.HTTP_201_CREATED)
-def add_appointment(appointment_data: schemas.AppointmentCreate, db: Session = Depends(get_db), current_user: dict = Depends(oauth2.get_current_user)):
+def add_appointment(appointment_data: schemas.AppointmentCreate, db: Session = Depends(get_write_db), current_user: dict = Depends(oauth2.get_current_user)):
     # Fetch patient, doctor, clinic, and schedule records
     patient = db.query(models.Patient).get(appointment_data.patient_id)
     doctor = db.query(models.Doctor).get(appointment_data.doctor_id)
     clinic = db.query(models.Clinic).get(appointment_data.clinic_id)
     doc_schedule = db.query(models.DoctorSchedule).filter_by(doctor_id=appointment_data.doctor_id).first()
-    
-    # Fetch all existing appointments
-    all_appointments = db.query(models.Appointment).all()
-    doctors_ids_arr = [appointment.doctor_id for appointment in all_appointments]
-    appointment_date_time_set = {(appointment.appointment_date, appointment.appointment_time) for appointment in all_appointments}
-    
-
-    # Check if doctor is already booked
-    is_doctor_booked = (appointment_data.doctor_id in doctors_ids_arr) and \
-                       ((appointment_data.appointment_date, appointment_data.appointment_time) in appointment_date_time_set)
 
     # Create a new appointment instance
     new_appointment = models.Appointment(
@@ -62,11 +55,6 @@ def add_appointment(appointment_data: schemas.AppointmentCreate, db: Session = D
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Booking for {doctor.name} is currently unavailable")
     
 
-    # Check if the doctor is already booked for the chosen date and time
-    if is_doctor_booked:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"{doctor.name} is already booked for this timeframe")
-    
-
     # Check if the chosen appointment date is within the doctor's schedule date
     if appointment_data.appointment_date != doc_schedule.date:
         raise HTTPException(
@@ -88,9 +76,22 @@ def add_appointment(appointment_data: schemas.AppointmentCreate, db: Session = D
             detail=f"{doctor.name} does not have a schedule at {clinic.name}."
         )
 
-
-    # Add the new appointment to the database
+    # Add the new appointment to the database; its trigger takes a seat in the slot. The insert is
+    # the last write, so the slot's row lock is only held for the commit; a full slot fails it.
     db.add(new_appointment)
+    try:
+        db.flush()
+    except IntegrityError as error:
+        db.rollback()
+        if not booking.is_full(error):
+            raise
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"{doctor.name} is already booked for this timeframe")
+    remaining = booking.seats_left(db, appointment_data.doctor_id, appointment_data.appointment_date,
+                                   appointment_data.appointment_time)
+
+    # Subscribers are notified, and the change is written to the audit log, when the transaction commits
+    availability.slot_taken(db, new_appointment, remaining)
+    audit.created(db, current_user.id, new_appointment)
     db.commit()
     db.refresh(new_appointment)
 
@@ -100,25 +101,37 @@ def add_appointment(appointment_data: schemas.AppointmentCreate, db: Session = D
     
 ########################### GET ALL APPOINTMENTS [ READ ] ###########################
 @router.get("/", response_model=List[schemas.AppointmentResponseData])
-def get_appointments(db: Session = Depends(get_db), 
-                     current_user: dict = Depends(oauth2.get_current_user)):
-
-    # Check if the current user is an admin
-    if current_user.role == 'admin':
-        # If the user is an admin, retrieve all appointments
-        appointments = db.query(models.Appointment).all()
-        return appointments
-
+def get_appointments(db: Session = Depends(get_read_db), 
+                     current_user: dict = Depends(oauth2.get_current_user),
+                     date_from: Optional[str] = None, date_to: Optional[str] = None, ids: Optional[str] = None,
+                     batch: loaders.Loaders = Depends(loaders.get_loaders)):
+
+    appointments_query = db.query(models.Appointment)
+
+    # Optional date range (YYYY-MM-DD, inclusive); only the monthly partitions it covers are scanned
+    if date_from is not None:
+        appointments_query = appointments_query.filter(models.Appointment.appointment_date >= date_from)
+    if date_to is not None:
+        appointments_query = appointments_query.filter(models.Appointment.appointment_date <= date_to)
+
+    # If the user is not an admin, only the appointments associated with the user are returned
+    if current_user.role != 'admin':
+        appointments_query = appointments_query.filter(models.Appointment.user_fkey == current_user.id)
+
+    # With ?ids=1,2,3 only those appointments are returned (one IN query), in the order given
+    if ids is not None:
+        appointments = loaders.fetch_by_ids(appointments_query, models.Appointment.appointments_id, loaders.parse_ids(ids))
     else:
-        # If the user is not an admin, retrieve appointments associated with the user
-        appointments = db.query(models.Appointment).filter(models.Appointment.user_fkey == current_user.id).all()
-        return appointments
+        appointments = appointments_query.all()
+
+    # Load the patients, doctors and clinics of all appointments with one query each
+    return batch.prefetch(appointments, models.Appointment.patient, models.Appointment.doctor, models.Appointment.clinic)
     
 
 
 ########################### GET APPOINTMENT WITH ID [ READ ] ###########################
 @router.get("/{appointment_id}", response_model=schemas.AppointmentResponseData)
-def get_clinic(appointment_id: int, db: Session = Depends(get_db), 
+def get_clinic(appointment_id: int, db: Session = Depends(get_read_db), 
                current_user: dict = Depends(oauth2.get_current_user)):
     
     # Retrieve a appointment with the specified ID from the database
@@ -138,28 +151,58 @@ def get_clinic(appointment_id: int, db: Session = Depends(get_db),
     return appointment
 
 
+SCHEDULED_FIELDS = {"doctor_id", "clinic_id", "appointment_date", "appointment_time"}
+
+
+# Name of a doctor or clinic for error messages; the record may have been deleted meanwhile
+def _name(db: Session, model, record_id: int) -> str:
+    record = db.get(model, record_id, execution_options={"include_deleted": True})
+    return record.name if record is not None else f"{model.__name__} {record_id}"
+
+
+# Raises 404/403 when an appointment is not within its doctor's schedule
+def _check_schedule(db: Session, appointment: models.Appointment):
+    doctor_name = _name(db, models.Doctor, appointment.doctor_id)
+    doc_schedule = db.query(models.DoctorSchedule).filter(models.DoctorSchedule.doctor_id == appointment.doctor_id).first()
+
+    # Check if the doctor's schedule exists
+    if not doc_schedule:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Booking for {doctor_name} is currently unavailable")
+
+    # Check if the chosen appointment date is within the doctor's schedule date
+    if appointment.appointment_date != doc_schedule.date:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"{doctor_name} does not have a schedule for this date: {appointment.appointment_date}."
+        )
+
+    # Check if the chosen appointment time is within the doctor's available time slots
+    if appointment.appointment_time not in doc_schedule.slots:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"{doctor_name} has time schedules for these times: {doc_schedule.slots}."
+        )
+
+    # Check if the chosen clinic is the same as the one where the doctor has a schedule
+    if appointment.clinic_id != doc_schedule.clinic_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"{doctor_name} does not have a schedule at {_name(db, models.Clinic, appointment.clinic_id)}."
+        )
+
+
 ########################### UPDATE APPOINTMENT [ UPDATE ] ###########################
 @router.put("/{appointment_id}", response_model=schemas.AppointmentResponseData)
-def update_appointment(appointment_id: int, appointment_update: schemas.AppointmentUpdate, db: Session = Depends(get_db),
-                       current_user: dict = Depends(oauth2.get_current_user)):
+def update_appointment(appointment_id: int, appointment_update: schemas.AppointmentUpdate, db: Session = Depends(get_write_db),
+                       current_user: dict = Depends(oauth2.get_current_user), if_match: Optional[str] = Header(None)):
     
     """
     Update an existing appointment.
     """
-    # Query the appointment by its ID
-    appointment_query = db.query(models.Appointment).filter(models.Appointment.appointments_id == appointment_id)
-    appointment = appointment_query.first()
+    # Parse the expected version first so a malformed If-Match fails before any query
+    expected_version = mutations.parse_if_match(if_match)
 
-    # Check if the appointment exists
-    if not appointment:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"Appointment with ID: {appointment_id}, not found!")
-    
-    # Check if the current user has permission to update the appointment
-    if appointment.user_fkey != current_user.id and current_user.role != 'admin':
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail=f"You don't have permission to update this appointment")
-    
     # Prepare appointment data for update, excluding unset fields
     appointment_data = appointment_update.model_dump(exclude_unset=True)
 
@@ -184,81 +227,75 @@ def update_appointment(appointment_id: int, appointment_update: schemas.Appointm
                                 detail=f"Invalid clinic_id")
         appointment_data["clinic_fkey"] = clinic.id
 
-    ################ check avaliability of doctor ####################
-    doc_schedule = db.query(models.DoctorSchedule).filter(models.DoctorSchedule.doctor_id == appointment_update.doctor_id).first()
-
-    # Check if the doctor's schedule exists
-    if not doc_schedule:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
-                            detail=f"Booking for {doctor.name} is currently unavailable")
-
-    # Fetch all existing appointments
-    all_appointments = db.query(models.Appointment).all()
-    doctors_ids_arr = [appointment.doctor_id for appointment in all_appointments]
-    appointment_date_time_set = {(appointment.appointment_date, appointment.appointment_time) for appointment in all_appointments}
-    
-    # Check if doctor is already booked
-    is_doctor_booked = (appointment_update.doctor_id in doctors_ids_arr) and \
-                       ((appointment_update.appointment_date, appointment_update.appointment_time) in appointment_date_time_set)
-    
-
-    # Check if the chosen appointment date is within the doctor's schedule date
-    if appointment_update.appointment_date != doc_schedule.date:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"{doctor.name} does not have a schedule for this date: {appointment_update.appointment_date}."
-        )
-
-    # Check if the chosen appointment time is within the doctor's available time slots
-    if appointment_update.appointment_time not in doc_schedule.slots:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"{doctor.name} has time schedules for these times: {doc_schedule.slots}."
-        )
-    
-    # Check if the chosen clinic is the same as the one where the doctor has a schedule
-    if appointment_update.clinic_id != doc_schedule.clinic_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"{doctor.name} does not have a schedule at {clinic.name}."
+    # Update the appointment in one statement that also checks existence, ownership and the version.
+    # Its trigger moves the seat to the new slot; if that slot is full, nothing is changed.
+    try:
+        result = mutations.update_returning(
+            db, models.Appointment, appointment_id, appointment_data,
+            allowed=current_user.role == 'admin', owner_column=models.Appointment.user_fkey, owner_id=current_user.id,
+            expected_version=expected_version,
         )
-    
-    # Check if the doctor is already booked for the chosen date and time
-    if is_doctor_booked:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"{doctor.name} is already booked for this timeframe")
-    ################ end check avaliability of doctor ################
-
-    # Update the appointment data in the database
-    appointment_query.update(appointment_data, synchronize_session=False)
-
-    # Commit the changes and refresh the appointment object
+    except IntegrityError as error:
+        db.rollback()
+        if not booking.is_full(error):
+            raise
+        # Only an allowed update reaches the trigger, so the appointment exists and belongs to the caller
+        doctor_id = appointment_data.get("doctor_id") or db.query(models.Appointment.doctor_id) \
+            .filter(models.Appointment.appointments_id == appointment_id).scalar()
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"{_name(db, models.Doctor, doctor_id)} is already booked for this timeframe")
+    mutations.check_outcome(result.outcome,
+                            not_found_detail=f"Appointment with ID: {appointment_id}, not found!",
+                            forbidden_detail=f"You don't have permission to update this appointment")
+
+    # Check the appointment as updated (fields not sent keep their values) against the doctor's
+    # schedule; only the owner gets this far, and a rejected update is rolled back
+    if SCHEDULED_FIELDS & appointment_data.keys():
+        try:
+            _check_schedule(db, result.instance)
+        except HTTPException:
+            db.rollback()
+            raise
+
+    availability.slot_moved(db, result.previous, result.instance)
+    audit.updated(db, current_user.id, result.previous, result.instance)
+
+    # Offer a seat the appointment gave up to the first patient waiting for it. Its counter row is
+    # already locked by the update's trigger, so this takes no lock the update did not hold.
+    previous = result.previous
+    if waitlist.slot_released(previous, result.instance):
+        waitlist.backfill(db, previous.doctor_id, previous.clinic_id, previous.appointment_date, previous.appointment_time)
+
+    # Commit the changes; the returned row is already loaded, so no refresh is needed
     db.commit()
-    db.refresh(appointment)
 
-    return appointment
+    return result.instance
 
 
 ########################### DELETE APPOINTMENT [ DELETE ] ###########################
 @router.delete("/{appointment_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_appointment(appointment_id: int, db: Session = Depends(get_db),
-                  current_user: dict = Depends(oauth2.get_current_user)):
-    appointment_query = db.query(models.Appointment).filter(models.Appointment.appointments_id == appointment_id)
-    appointment = appointment_query.first()
-
-    if not appointment:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"Clinic with ID: {id}, not found!")
-
-    # Check if the user is an admin
-    if appointment.user_fkey != current_user.id and current_user.role != 'admin':
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail=f"You don't have permission to delete this appointment")
-
-    appointment_query.delete(synchronize_session=False)
+def delete_appointment(appointment_id: int, db: Session = Depends(get_write_db),
+                  current_user: dict = Depends(oauth2.get_current_user), if_match: Optional[str] = Header(None)):
+    # Delete the appointment in one statement that also checks existence and ownership; its trigger
+    # gives the seat back
+    result = mutations.delete_returning(
+        db, models.Appointment, appointment_id,
+        allowed=current_user.role == 'admin', owner_column=models.Appointment.user_fkey, owner_id=current_user.id,
+        expected_version=mutations.parse_if_match(if_match),
+    )
+    mutations.check_outcome(result.outcome,
+                            not_found_detail=f"Appointment with ID: {appointment_id}, not found!",
+                            forbidden_detail=f"You don't have permission to delete this appointment")
+    previous = result.previous
+    audit.deleted(db, current_user.id, previous)
+    if previous.appointment_status == 'booked':
+        remaining = booking.seats_left(db, previous.doctor_id, previous.appointment_date, previous.appointment_time)
+        availability.slot_freed(db, previous, remaining)
+        # Book the freed seat for the first patient waiting for it, in the same transaction
+        waitlist.backfill(db, previous.doctor_id, previous.clinic_id, previous.appointment_date, previous.appointment_time)
 
     # Commit the transaction to the database
     db.commit()
 
     # Return a response with no content (204 No Content)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
-
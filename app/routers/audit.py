@@ -0,0 +1,47 @@
+from typing import List, Optional
+from fastapi import Depends, HTTPException, APIRouter, Query, status
+from sqlalchemy.orm import Session
+
+from .. import audit, models, schemas, oauth2
+from ..database import get_read_db
+
+router = APIRouter(
+    prefix='/audit'
+)
+
+########################### GET AUDIT LOG [ READ ] ###########################
+
+# Endpoint to retrieve audited changes, newest first. Records are written in batches, so a change
+# shows up here within AUDIT_FLUSH_SECONDS of its commit. Requires an authenticated admin user.
+@router.get("/", response_model=List[schemas.AuditLogResponseData])
+def get_audit_log(table_name: Optional[str] = None, record_id: Optional[int] = None, user_id: Optional[int] = None,
+                  before_id: Optional[int] = None, limit: int = Query(100, ge=1, le=1000),
+                  db: Session = Depends(get_read_db), current_user: dict = Depends(oauth2.get_current_user)):
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Only admin can view the audit log.")
+
+    entries_query = db.query(models.AuditLog)
+    if table_name is not None:
+        entries_query = entries_query.filter(models.AuditLog.table_name == table_name)
+    if record_id is not None:
+        entries_query = entries_query.filter(models.AuditLog.record_id == record_id)
+    if user_id is not None:
+        entries_query = entries_query.filter(models.AuditLog.user_id == user_id)
+    # Pages continue below the smallest id of the previous page
+    if before_id is not None:
+        entries_query = entries_query.filter(models.AuditLog.id < before_id)
+
+    return entries_query.order_by(models.AuditLog.id.desc()).limit(limit).all()
+
+
+########################### AUDIT WRITER METRICS [ READ ] ###########################
+
+# Endpoint to retrieve this worker's audit queue depth, batch sizes and per-request overhead
+@router.get("/metrics")
+def get_audit_metrics(current_user: dict = Depends(oauth2.get_current_user)):
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Only admin can view audit metrics.")
+
+    return audit.writer.snapshot()
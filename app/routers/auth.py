@@ -1,33 +1,78 @@
-from fastapi import Depends, HTTPException, APIRouter, status
+from typing import Optional
+from fastapi import Depends, HTTPException, APIRouter, Response, status
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm
 from .. import models, utils, schemas, oauth2
-from ..database import get_db
+from ..database import get_write_db
+from ..revocation import revocations
 
-router = APIRouter(
-    prefix='/login'
-)
+router = APIRouter()
 
 ########################### LOGIN USER ###########################
-@router.post("/", response_model=schemas.Token)
-def login_user(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@router.post("/login/", response_model=schemas.Token)
+def login_user(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_write_db)):
     # Query the database to get the user by their email.
     user = db.query(models.User).filter(models.User.email == user_credentials.username).first()
 
     # Check if the user exists. If not, raise a 403 Forbidden HTTPException.
     if not user:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"Invalid Credential")
-    
+
     # Verify the user's password against the stored hashed password.
     # If the password is invalid, raise a 403 Forbidden HTTPException.
     if not utils.verify_password(user_credentials.password, user.password):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"Invalid Credential")
-    
-    # If the user is authenticated, create an access token for them.
-    # The access token is based on the user's username and will be used for future API requests.
-    access_token = oauth2.create_access_token(data={"username": user.username})
-    
-    # Return the access token along with the token type.
-    return {"access_token": access_token, "token_type": "bearer"}
+
+    # If the user is authenticated, create a short lived access token carrying the user's id and
+    # role, used for future API requests, and a refresh token to get new access tokens with.
+    access_token = oauth2.create_access_token(user.id, user.role)
+    refresh_token = oauth2.create_refresh_token(user.id, user.role)
+
+    # Return the tokens along with the token type.
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token,
+            "expires_in": oauth2.ACCESS_TOKEN_EXPIRE_MINUTES * 60}
+
+
+########################### REFRESH ACCESS TOKEN ###########################
+@router.post("/login/refresh", response_model=schemas.Token)
+def refresh_access_token(refresh: schemas.RefreshRequest, db: Session = Depends(get_write_db)):
+    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                          detail="Could not validate credentials",
+                                          headers={"WWW-Authenticate": "Bearer"})
+    token = oauth2.verify_token(refresh.refresh_token, "refresh", credentials_exception)
+
+    # The role is read again here, so a new access token never carries a stale role.
+    user = db.query(models.User).filter(models.User.id == token.id).first()
+    if not user:
+        raise credentials_exception
+
+    return {"access_token": oauth2.create_access_token(user.id, user.role), "token_type": "bearer",
+            "expires_in": oauth2.ACCESS_TOKEN_EXPIRE_MINUTES * 60}
+
+
+########################### CALENDAR FEED TOKEN ###########################
+# Calendar apps poll the .ics feeds by URL, so they get a long lived token that is only accepted
+# there, passed as ?token=. It is revoked like the user's other tokens (role change, deletion).
+@router.post("/login/calendar-token", response_model=schemas.CalendarToken)
+def create_calendar_token(current_user: schemas.TokenData = Depends(oauth2.get_current_user)):
+    return {"calendar_token": oauth2.create_calendar_token(current_user.id, current_user.role),
+            "expires_in": oauth2.CALENDAR_TOKEN_EXPIRE_DAYS * 86400}
+
+
+########################### LOGOUT USER ###########################
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+def logout_user(logout: Optional[schemas.LogoutRequest] = None, db: Session = Depends(get_write_db),
+                current_user: schemas.TokenData = Depends(oauth2.get_current_user)):
+    # Revoke the access token used for this request, and the refresh token if one is passed.
+    revocations.revoke_token(db, current_user.token_id, oauth2.token_expiry(current_user))
+
+    if logout is not None and logout.refresh_token is not None:
+        invalid_token = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid refresh token")
+        refresh = oauth2.verify_token(logout.refresh_token, "refresh", invalid_token)
+        if refresh.id != current_user.id:
+            raise invalid_token
+        revocations.revoke_token(db, refresh.token_id, oauth2.token_expiry(refresh))
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
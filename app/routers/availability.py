@@ -0,0 +1,62 @@
+import asyncio
+import json
+from typing import Optional
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+
+from .. import availability
+
+router = APIRouter()
+
+# Subscription parameter -> topic kind
+SUBSCRIPTION_KEYS = {"doctor_id": "doctor", "clinic_id": "clinic", "date": "date"}
+
+########################### SLOT AVAILABILITY STREAM [ WEBSOCKET ] ###########################
+
+# Clients subscribe with query parameters (/ws/availability?doctor_id=3&date=2026-11-02) and may change
+# their subscriptions later by sending {"subscribe": {"doctor_id": 4}} or {"unsubscribe": {"date": "2026-11-02"}}.
+# The server pushes slot_taken, slot_freed, schedule_changed and schedule_removed events as they commit,
+# and "resync" when events may have been lost, after which the client should reload the schedules.
+# Like GET /schedules, no authentication is required.
+@router.websocket("/ws/availability")
+async def availability_stream(websocket: WebSocket, doctor_id: Optional[int] = None,
+                              clinic_id: Optional[int] = None, date: Optional[str] = None):
+    await websocket.accept()
+
+    hub = availability.hub
+    subscriber = hub.connect()
+    for key, value in (("doctor_id", doctor_id), ("clinic_id", clinic_id), ("date", date)):
+        if value is not None:
+            hub.subscribe(subscriber, availability.topic(SUBSCRIPTION_KEYS[key], value))
+
+    # Frames are forwarded by a sender task while this coroutine waits for client messages
+    async def send_events():
+        while True:
+            frame = await subscriber.queue.get()
+            if frame is None:
+                # The client fell too far behind; it has to reconnect and reload
+                await websocket.close(code=1013)
+                return
+            await websocket.send_text(frame)
+
+    sender = asyncio.create_task(send_events())
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except ValueError:
+                continue
+            if not isinstance(message, dict):
+                continue
+            for action, change in (("subscribe", hub.subscribe), ("unsubscribe", hub.unsubscribe)):
+                params = message.get(action)
+                if not isinstance(params, dict):
+                    continue
+                for key, value in params.items():
+                    if key in SUBSCRIPTION_KEYS and value is not None:
+                        change(subscriber, availability.topic(SUBSCRIPTION_KEYS[key], value))
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        hub.disconnect(subscriber)
+        sender.cancel()
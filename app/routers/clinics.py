@@ -1,17 +1,20 @@
-from typing import List
-from fastapi import Depends, Response, HTTPException, APIRouter, status
+from typing import List, Optional, Union
+from fastapi import Depends, Header, Query, Request, Response, HTTPException, APIRouter, status
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from .. import models, schemas, oauth2
-from ..database import get_db
+from .. import models, schemas, oauth2, mutations, loaders, geo, search, sync, ical, audit, purge
+from ..database import get_read_db, get_write_db
+from ..negotiation import NegotiatedRoute
 
 router = APIRouter(
-    prefix='/clinics'
+    prefix='/clinics',
+    route_class=NegotiatedRoute
 )
 
 ########################### ADD NEW CLINIC [ CREATE ] ###########################
 @router.post("/", response_model=schemas.ClinicResponseData, status_code=status.HTTP_201_CREATED)
-def add_clinic(clinic: schemas.ClinicCreate, db: Session = Depends(get_db),
+def add_clinic(clinic: schemas.ClinicCreate, db: Session = Depends(get_write_db),
                current_user: dict = Depends(oauth2.get_current_user)):
     # Check if the user is an admin
     isAdmin = current_user.role == 'admin'
@@ -19,7 +22,8 @@ def add_clinic(clinic: schemas.ClinicCreate, db: Session = Depends(get_db),
     if isAdmin:
         # Create a new Clinic object from the provided data
         new_clinic = models.Clinic(**clinic.dict())
-        all_clinics = db.query(models.Clinic).all()
+        # Deleted clinics keep their name until they are purged, so they are checked too
+        all_clinics = db.query(models.Clinic).execution_options(include_deleted=True).all()
 
         # Check if clinic's name is already in the database.
         if clinic.name in [cli.name for cli in all_clinics]:
@@ -29,10 +33,13 @@ def add_clinic(clinic: schemas.ClinicCreate, db: Session = Depends(get_db),
 
         # Add the new clinic to the database session
         db.add(new_clinic)
+        db.flush()
+        audit.created(db, current_user.id, new_clinic)
 
         # Commit the transaction to the database
         db.commit()
-
+        search.invalidate("clinics")
+        geo.invalidate()
         # Refresh the object in the session to get the updated state from the database
         db.refresh(new_clinic)
 
@@ -44,17 +51,41 @@ def add_clinic(clinic: schemas.ClinicCreate, db: Session = Depends(get_db),
                             detail="Only admin can add new clinic.")
 
 ########################### GET ALL CLINICS [ READ ] ###########################
-@router.get("/", response_model=List[schemas.ClinicResponseData])
-def get_clinics(db: Session = Depends(get_db)):
+# With ?since=<X-Sync-Token of a previous response> only the clinics changed and the ids of those deleted since then are returned
+@router.get("/", response_model=Union[List[schemas.ClinicResponseData], schemas.ClinicDeltaResponseData])
+def get_clinics(response: Response, since: Optional[str] = None, ids: Optional[str] = None,
+                db: Session = Depends(get_read_db)):
+    # With ?ids=1,2,3 only those clinics are returned (one IN query), in the order given
+    if ids is not None:
+        if since is not None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids and since cannot be combined")
+        return loaders.fetch_by_ids(db.query(models.Clinic), models.Clinic.id, loaders.parse_ids(ids))
+
+    since_time = sync.parse_since(since) if since is not None else None
+    sync_token = sync.start_sync(db, response)
+
+    if since_time is not None:
+        changed, deleted = sync.changes(db, models.Clinic, since_time)
+        return {"changed": changed, "deleted": deleted, "sync_token": sync_token}
+
     # Retrieve all clinics from the database
     all_clinics = db.query(models.Clinic).all()
 
     # Return the list of clinics
     return all_clinics
 
+########################### NEAREST CLINICS WITH A FREE SLOT [ READ ] ###########################
+# Clinics closest to the given location that have a free slot on `date` (default today), ranked by
+# distance, then earliest slot. Declared before /{clinic_id} so "nearest" is not read as an ID.
+@router.get("/nearest", response_model=List[schemas.NearestClinicResponseData])
+def get_nearest_clinics(latitude: float = Query(..., ge=-90, le=90), longitude: float = Query(..., ge=-180, le=180),
+                        date: Optional[str] = None, limit: int = Query(5, ge=1, le=50),
+                        max_distance_km: Optional[float] = Query(None, gt=0), db: Session = Depends(get_read_db)):
+    return geo.nearest_available(db, latitude, longitude, date, limit, max_distance_km)
+
 ########################### GET CLINIC WITH ID [ READ ] ###########################
 @router.get("/{clinic_id}", response_model=schemas.ClinicResponseData)
-def get_clinic(clinic_id: int, db: Session = Depends(get_db)):
+def get_clinic(clinic_id: int, db: Session = Depends(get_read_db)):
     # Retrieve a clinic with the specified ID from the database
     clinic = db.query(models.Clinic).filter(models.Clinic.id == clinic_id).first()
 
@@ -66,59 +97,67 @@ def get_clinic(clinic_id: int, db: Session = Depends(get_db)):
     # Return the clinic
     return clinic
 
-########################### UPDATE CLINIC [ UPDATE ] ###########################
-@router.put("/{clinic_id}", response_model=schemas.ClinicResponseData)
-def update_clinic(clinic_id: int, clinic_update: schemas.ClinicUpdate, db: Session = Depends(get_db),
-                  current_user: dict = Depends(oauth2.get_current_user)):
-    # Query the database for the clinic with the specified ID
-    clinic_query = db.query(models.Clinic).filter(models.Clinic.id == clinic_id)
+########################### CLINIC CALENDAR FEED [ READ ] ###########################
+# iCalendar feed of the schedules and booked appointments of every doctor at the clinic
+@router.get("/{clinic_id}/calendar.ics", response_class=Response)
+def get_clinic_calendar(clinic_id: int, request: Request, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                        db: Session = Depends(get_read_db),
+                        current_user: schemas.TokenData = Depends(oauth2.get_calendar_user)):
+    if current_user.role not in ('admin', 'doctor'):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Only admins and doctors can read a clinic's calendar.")
 
-    # If clinic is not found, raise a not found exception
-    if not clinic_query.first():
+    clinic = db.query(models.Clinic).filter(models.Clinic.id == clinic_id).first()
+    if not clinic:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Clinic with ID: {clinic_id}, not found!")
 
-    # Check if the user is an admin
-    if current_user.role != 'admin':
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail=f"Only admin can update a clinic")
+    return ical.feed_response(request, db, "clinic", clinic_id, clinic.name, date_from, date_to)
 
-    # Update the clinic's attributes with the provided data
-    clinic_query.update(clinic_update.model_dump(exclude_unset=True), synchronize_session=False)
+########################### UPDATE CLINIC [ UPDATE ] ###########################
+@router.put("/{clinic_id}", response_model=schemas.ClinicResponseData)
+def update_clinic(clinic_id: int, clinic_update: schemas.ClinicUpdate, db: Session = Depends(get_write_db),
+                  current_user: dict = Depends(oauth2.get_current_user), if_match: Optional[str] = Header(None)):
+    # Update the clinic in one statement that also checks existence, the admin role and the version
+    result = mutations.update_returning(
+        db, models.Clinic, clinic_id, clinic_update.model_dump(exclude_unset=True),
+        allowed=current_user.role == 'admin', expected_version=mutations.parse_if_match(if_match),
+    )
+    mutations.check_outcome(result.outcome,
+                            not_found_detail=f"Clinic with ID: {clinic_id}, not found!",
+                            forbidden_detail=f"Only admin can update a clinic")
+    audit.updated(db, current_user.id, result.previous, result.instance)
 
     # Commit the transaction to the database
     db.commit()
-
-    # Refresh the clinic object in the session to get the updated state from the database
-    db.refresh(clinic_query.first())
-
+    search.invalidate("clinics")
+    geo.invalidate()
     # Return the updated clinic
-    return clinic_query.first()
+    return result.instance
 
 ########################### DELETE CLINIC [ DELETE ] ###########################
-@router.delete("/{clinic_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_clinic(clinic_id: int, db: Session = Depends(get_db),
-                  current_user: dict = Depends(oauth2.get_current_user)):
-    # Query the database for the clinic with the specified ID
-    clinic_query = db.query(models.Clinic).filter(models.Clinic.id == clinic_id)
-    clinic = clinic_query.first()
-
-    # If clinic is not found, raise a not found exception
-    if not clinic:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"Clinic with ID: {clinic_id}, not found!")
-
-    # Check if the user is an admin
-    if current_user.role != 'admin':
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail=f"Only admin can delete a clinic")
-
-    # Delete the clinic from the database
-    clinic_query.delete(synchronize_session=False)
+# The clinic and its schedules are removed at once; its appointments are purged in the background
+# by the returned job (202 Accepted, Location: /purge-jobs/{id})
+@router.delete("/{clinic_id}", response_model=schemas.PurgeJobResponseData, status_code=status.HTTP_202_ACCEPTED)
+def delete_clinic(clinic_id: int, response: Response, db: Session = Depends(get_write_db),
+                  current_user: dict = Depends(oauth2.get_current_user), if_match: Optional[str] = Header(None)):
+    # Soft-delete the clinic in one statement that also checks existence and the admin role
+    result = mutations.update_returning(
+        db, models.Clinic, clinic_id, {"deleted_at": func.now()},
+        allowed=current_user.role == 'admin', expected_version=mutations.parse_if_match(if_match),
+    )
+    mutations.check_outcome(result.outcome,
+                            not_found_detail=f"Clinic with ID: {clinic_id}, not found!",
+                            forbidden_detail=f"Only admin can delete a clinic")
+    audit.deleted(db, current_user.id, result.previous)
+    purge.remove_schedules(db, models.DoctorSchedule.clinic_fkey, clinic_id, current_user.id)
+    job = purge.enqueue(db, "clinics", clinic_id, current_user.id)
 
     # Commit the transaction to the database
     db.commit()
-
-    # Return a response with no content (204 No Content)
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
-
+    db.refresh(job)
+    search.invalidate("clinics")
+    geo.invalidate()
+    # Return the purge job, with a link to follow its progress
+    response.headers["Location"] = f"/purge-jobs/{job.id}"
+    return job
@@ -1,19 +1,22 @@
-from typing import List
-from fastapi import Depends, Response, HTTPException, APIRouter, status
+from typing import List, Optional, Union
+from fastapi import Depends, Header, Request, Response, HTTPException, APIRouter, status
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from .. import models, schemas, oauth2
-from ..database import get_db
+from .. import models, schemas, oauth2, mutations, loaders, search, availability, sync, waitlist, ical, audit, purge
+from ..database import get_read_db, get_write_db
+from ..negotiation import NegotiatedRoute
 
 router = APIRouter(
-    prefix='/doctors'
+    prefix='/doctors',
+    route_class=NegotiatedRoute
 )
 
 ########################### ADD NEW DOCTOR [ CREATE ] ###########################
 
 # Endpoint to add a new doctor. Requires an authenticated admin user.
 @router.post("/", response_model=schemas.DoctorResponseData, status_code=status.HTTP_201_CREATED)
-def add_doctor(doctor: schemas.DoctorCreate, db: Session = Depends(get_db), 
+def add_doctor(doctor: schemas.DoctorCreate, db: Session = Depends(get_write_db), 
                current_user: dict = Depends(oauth2.get_current_user)):
     
     # Check if the current user is an admin.
@@ -22,7 +25,8 @@ def add_doctor(doctor: schemas.DoctorCreate, db: Session = Depends(get_db),
     if isAdmin:
         # Create a new Doctor instance from the incoming data.
         new_doctor = models.Doctor(**doctor.dict())
-        all_doctors = db.query(models.Doctor).all()
+        # Deleted doctors keep their name until they are purged, so they are checked too
+        all_doctors = db.query(models.Doctor).execution_options(include_deleted=True).all()
 
         # Check if doctor's name is already in the database.
         if doctor.name in [doc.name for doc in all_doctors]:
@@ -32,9 +36,12 @@ def add_doctor(doctor: schemas.DoctorCreate, db: Session = Depends(get_db),
 
         # Add the new doctor to the database.
         db.add(new_doctor)
+        db.flush()
+        audit.created(db, current_user.id, new_doctor)
 
         # Commit the transaction to persist the changes.
         db.commit()
+        search.invalidate("doctors")
 
         # Refresh the doctor object to ensure it reflects the database state.
         db.refresh(new_doctor)
@@ -47,9 +54,23 @@ def add_doctor(doctor: schemas.DoctorCreate, db: Session = Depends(get_db),
 
 ########################### GET ALL DOCTORS [ READ ] ###########################
 
-# Endpoint to retrieve a list of all doctors.
-@router.get("/", response_model=List[schemas.DoctorResponseData])
-def get_doctors(db: Session = Depends(get_db)):
+# Endpoint to retrieve a list of all doctors. With ?since=<X-Sync-Token of a previous response>
+# only the doctors changed and the ids of those deleted since then are returned.
+@router.get("/", response_model=Union[List[schemas.DoctorResponseData], schemas.DoctorDeltaResponseData])
+def get_doctors(response: Response, since: Optional[str] = None, ids: Optional[str] = None,
+                db: Session = Depends(get_read_db)):
+    # With ?ids=1,2,3 only those doctors are returned (one IN query), in the order given
+    if ids is not None:
+        if since is not None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids and since cannot be combined")
+        return loaders.fetch_by_ids(db.query(models.Doctor), models.Doctor.id, loaders.parse_ids(ids))
+
+    since_time = sync.parse_since(since) if since is not None else None
+    sync_token = sync.start_sync(db, response)
+
+    if since_time is not None:
+        changed, deleted = sync.changes(db, models.Doctor, since_time)
+        return {"changed": changed, "deleted": deleted, "sync_token": sync_token}
 
     # Query the database to retrieve all doctors.
     all_doctors = db.query(models.Doctor).all()
@@ -61,7 +82,7 @@ def get_doctors(db: Session = Depends(get_db)):
 
 # Endpoint to retrieve a specific doctor by ID.
 @router.get("/{doctor_id}", response_model=schemas.DoctorResponseData)
-def get_doctor(doctor_id: int, db: Session = Depends(get_db)):
+def get_doctor(doctor_id: int, db: Session = Depends(get_read_db)):
 
     # Query the database to retrieve the doctor with the specified ID.
     doctor = db.query(models.Doctor).filter(models.Doctor.id == doctor_id).first()
@@ -74,66 +95,78 @@ def get_doctor(doctor_id: int, db: Session = Depends(get_db)):
     return doctor
 
 
+########################### DOCTOR CALENDAR FEED [ READ ] ###########################
+
+# iCalendar feed of the doctor's schedules and booked appointments, for admins and doctors.
+# Calendar apps pass a feed token as ?token= and revalidate with If-None-Match (304 when unchanged).
+@router.get("/{doctor_id}/calendar.ics", response_class=Response)
+def get_doctor_calendar(doctor_id: int, request: Request, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                        db: Session = Depends(get_read_db),
+                        current_user: schemas.TokenData = Depends(oauth2.get_calendar_user)):
+    if current_user.role not in ('admin', 'doctor'):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Only admins and doctors can read a doctor's calendar.")
+
+    doctor = db.query(models.Doctor).filter(models.Doctor.id == doctor_id).first()
+    if not doctor:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Doctor with ID: {doctor_id}, not found!")
+
+    return ical.feed_response(request, db, "doctor", doctor_id, doctor.name, date_from, date_to)
+
+
 ########################### UPDATE DOCTOR [ UPDATE ] ###########################
 
 # Endpoint to update a doctor's information by ID. Requires an authenticated admin user.
 @router.put("/{doctor_id}", response_model=schemas.DoctorResponseData)
-def update_doctor(doctor_id: int, doctor_update: schemas.DoctorUpdate, db: Session = Depends(get_db),
-                  current_user: dict = Depends(oauth2.get_current_user)):
-
-    # Query the database to find the doctor to be updated.
-    doc_query = db.query(models.Doctor).filter(models.Doctor.id == doctor_id)
-
-    if not doc_query.first():
-        # Raise a Not Found error if the doctor is not found.
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
-                            detail=f"Doctor with ID: {doctor_id}, not found!")
-    
-    if current_user.role != 'admin':
-        # Raise a Forbidden error if the user is not an admin.
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
-                            detail=f"Only admin can update a doctor")
-    
-    # Update the doctor's data in the database.
-    doc_query.update(doctor_update.model_dump(exclude_unset=True), synchronize_session=False)
+def update_doctor(doctor_id: int, doctor_update: schemas.DoctorUpdate, db: Session = Depends(get_write_db),
+                  current_user: dict = Depends(oauth2.get_current_user), if_match: Optional[str] = Header(None)):
+
+    # Update the doctor's data in one statement that also checks existence, the admin role and the version.
+    result = mutations.update_returning(
+        db, models.Doctor, doctor_id, doctor_update.model_dump(exclude_unset=True),
+        allowed=current_user.role == 'admin', expected_version=mutations.parse_if_match(if_match),
+    )
+    mutations.check_outcome(result.outcome,
+                            not_found_detail=f"Doctor with ID: {doctor_id}, not found!",
+                            forbidden_detail=f"Only admin can update a doctor")
+    audit.updated(db, current_user.id, result.previous, result.instance)
 
     # Commit the transaction to persist the changes.
     db.commit()
+    search.invalidate("doctors")
 
-    # Refresh the doctor object to ensure it reflects the updated state.
-    db.refresh(doc_query.first())
-
-    return doc_query.first()
+    return result.instance
 
 
 ########################### DELETE DOCTOR [ DELETE ] ###########################
 
-# Endpoint to delete a doctor by ID. Requires an authenticated admin user.
-@router.delete("/{doctor_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_doctor(doctor_id: int, db: Session = Depends(get_db), 
-                  current_user: dict = Depends(oauth2.get_current_user)):
-
-    # Query the database to find the doctor to be deleted.
-    doc_query = db.query(models.Doctor).filter(models.Doctor.id == doctor_id)
-    doctor = doc_query.first()
-
-    if not doctor:
-        # Raise a Not Found error if the doctor is not found.
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
-                            detail=f"Doctor with ID: {doctor_id}, not found!")
-    
-    if current_user.role != 'admin':
-        # Raise a Forbidden error if the user is not an admin.
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
-                            detail=f"Only admin can delete a doctor")
-    
-    # Delete the doctor from the database.
-    doc_query.delete(synchronize_session=False)
+# Endpoint to delete a doctor by ID. Requires an authenticated admin user. The doctor and their
+# schedules are removed at once; their waitlist entries and appointments are purged in the
+# background by the returned job (202 Accepted, Location: /purge-jobs/{id}).
+@router.delete("/{doctor_id}", response_model=schemas.PurgeJobResponseData, status_code=status.HTTP_202_ACCEPTED)
+def delete_doctor(doctor_id: int, response: Response, db: Session = Depends(get_write_db), 
+                  current_user: dict = Depends(oauth2.get_current_user), if_match: Optional[str] = Header(None)):
+
+    # Soft-delete the doctor in one statement that also checks existence and the admin role.
+    result = mutations.update_returning(
+        db, models.Doctor, doctor_id, {"deleted_at": func.now()},
+        allowed=current_user.role == 'admin', expected_version=mutations.parse_if_match(if_match),
+    )
+    mutations.check_outcome(result.outcome,
+                            not_found_detail=f"Doctor with ID: {doctor_id}, not found!",
+                            forbidden_detail=f"Only admin can delete a doctor")
+    audit.deleted(db, current_user.id, result.previous)
+    purge.remove_schedules(db, models.DoctorSchedule.doctor_fkey, doctor_id, current_user.id)
+    job = purge.enqueue(db, "doctors", doctor_id, current_user.id)
 
     # Commit the transaction to persist the changes.
     db.commit()
+    db.refresh(job)
+    search.invalidate("doctors")
 
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
+    response.headers["Location"] = f"/purge-jobs/{job.id}"
+    return job
 
 
 ########################################################################################
@@ -144,7 +177,7 @@ def delete_doctor(doctor_id: int, db: Session = Depends(get_db),
 ####📌 work on the schedule. if doctor is not added return a 404 error 📌###
 # Endpoint to retrieve all schedules for a specific doctor identified by 'doctor_id'
 @router.get("/{doctor_id}/schedules", response_model=List[schemas.DoctorScheduleResponseData])
-def get_doctor_schedules(doctor_id: int, db: Session = Depends(get_db)):
+def get_doctor_schedules(doctor_id: int, db: Session = Depends(get_read_db)):
     # Query the database to retrieve all schedules for the specified doctor
     doctor_schedule = db.query(models.DoctorSchedule).filter(models.DoctorSchedule.doctor_id == doctor_id).all()
 
@@ -161,56 +194,49 @@ def get_doctor_schedules(doctor_id: int, db: Session = Depends(get_db)):
 
 # Endpoint to update a specific doctor's schedule identified by 'id'
 @router.put("/{schedule_id}/schedules", response_model=schemas.DoctorScheduleResponseData)
-def update_doctor_schedules(schedule_id: int, schedule_update: schemas.DoctorScheduleUpdate, db: Session = Depends(get_db),
-                         current_user: dict = Depends(oauth2.get_current_user)):
-    # Query the database to retrieve the doctor schedule with the given 'id'
-    schedules_query = db.query(models.DoctorSchedule).filter(models.DoctorSchedule.schedule_id == schedule_id)
-    schedule = schedules_query.first()
-
-    # If no schedule is found, raise a 404 error
-    if not schedule:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
-                            detail=f"Doctor Schedule with ID: {schedule_id}, not found!")
-
-    # Only admin users are allowed to update doctor schedules
-    if current_user.role != 'admin':
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
-                            detail=f"Only admin can update doctor schedule.")
-    
-    # Update the doctor schedule with the provided data
-    schedules_query.update(schedule_update.model_dump(exclude_unset=True), synchronize_session=False)
+def update_doctor_schedules(schedule_id: int, schedule_update: schemas.DoctorScheduleUpdate, db: Session = Depends(get_write_db),
+                         current_user: dict = Depends(oauth2.get_current_user), if_match: Optional[str] = Header(None)):
+    # Update the doctor schedule in one statement; only admin users are allowed to update doctor schedules
+    result = mutations.update_returning(
+        db, models.DoctorSchedule, schedule_id, schedule_update.model_dump(exclude_unset=True),
+        allowed=current_user.role == 'admin', expected_version=mutations.parse_if_match(if_match),
+    )
+    mutations.check_outcome(result.outcome,
+                            not_found_detail=f"Doctor Schedule with ID: {schedule_id}, not found!",
+                            forbidden_detail=f"Only admin can update doctor schedule.")
+    audit.updated(db, current_user.id, result.previous, result.instance)
+
+    # Tell availability subscribers; a schedule moved to another doctor or date is removed from the old one
+    previous, schedule = result.previous, result.instance
+    if (previous.doctor_id, previous.date) != (schedule.doctor_id, schedule.date):
+        availability.schedule_removed(db, previous)
+    availability.schedule_changed(db, schedule)
+
+    # Book slots the update added for patients on the doctor's waitlist for that date
+    waitlist.backfill_schedule(db, schedule, previous)
 
     # Commit the changes to the database
     db.commit()
 
-    # Refresh and retrieve the updated doctor schedule
-    db.refresh(schedule)
-
-    return schedule
+    return result.instance
 
 
 ########################### DELETE DOCTORS SCHEDULES WITH ID [ DELETE ] ###########################
 
 # Endpoint to delete a specific doctor's schedule identified by 'id'
 @router.delete("/{schedule_id}/schedules", status_code=status.HTTP_204_NO_CONTENT)
-def delete_doctor_schedules(schedule_id: int, db: Session = Depends(get_db),
-                         current_user: dict = Depends(oauth2.get_current_user)):
-    # Query the database to retrieve the doctor schedule with the given 'id'
-    schedule_query = db.query(models.DoctorSchedule).filter(models.DoctorSchedule.schedule_id == schedule_id)
-    schedule = schedule_query.first()
-
-    # If no schedule is found, raise a 404 error
-    if not schedule:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
-                            detail=f"Doctor Schedule with ID: {schedule_id}, not found!")
-
-    # Only admin users are allowed to delete doctor schedules
-    if current_user.role != 'admin':
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
-                            detail=f"Only admin can delete doctor schedule.")
-    
-    # Delete the doctor schedule from the database
-    schedule_query.delete(synchronize_session=False)
+def delete_doctor_schedules(schedule_id: int, db: Session = Depends(get_write_db),
+                         current_user: dict = Depends(oauth2.get_current_user), if_match: Optional[str] = Header(None)):
+    # Delete the doctor schedule in one statement; only admin users are allowed to delete doctor schedules
+    result = mutations.delete_returning(
+        db, models.DoctorSchedule, schedule_id,
+        allowed=current_user.role == 'admin', expected_version=mutations.parse_if_match(if_match),
+    )
+    mutations.check_outcome(result.outcome,
+                            not_found_detail=f"Doctor Schedule with ID: {schedule_id}, not found!",
+                            forbidden_detail=f"Only admin can delete doctor schedule.")
+    audit.deleted(db, current_user.id, result.previous)
+    availability.schedule_removed(db, result.previous)
 
     # Commit the changes to the database
     db.commit()
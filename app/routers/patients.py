@@ -1,17 +1,19 @@
-from typing import List
-from fastapi import Depends, Response, HTTPException, APIRouter, status
+from typing import List, Optional
+from fastapi import Depends, Header, Response, HTTPException, APIRouter, status
 from sqlalchemy.orm import Session
 
-from .. import models, schemas, oauth2
-from .. database import get_db
+from .. import models, schemas, oauth2, mutations, loaders, audit, availability, booking, waitlist
+from ..database import get_read_db, get_write_db
+from ..negotiation import NegotiatedRoute
 
 router = APIRouter(
-    prefix='/patients'
+    prefix='/patients',
+    route_class=NegotiatedRoute
 )
 
 ########################### ADD NEW PATIENT [ CREATE ] ###########################
 @router.post("/", response_model=schemas.PatientResponseData, status_code=status.HTTP_201_CREATED)
-def add_patient(patient: schemas.PatientCreate, db: Session = Depends(get_db),
+def add_patient(patient: schemas.PatientCreate, db: Session = Depends(get_write_db),
                 current_user: dict = Depends(oauth2.get_current_user)):
     # Create a new Patient instance, associating it with the current user ID
     new_patient = models.Patient(user_id=current_user.id, **patient.dict())
@@ -26,6 +28,8 @@ def add_patient(patient: schemas.PatientCreate, db: Session = Depends(get_db),
                             detail=f"The information of '{patient.name}' has been successfully added already.")
     
     db.add(new_patient)  # Add the new patient to the database
+    db.flush()  # Assign the patient's ID
+    audit.created(db, current_user.id, new_patient)  # Record the change, written to the audit log after commit
     db.commit()  # Commit the transaction
     db.refresh(new_patient)  # Refresh the instance to ensure its attributes are up-to-date
 
@@ -33,7 +37,7 @@ def add_patient(patient: schemas.PatientCreate, db: Session = Depends(get_db),
 
 ########################## GET PATIENT WITH ID [ READ ] ###########################
 @router.get("/{patient_id}", response_model=schemas.PatientResponseData)
-def get_patient(patient_id: int, db: Session = Depends(get_db)):
+def get_patient(patient_id: int, db: Session = Depends(get_read_db)):
     # Query the database for a patient with the specified ID
     patient = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
 
@@ -46,64 +50,66 @@ def get_patient(patient_id: int, db: Session = Depends(get_db)):
 
 ########################### GET ALL PATIENTS [ READ ] ###########################
 @router.get("/", response_model=List[schemas.PatientResponseData])
-def get_patients(db: Session = Depends(get_db), 
+def get_patients(ids: Optional[str] = None, db: Session = Depends(get_read_db), 
                  current_user: dict = Depends(oauth2.get_current_user)):
     
-    # Check if the current user is an admin, show all patients.
-    if current_user.role == 'admin':
-        all_patients = db.query(models.Patient).all()
-    else:
-        # Query the database to retrieve all patients created by the current user.
-        all_patients = db.query(models.Patient).filter(models.Patient.user_id == current_user.id).all()
+    # Admins see all patients; other users only the patients they created.
+    patients_query = db.query(models.Patient)
+    if current_user.role != 'admin':
+        patients_query = patients_query.filter(models.Patient.user_id == current_user.id)
+
+    # With ?ids=1,2,3 only those patients are returned (one IN query), in the order given
+    if ids is not None:
+        return loaders.fetch_by_ids(patients_query, models.Patient.id, loaders.parse_ids(ids))
+
+    all_patients = patients_query.all()
 
     return all_patients  # Return the list of all patients
 
 ########################### UPDATE PATIENT [ UPDATE ] ###########################
 @router.put("/{patient_id}", response_model=schemas.PatientResponseData)
-def update_patient(patient_id: int, patient_update: schemas.PatientUpdate, db: Session = Depends(get_db),
-                   current_user: dict = Depends(oauth2.get_current_user)):
-    # Query the database for the patient to be updated
-    patient_query = db.query(models.Patient).filter(models.Patient.id == patient_id)
-    patient = patient_query.first()
-
-    if not patient:
-        # If patient doesn't exist, raise a 404 Not Found error
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"Patient with ID: {patient_id} not found!")
-
-    if patient.user_id != current_user.id and current_user.role != 'admin':
-        # If the current user is not the owner or an admin, raise a 403 Forbidden error
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail=f"You don't have permission to update this patient")
-
-    # Update patient attributes based on the provided update data
-    patient_query.update(patient_update.model_dump(exclude_unset=True), synchronize_session=False)
+def update_patient(patient_id: int, patient_update: schemas.PatientUpdate, db: Session = Depends(get_write_db),
+                   current_user: dict = Depends(oauth2.get_current_user), if_match: Optional[str] = Header(None)):
+    # Update patient attributes in one statement; only the owner or an admin may update the patient
+    result = mutations.update_returning(
+        db, models.Patient, patient_id, patient_update.model_dump(exclude_unset=True),
+        allowed=current_user.role == 'admin', owner_column=models.Patient.user_id, owner_id=current_user.id,
+        expected_version=mutations.parse_if_match(if_match),
+    )
+    mutations.check_outcome(result.outcome,
+                            not_found_detail=f"Patient with ID: {patient_id} not found!",
+                            forbidden_detail=f"You don't have permission to update this patient")
+    audit.updated(db, current_user.id, result.previous, result.instance)
     db.commit()  # Commit the transaction
 
-    db.refresh(patient_query.first())  # Refresh the patient instance
-
-    return patient  # Return the updated patient
+    return result.instance  # Return the updated patient
 
 ########################### DELETE PATIENT [ DELETE ] ###########################
 @router.delete("/{patient_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user(patient_id: int, db: Session = Depends(get_db),
-                current_user: dict = Depends(oauth2.get_current_user)):
-    # Query the database for the patient to be deleted
-    patient_query = db.query(models.Patient).filter(models.Patient.id == patient_id)
-    patient = patient_query.first()
-
-    if not patient:
-        # If patient doesn't exist, raise a 404 Not Found error
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"Patient with ID: {patient_id} not found!")
-
-    if patient.user_id != current_user.id and current_user.role != 'admin':
-        # If the current user is not the owner or an admin, raise a 403 Forbidden error
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail=f"You don't have permission to delete this patient")
-
-    patient_query.delete(synchronize_session=False)  # Delete the patient from the database
+def delete_user(patient_id: int, db: Session = Depends(get_write_db),
+                current_user: dict = Depends(oauth2.get_current_user), if_match: Optional[str] = Header(None)):
+    # The slots of the patient's booked appointments, which the delete frees through the foreign key cascade
+    Appointment = models.Appointment
+    freed = db.query(Appointment.doctor_id, Appointment.clinic_id, Appointment.appointment_date, Appointment.appointment_time) \
+        .filter(Appointment.patient_fkey == patient_id, Appointment.appointment_status == 'booked') \
+        .distinct().order_by(Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_time).all()
+
+    # Delete the patient in one statement; only the owner or an admin may delete the patient
+    result = mutations.delete_returning(
+        db, models.Patient, patient_id,
+        allowed=current_user.role == 'admin', owner_column=models.Patient.user_id, owner_id=current_user.id,
+        expected_version=mutations.parse_if_match(if_match),
+    )
+    mutations.check_outcome(result.outcome,
+                            not_found_detail=f"Patient with ID: {patient_id} not found!",
+                            forbidden_detail=f"You don't have permission to delete this patient")
+    audit.deleted(db, current_user.id, result.previous)
+
+    # The appointments trigger gave their seats back; offer each freed seat to the waitlist
+    for slot in freed:
+        remaining = booking.seats_left(db, slot.doctor_id, slot.appointment_date, slot.appointment_time)
+        availability.slot_freed(db, slot, remaining)
+        waitlist.backfill(db, slot.doctor_id, slot.clinic_id, slot.appointment_date, slot.appointment_time)
     db.commit()  # Commit the transaction
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)  # Return a 204 No Content response
-
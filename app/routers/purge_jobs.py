@@ -0,0 +1,43 @@
+from typing import List, Optional
+from fastapi import Depends, HTTPException, APIRouter, Query, status
+from sqlalchemy.orm import Session
+
+from .. import models, schemas, oauth2
+from ..database import get_read_db
+
+router = APIRouter(
+    prefix='/purge-jobs'
+)
+
+########################### GET PURGE JOB WITH ID [ READ ] ###########################
+
+# Endpoint to follow the purge started by deleting a doctor, clinic or user (the DELETE response
+# links here). Visible to admins and to the user who made the delete.
+@router.get("/{job_id}", response_model=schemas.PurgeJobResponseData)
+def get_purge_job(job_id: int, db: Session = Depends(get_read_db), current_user: dict = Depends(oauth2.get_current_user)):
+    job = db.query(models.PurgeJob).filter(models.PurgeJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Purge job with ID: {job_id}, not found!")
+    if job.requested_by != current_user.id and current_user.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="You don't have permission to view this purge job")
+
+    return job
+
+
+########################### GET ALL PURGE JOBS [ READ ] ###########################
+
+# Endpoint to list purge jobs, newest first, optionally by status. Requires an authenticated admin user.
+@router.get("/", response_model=List[schemas.PurgeJobResponseData])
+def get_purge_jobs(job_status: Optional[str] = Query(None, alias="status"), db: Session = Depends(get_read_db),
+                   current_user: dict = Depends(oauth2.get_current_user)):
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Only admin can view purge jobs.")
+
+    jobs_query = db.query(models.PurgeJob)
+    if job_status is not None:
+        jobs_query = jobs_query.filter(models.PurgeJob.status == job_status)
+
+    return jobs_query.order_by(models.PurgeJob.id.desc()).limit(100).all()
@@ -1,12 +1,14 @@
-from typing import List
-from fastapi import Depends, HTTPException, APIRouter, status
+from typing import List, Optional, Union
+from fastapi import Depends, HTTPException, APIRouter, Response, status
 from sqlalchemy.orm import Session
 
-from .. import models, schemas, oauth2
-from ..database import get_db
+from .. import models, schemas, oauth2, availability, sync, loaders, waitlist, audit
+from ..database import get_read_db, get_write_db
+from ..negotiation import NegotiatedRoute
 
 router = APIRouter(
-    prefix='/schedules'
+    prefix='/schedules',
+    route_class=NegotiatedRoute
 )
 
 ########################### ADD NEW DOCTOR SCHEDULE [ CREATE ] ###########################
@@ -16,7 +18,7 @@ router = APIRouter(
 # Authentication through OAuth2 is enforced, and the user must have the 'admin' role.
 
 @router.post("/", response_model=schemas.DoctorScheduleResponseData, status_code=status.HTTP_201_CREATED)
-def add_schedule(schedule_data: schemas.DoctorScheduleCreate, db: Session = Depends(get_db), 
+def add_schedule(schedule_data: schemas.DoctorScheduleCreate, db: Session = Depends(get_write_db), 
                  current_user: dict = Depends(oauth2.get_current_user)):
     
     # Get doctor and clinic based on IDs from the payload.
@@ -63,8 +65,14 @@ def add_schedule(schedule_data: schemas.DoctorScheduleCreate, db: Session = Depe
                 detail=f"{doctor.name} has already been scheduled for this timeframe."
             )
 
-        # Add the new schedule to the database.
+        # Add the new schedule to the database and tell availability subscribers once it commits.
         db.add(new_schedule)
+        availability.schedule_changed(db, new_schedule)
+        db.flush()
+        audit.created(db, current_user.id, new_schedule)
+
+        # Book the new slots for patients on the doctor's waitlist for that date, in the same transaction.
+        waitlist.backfill_schedule(db, new_schedule)
 
         # Commit the changes to the database.
         db.commit()
@@ -87,13 +95,24 @@ def add_schedule(schedule_data: schemas.DoctorScheduleCreate, db: Session = Depe
 
 # This route allows retrieving all doctor schedules. It returns a list of doctor schedules
 # in the response. No authentication is required for this route.
-@router.get("/", response_model=List[schemas.DoctorScheduleResponseData])
-def get_schedules(db: Session = Depends(get_db)):
+# Every response carries an X-Sync-Token header; passing it back as ?since= returns only the
+# schedules changed since then and the ids of the deleted ones, instead of the whole list.
+@router.get("/", response_model=Union[List[schemas.DoctorScheduleResponseData], schemas.DoctorScheduleDeltaResponseData])
+def get_schedules(response: Response, since: Optional[str] = None, db: Session = Depends(get_read_db),
+                  batch: loaders.Loaders = Depends(loaders.get_loaders)):
+    since_time = sync.parse_since(since) if since is not None else None
+    sync_token = sync.start_sync(db, response)
+
+    if since_time is not None:
+        changed, deleted = sync.changes(db, models.DoctorSchedule, since_time)
+        batch.prefetch(changed, models.DoctorSchedule.doctor, models.DoctorSchedule.clinic)
+        return {"changed": changed, "deleted": deleted, "sync_token": sync_token}
+
     # Query the database to retrieve all doctor schedules.
     all_schedules = db.query(models.DoctorSchedule).all()
 
-    # Return the list of schedules as a response.
-    return all_schedules
+    # Return the list of schedules as a response, with their doctors and clinics loaded with one query each.
+    return batch.prefetch(all_schedules, models.DoctorSchedule.doctor, models.DoctorSchedule.clinic)
 
 
 
@@ -0,0 +1,51 @@
+from typing import List
+from fastapi import Depends, APIRouter, Query
+from sqlalchemy.orm import Session
+
+from .. import models, schemas, oauth2, search
+from ..database import get_read_db
+from ..negotiation import NegotiatedRoute
+
+router = APIRouter(
+    prefix='/search',
+    route_class=NegotiatedRoute
+)
+
+# Shared query parameters: the text typed so far and the number of results wanted
+SEARCH_TEXT = Query(..., min_length=1, max_length=100)
+RESULT_LIMIT = Query(10, ge=1, le=50)
+
+
+########################### SEARCH DOCTORS [ READ ] ###########################
+
+# Doctors whose name or specialty matches q by prefix, substring or fuzzy match, best matches first
+@router.get("/doctors", response_model=List[schemas.DoctorResponseData])
+def search_doctors(q: str = SEARCH_TEXT, limit: int = RESULT_LIMIT, db: Session = Depends(get_read_db)):
+    return search.search(db, models.Doctor, (models.Doctor.name, models.Doctor.specialty), q, limit)
+
+
+# Doctors whose name or specialty has a word starting with q, for type-ahead inputs
+@router.get("/doctors/autocomplete", response_model=List[schemas.SearchSuggestionResponseData])
+def autocomplete_doctors(q: str = SEARCH_TEXT, limit: int = RESULT_LIMIT, db: Session = Depends(get_read_db)):
+    return search.autocomplete(db, "doctors", q, limit)
+
+
+########################### SEARCH CLINICS [ READ ] ###########################
+@router.get("/clinics", response_model=List[schemas.ClinicResponseData])
+def search_clinics(q: str = SEARCH_TEXT, limit: int = RESULT_LIMIT, db: Session = Depends(get_read_db)):
+    return search.search(db, models.Clinic, (models.Clinic.name,), q, limit)
+
+
+@router.get("/clinics/autocomplete", response_model=List[schemas.SearchSuggestionResponseData])
+def autocomplete_clinics(q: str = SEARCH_TEXT, limit: int = RESULT_LIMIT, db: Session = Depends(get_read_db)):
+    return search.autocomplete(db, "clinics", q, limit)
+
+
+########################### SEARCH PATIENTS [ READ ] ###########################
+
+# Admins search all patients, other users only the patients they registered (as in GET /patients)
+@router.get("/patients", response_model=List[schemas.PatientResponseData])
+def search_patients(q: str = SEARCH_TEXT, limit: int = RESULT_LIMIT, db: Session = Depends(get_read_db),
+                    current_user: dict = Depends(oauth2.get_current_user)):
+    filters = () if current_user.role == 'admin' else (models.Patient.user_id == current_user.id,)
+    return search.search(db, models.Patient, (models.Patient.name,), q, limit, filters)
@@ -0,0 +1,74 @@
+from typing import List, Optional
+from fastapi import Depends, HTTPException, APIRouter, status
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .. import models, schemas, oauth2, utilization
+from ..database import get_read_db
+from ..negotiation import NegotiatedRoute
+
+router = APIRouter(
+    prefix='/stats',
+    route_class=NegotiatedRoute
+)
+
+Utilization = models.UtilizationDaily
+
+
+# Statistics are for management only
+def require_admin(current_user: dict = Depends(oauth2.get_current_user)):
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Only admin can view statistics.")
+    return current_user
+
+
+# Filters shared by the utilization endpoints; dates are YYYY-MM-DD and inclusive
+def filtered(query, date_from: Optional[str], date_to: Optional[str], doctor_id: Optional[int], clinic_id: Optional[int]):
+    if date_from is not None:
+        query = query.filter(Utilization.date >= date_from)
+    if date_to is not None:
+        query = query.filter(Utilization.date <= date_to)
+    if doctor_id is not None:
+        query = query.filter(Utilization.doctor_id == doctor_id)
+    if clinic_id is not None:
+        query = query.filter(Utilization.clinic_id == clinic_id)
+    return query
+
+
+def totals(db: Session, key, date_from, date_to, doctor_id, clinic_id):
+    query = db.query(key, func.sum(Utilization.available_slots), func.sum(Utilization.booked_slots))
+    rows = filtered(query, date_from, date_to, doctor_id, clinic_id).group_by(key).order_by(key).all()
+    return [{"id": row_id, "available_slots": available, "booked_slots": booked,
+             "utilization": utilization.ratio(booked, available)} for row_id, available, booked in rows]
+
+
+########################### DAILY UTILIZATION [ READ ] ###########################
+
+# Booked vs. available slots per doctor, clinic and day, read from the incrementally maintained summary
+@router.get("/utilization", response_model=List[schemas.UtilizationDailyResponseData])
+def get_daily_utilization(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                          doctor_id: Optional[int] = None, clinic_id: Optional[int] = None,
+                          db: Session = Depends(get_read_db), current_user: dict = Depends(require_admin)):
+    rows = filtered(db.query(Utilization), date_from, date_to, doctor_id, clinic_id) \
+        .order_by(Utilization.date, Utilization.doctor_id, Utilization.clinic_id).all()
+
+    return [{"doctor_id": row.doctor_id, "clinic_id": row.clinic_id, "date": row.date,
+             "available_slots": row.available_slots, "booked_slots": row.booked_slots,
+             "utilization": utilization.ratio(row.booked_slots, row.available_slots)} for row in rows]
+
+
+########################### UTILIZATION PER DOCTOR [ READ ] ###########################
+@router.get("/utilization/doctors", response_model=List[schemas.UtilizationTotalResponseData])
+def get_doctor_utilization(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                           clinic_id: Optional[int] = None,
+                           db: Session = Depends(get_read_db), current_user: dict = Depends(require_admin)):
+    return totals(db, Utilization.doctor_id, date_from, date_to, None, clinic_id)
+
+
+########################### UTILIZATION PER CLINIC [ READ ] ###########################
+@router.get("/utilization/clinics", response_model=List[schemas.UtilizationTotalResponseData])
+def get_clinic_utilization(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                           doctor_id: Optional[int] = None,
+                           db: Session = Depends(get_read_db), current_user: dict = Depends(require_admin)):
+    return totals(db, Utilization.clinic_id, date_from, date_to, doctor_id, None)
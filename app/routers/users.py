@@ -1,9 +1,11 @@
-from typing import List
-from fastapi import Depends, Response, HTTPException, APIRouter, status
+from typing import List, Optional
+from fastapi import Depends, Header, Request, Response, HTTPException, APIRouter, status
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from .. import models, utils, schemas, oauth2
-from .. database import get_db
+from .. import models, utils, schemas, oauth2, mutations, loaders, ical, audit, purge
+from ..database import get_read_db, get_write_db
+from ..revocation import revocations
 
 router = APIRouter(
     prefix='/users'
@@ -11,7 +13,7 @@ router = APIRouter(
 
 ########################### ADD NEW USER [ CREATE ] ###########################
 @router.post("/", response_model=schemas.UserResponseData, status_code=status.HTTP_201_CREATED)
-def add_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+def add_user(user: schemas.UserCreate, db: Session = Depends(get_write_db)):
     # Hash the password before storing it in the database
     hash_password = utils.get_password_hash(user.password)
     user.password = hash_password
@@ -19,6 +21,9 @@ def add_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     # Create a new user object and add it to the database
     new_user = models.User(**user.dict())
     db.add(new_user)
+    db.flush()
+    # Users register themselves, so the new user is recorded as the author of the change
+    audit.created(db, new_user.id, new_user)
     db.commit()
     db.refresh(new_user)
 
@@ -26,7 +31,11 @@ def add_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
 
 ########################### GET ALL USER [ READ ] ###########################
 @router.get("/", response_model=List[schemas.UserResponseData])
-def get_users(db: Session = Depends(get_db)):
+def get_users(ids: Optional[str] = None, db: Session = Depends(get_read_db)):
+    # With ?ids=1,2,3 only those users are returned (one IN query), in the order given
+    if ids is not None:
+        return loaders.fetch_by_ids(db.query(models.User), models.User.id, loaders.parse_ids(ids))
+
     # Retrieve all user records from the database
     all_users = db.query(models.User).all()
 
@@ -35,7 +44,7 @@ def get_users(db: Session = Depends(get_db)):
 
 ########################## GET USER WITH ID [ READ ] ###########################
 @router.get("/{id}", response_model=schemas.UserResponseData)
-def get_user(id: int, db: Session = Depends(get_db)):
+def get_user(id: int, db: Session = Depends(get_read_db)):
     user = db.query(models.User).filter(models.User.id == id).first()
 
     if not user:
@@ -44,55 +53,70 @@ def get_user(id: int, db: Session = Depends(get_db)):
 
     return user
 
-########################### UPDATE USER [ UPDATE ] ###########################
-@router.put("/{id}", response_model=schemas.UserResponseData)
-def update_user(id: int, user_update: schemas.UserUpdate, db: Session = Depends(get_db),
-                get_user: dict = Depends(oauth2.get_current_user)):
-    
-    # Find the user with the given ID
-    user_query = db.query(models.User).filter(models.User.id == id)
-    user = user_query.first()
+########################### USER CALENDAR FEED [ READ ] ###########################
+# iCalendar feed of the appointments a user booked, for the user and admins
+@router.get("/{id}/calendar.ics", response_class=Response)
+def get_user_calendar(id: int, request: Request, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                      db: Session = Depends(get_read_db),
+                      current_user: schemas.TokenData = Depends(oauth2.get_calendar_user)):
+    if current_user.id != id and current_user.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"You don't have permission to read this calendar")
 
-    # Check if the user exists
+    user = db.query(models.User).filter(models.User.id == id).first()
     if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
-                            detail=f"User with ID: {id} not found!")
-    
-    # Check if the authenticated user has permission to update this user
-    if get_user.username != user.username and get_user.role != 'admin':
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
-                            detail=f"You don't have permission to update this user")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"User with ID: {id}, not found!")
+
+    return ical.feed_response(request, db, "user", id, f"{user.username} appointments", date_from, date_to)
+
+########################### UPDATE USER [ UPDATE ] ###########################
+@router.put("/{id}", response_model=schemas.UserResponseData)
+def update_user(id: int, user_update: schemas.UserUpdate, db: Session = Depends(get_write_db),
+                get_user: dict = Depends(oauth2.get_current_user), if_match: Optional[str] = Header(None)):
     
-    # Update the user record with the provided data
-    user_query.update(user_update.model_dump(exclude_unset=True), synchronize_session=False)
+    # Update the user in one statement; admins may update anyone, other users only themselves.
+    # An If-Match header with the last seen version makes the update fail if the user changed meanwhile.
+    result = mutations.update_returning(
+        db, models.User, id, user_update.model_dump(exclude_unset=True),
+        allowed=get_user.role == 'admin', owner_column=models.User.id, owner_id=get_user.id,
+        expected_version=mutations.parse_if_match(if_match),
+    )
+    mutations.check_outcome(result.outcome,
+                            not_found_detail=f"User with ID: {id} not found!",
+                            forbidden_detail=f"You don't have permission to update this user")
+    audit.updated(db, get_user.id, result.previous, result.instance)
     db.commit()
 
-    # Refresh the user object to get the updated data
-    db.refresh(user_query.first())
+    # Tokens carry the role, so a role change revokes the user's existing tokens
+    if result.previous.role != result.instance.role:
+        revocations.revoke_user(db, id)
 
-    return user
+    return result.instance
 
 
 ########################### DELETE USER [ DELETE ] ###########################
-@router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user(id: int, db: Session = Depends(get_db), 
-                get_user: dict = Depends(oauth2.get_current_user)):
-    # Find the user with the given ID
-    user_query = db.query(models.User).filter(models.User.id == id)
-    user = user_query.first()
-
-    # Check if the user exists
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
-                            detail=f"User with ID: {id} not found!")
-    
-    # Check if the authenticated user has permission to delete this user
-    if get_user.username != user.username and get_user.role != 'admin':
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
-                            detail=f"You don't have permission to delete this user")
-    
-    # Delete the user record
-    user_query.delete(synchronize_session=False)
+# The user is hidden at once; their patients, appointments and waitlist entries are purged in the
+# background by the returned job (202 Accepted, Location: /purge-jobs/{id})
+@router.delete("/{id}", response_model=schemas.PurgeJobResponseData, status_code=status.HTTP_202_ACCEPTED)
+def delete_user(id: int, response: Response, db: Session = Depends(get_write_db), 
+                get_user: dict = Depends(oauth2.get_current_user), if_match: Optional[str] = Header(None)):
+    # Soft-delete the user in one statement, checking existence and permission at the same time
+    result = mutations.update_returning(
+        db, models.User, id, {"deleted_at": func.now()},
+        allowed=get_user.role == 'admin', owner_column=models.User.id, owner_id=get_user.id,
+        expected_version=mutations.parse_if_match(if_match),
+    )
+    mutations.check_outcome(result.outcome,
+                            not_found_detail=f"User with ID: {id} not found!",
+                            forbidden_detail=f"You don't have permission to delete this user")
+    audit.deleted(db, get_user.id, result.previous)
+    job = purge.enqueue(db, "users", id, get_user.id)
     db.commit()
+    db.refresh(job)
+
+    # Tokens are accepted without a user lookup, so the deleted user's tokens are revoked
+    revocations.revoke_user(db, id)
 
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
+    response.headers["Location"] = f"/purge-jobs/{job.id}"
+    return job
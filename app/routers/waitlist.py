@@ -0,0 +1,95 @@
+from datetime import date
+from typing import List
+from fastapi import Depends, HTTPException, APIRouter, Response, status
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models, schemas, oauth2, audit
+from ..database import get_read_db, get_write_db
+from ..negotiation import NegotiatedRoute
+
+router = APIRouter(
+    prefix='/waitlist',
+    route_class=NegotiatedRoute
+)
+
+########################### JOIN WAITLIST [ CREATE ] ###########################
+# Patients join the queue of a doctor, date and time window. When a matching slot is freed by a
+# cancellation or added to the doctor's schedule, it is booked for the highest priority entry.
+@router.post("/", response_model=schemas.WaitlistResponseData, status_code=status.HTTP_201_CREATED)
+def join_waitlist(entry_data: schemas.WaitlistCreate, db: Session = Depends(get_write_db),
+                  current_user: dict = Depends(oauth2.get_current_user)):
+    try:
+        wanted = date.fromisoformat(entry_data.date)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="date must be in YYYY-MM-DD format")
+    if wanted < date.today():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="date must not be in the past")
+
+    # Only admins may queue a patient ahead of others, or for a patient another user created.
+    isAdmin = current_user.role == 'admin'
+    if entry_data.priority != 0 and not isAdmin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admin can set a waitlist priority.")
+
+    patient = db.query(models.Patient).filter(models.Patient.id == entry_data.patient_id).first()
+    if not patient:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Patient with ID: {entry_data.patient_id} not found")
+    if patient.user_id != current_user.id and not isAdmin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"You don't have permission to add this patient to the waitlist")
+
+    doctor = db.query(models.Doctor).filter(models.Doctor.id == entry_data.doctor_id).first()
+    if not doctor:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Doctor with ID: {entry_data.doctor_id} not found")
+
+    # The entry is booked in the patient's owner's name, like an appointment they made themselves
+    new_entry = models.WaitlistEntry(user_id=patient.user_id, **entry_data.dict())
+    db.add(new_entry)
+    try:
+        db.flush()
+        audit.created(db, current_user.id, new_entry)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"{patient.name} is already waiting for {doctor.name} on {entry_data.date} "
+                                   f"({entry_data.time_window})")
+    db.refresh(new_entry)
+
+    return new_entry
+
+
+########################### GET WAITLIST ENTRIES [ READ ] ###########################
+# Admins see every entry; other users the entries of their own patients.
+@router.get("/", response_model=List[schemas.WaitlistResponseData])
+def get_waitlist(db: Session = Depends(get_read_db), current_user: dict = Depends(oauth2.get_current_user)):
+    entries_query = db.query(models.WaitlistEntry)
+    if current_user.role != 'admin':
+        entries_query = entries_query.filter(models.WaitlistEntry.user_id == current_user.id)
+
+    return entries_query.order_by(models.WaitlistEntry.id).all()
+
+
+########################### LEAVE WAITLIST [ DELETE ] ###########################
+@router.delete("/{entry_id}", status_code=status.HTTP_204_NO_CONTENT)
+def leave_waitlist(entry_id: int, db: Session = Depends(get_write_db),
+                   current_user: dict = Depends(oauth2.get_current_user)):
+    # Lock the entry, so it cannot be removed while a backfill is booking it
+    entry = db.query(models.WaitlistEntry).filter(models.WaitlistEntry.id == entry_id).with_for_update().first()
+    if not entry:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Waitlist entry with ID: {entry_id}, not found!")
+    if entry.user_id != current_user.id and current_user.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"You don't have permission to remove this waitlist entry")
+    if entry.status != 'waiting':
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"The entry has already been booked as appointment {entry.appointment_id}")
+
+    audit.deleted(db, current_user.id, entry)
+    db.delete(entry)
+    db.commit()
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -1,6 +1,6 @@
 from datetime import datetime
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field, model_validator
+from typing import List, Literal, Optional
 
 ##########################################################👤 USER SCHEMAS
 # 👤User schemas for input and validation
@@ -30,6 +30,7 @@ class UserResponseData(BaseModel):
     email: EmailStr
     role: str
     created_at: datetime
+    version: int
 
     class Config:
         orm_mode = True  # 👤Enables SQLAlchemy ORM mode for this schema
@@ -74,6 +75,7 @@ class PatientResponseData(BaseModel):
     phone: str
     user_id: int
     created_at: datetime
+    version: int
 
     class Config:
         orm_mode = True
@@ -100,10 +102,18 @@ class DoctorUpdate(BaseModel):
 class DoctorResponseData(DoctorBase):
     id: int
     created_at: datetime
+    updated_at: datetime
+    version: int
 
     class Config:
         orm_mode = True
 
+# 🥼Represents the doctors changed and deleted since a sync token (GET /doctors?since=)
+class DoctorDeltaResponseData(BaseModel):
+    changed: List[DoctorResponseData]
+    deleted: List[int]
+    sync_token: str
+
 
 ##########################################################🏨 CLINIC SCHEMAS
 # 🏨Schemas for clinic data
@@ -113,6 +123,15 @@ class ClinicBase(BaseModel):
     name: str
     address: str
     phone: str
+    latitude: Optional[float] = Field(None, ge=-90, le=90)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
+
+    # 🏨A location needs both coordinates
+    @model_validator(mode="after")
+    def check_coordinates(self):
+        if (self.latitude is None) != (self.longitude is None):
+            raise ValueError("latitude and longitude must be given together")
+        return self
 
 # 🏨Represents the attributes required for creating a new clinic
 class ClinicCreate(ClinicBase):
@@ -123,6 +142,16 @@ class ClinicUpdate(BaseModel):
     name: Optional[str] = None
     address: Optional[str] = None
     phone: Optional[str] = None
+    latitude: Optional[float] = Field(None, ge=-90, le=90)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
+
+    # 🏨A location is moved (or cleared with nulls) as a whole
+    @model_validator(mode="after")
+    def check_coordinates(self):
+        if ("latitude" in self.model_fields_set) != ("longitude" in self.model_fields_set) \
+                or (self.latitude is None) != (self.longitude is None):
+            raise ValueError("latitude and longitude must be updated together")
+        return self
 
 # 🏨Represents the response data for a clinic
 class ClinicResponseData(BaseModel):
@@ -130,11 +159,29 @@ class ClinicResponseData(BaseModel):
     name: str
     address: str
     phone: str
+    latitude: Optional[float]
+    longitude: Optional[float]
     created_at: datetime
+    updated_at: datetime
+    version: int
 
     class Config:
         orm_mode = True
 
+# 🏨Represents the clinics changed and deleted since a sync token (GET /clinics?since=)
+class ClinicDeltaResponseData(BaseModel):
+    changed: List[ClinicResponseData]
+    deleted: List[int]
+    sync_token: str
+
+# 🏨Represents a clinic near the requested location with its earliest free slot on the requested date
+class NearestClinicResponseData(BaseModel):
+    clinic: ClinicResponseData
+    distance_km: float
+    doctor_id: int
+    earliest_slot: str
+    free_slots: int
+
 
 ################################################################################################
 # START OCTOR SCHEDULE DATA RSPONSE SCHEMAS🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼🥼
@@ -171,6 +218,7 @@ class DoctorScheduleBase(BaseModel):
     clinic_id: int
     date: str
     slots: List[str]
+    capacity: int = Field(1, ge=1)  # Appointments bookable per slot
 
 # 📌🥼Represents the attributes required for creating a new doctor's schedule
 class DoctorScheduleCreate(DoctorScheduleBase):
@@ -182,6 +230,7 @@ class DoctorScheduleUpdate(BaseModel):
     clinic_id: Optional[int] = None
     date: Optional[str] = None
     slots: Optional[List[str]] = None
+    capacity: Optional[int] = Field(None, ge=1)
 
 # 📌🥼Represents the response data for a doctor's schedule
 class DoctorScheduleResponseData(BaseModel):
@@ -190,10 +239,19 @@ class DoctorScheduleResponseData(BaseModel):
     clinic: ScheduleClinicResponseData
     date: str
     slots: List[str]
+    capacity: int
+    updated_at: datetime
+    version: int
 
     class Config:
         orm_mode = True
 
+# 📌🥼Represents the schedules changed and deleted since a sync token (GET /schedules?since=)
+class DoctorScheduleDeltaResponseData(BaseModel):
+    changed: List[DoctorScheduleResponseData]
+    deleted: List[int]
+    sync_token: str
+
 
 
 ################################################################################################
@@ -264,20 +322,140 @@ class AppointmentResponseData(BaseModel):
     appointment_time: str
     appointment_status: str
     created_at: datetime
+    version: int
+
+    class Config:
+        orm_mode = True
+
+
+################################⏳ WAITLIST SCHEMAS
+# ⏳Schemas for the appointment waitlist
+
+# ⏳Represents a request to wait for a slot with a doctor on a date. The time window is 'morning'
+# (before 12:00), 'afternoon' (12:00 - 17:00), 'evening' (from 17:00) or 'any'. Only admins may set a priority.
+class WaitlistCreate(BaseModel):
+    patient_id: int
+    doctor_id: int
+    date: str
+    time_window: Literal['morning', 'afternoon', 'evening', 'any'] = 'any'
+    priority: int = 0
+
+# ⏳Represents a waitlist entry; appointment_id is set once a slot has been booked for it
+class WaitlistResponseData(BaseModel):
+    id: int
+    patient_id: int
+    doctor_id: int
+    date: str
+    time_window: str
+    priority: int
+    status: str
+    appointment_id: Optional[int]
+    created_at: datetime
+    booked_at: Optional[datetime]
+
+    class Config:
+        orm_mode = True
+
+
+################################🧾 AUDIT SCHEMAS
+# 🧾Schemas for the audit log
+
+# 🧾Represents one audited change; changes holds the values on create and delete, {column: [old, new]} on update
+class AuditLogResponseData(BaseModel):
+    id: int
+    occurred_at: datetime
+    user_id: Optional[int]
+    action: str
+    table_name: str
+    record_id: int
+    changes: dict
+
+    class Config:
+        orm_mode = True
+
+
+################################🧹 PURGE SCHEMAS
+# 🧹Schemas for the background purge of deleted records
+
+# 🧹Represents the purge of a deleted doctor, clinic or user; deleted_rows counts the rows removed per step
+class PurgeJobResponseData(BaseModel):
+    id: int
+    table_name: str
+    record_id: int
+    status: str
+    step: Optional[str]
+    deleted_rows: dict
+    attempts: int
+    error: Optional[str]
+    created_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
 
     class Config:
         orm_mode = True
 
 
+################################📊 STATISTICS SCHEMAS
+# 📊Schemas for utilization statistics
+
+# 📊Represents booked vs. available slots of one doctor at one clinic on one day
+class UtilizationDailyResponseData(BaseModel):
+    doctor_id: int
+    clinic_id: int
+    date: str
+    available_slots: int
+    booked_slots: int
+    utilization: Optional[float]
+
+    class Config:
+        orm_mode = True
+
+# 📊Represents booked vs. available slots of a doctor or clinic over a date range
+class UtilizationTotalResponseData(BaseModel):
+    id: int
+    available_slots: int
+    booked_slots: int
+    utilization: Optional[float]
+
+
+################################🔎 SEARCH SCHEMAS
+# 🔎Schemas for search and autocomplete
+
+# 🔎Represents one autocomplete suggestion (detail is the doctor's specialty or the clinic's address)
+class SearchSuggestionResponseData(BaseModel):
+    id: int
+    name: str
+    detail: str
+
+
 ################################📜 TOKEN SCHEMAS
 # 📜Schemas for authentication tokens
 
-# 📜Represents an authentication token
+# 📜Represents an authentication token (the refresh token is only returned by POST /login)
 class Token(BaseModel):
     access_token: str
     token_type: str
+    expires_in: int  # Seconds until the access token expires
+    refresh_token: Optional[str] = None
+
+# 📜Represents the refresh token sent to POST /login/refresh
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+# 📜Represents the optional refresh token sent to POST /logout, revoked along with the access token
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
 
-# 📜Represents token data for a user
+# 📜Represents a feed token for the .ics calendar feeds (POST /login/calendar-token)
+class CalendarToken(BaseModel):
+    calendar_token: str
+    expires_in: int  # Seconds until the feed token expires
+
+# 📜Represents the claims of a verified token (routers use id and role as the current user)
 class TokenData(BaseModel):
-    username: str | None = None
+    id: int
+    role: str
+    token_id: str
+    issued_at: float
+    expires_at: float
 
@@ -0,0 +1,157 @@
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import String, case, func, literal, or_
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import app_settings
+
+# Name search for the /search endpoints. Full searches run in Postgres against the pg_trgm GIN
+# indexes; autocomplete on the small doctor and clinic catalogs is answered from an in-process
+# prefix trie, rebuilt after SEARCH_TRIE_TTL_SECONDS or when this worker changes the catalog.
+
+
+def normalize(value: str) -> str:
+    return " ".join(value.casefold().split())
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+########################### DATABASE SEARCH ###########################
+
+# Prefix matches rank first, then substring matches (both ILIKE, served by the trigram indexes),
+# then fuzzy matches by word similarity, which catch typos such as "jonh" for "John Smith".
+def search(db: Session, model, columns, q: str, limit: int, filters=()):
+    escaped = escape_like(q)
+    prefix = or_(*[column.ilike(f"{escaped}%") for column in columns])
+    contains = or_(*[column.ilike(f"%{escaped}%") for column in columns])
+    fuzzy = or_(*[literal(q, String).op("<%")(column) for column in columns])
+    similarity = func.greatest(*[func.word_similarity(q, column) for column in columns])
+
+    return (db.query(model)
+            .filter(or_(contains, fuzzy), *filters)
+            .order_by(case((prefix, 0), (contains, 1), else_=2), similarity.desc(), columns[0])
+            .limit(limit)
+            .all())
+
+
+########################### PREFIX TRIE ###########################
+
+# Character trie mapping keys to record ids. Keys are inserted in sorted order, so the children of
+# every node are in sorted order too and a depth-first walk yields completions alphabetically.
+class PrefixTrie:
+    __slots__ = ("root",)
+
+    def __init__(self, entries):
+        self.root = {}
+        for key, value in sorted(entries):
+            node = self.root
+            for char in key:
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append(value)  # The None key holds the values of keys ending here
+
+    def complete(self, prefix: str, limit: int):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+
+        found = {}
+        stack = [node]
+        while stack and len(found) < limit:
+            current = stack.pop()
+            for value in current.get(None, ()):
+                found.setdefault(value)
+            stack.extend(reversed([child for char, child in current.items() if char is not None]))
+        return list(found)[:limit]
+
+
+# Every word start of the normalized text is a key, so "smi" and "john sm" both find "John Smith"
+def _word_keys(value: str):
+    words = normalize(value).split(" ")
+    return {" ".join(words[start:]) for start in range(len(words))}
+
+
+# The trie and records of one catalog, swapped in as a whole so readers never see a half-built one
+class _Snapshot:
+    __slots__ = ("trie", "records")
+
+    def __init__(self, trie: PrefixTrie, records: dict):
+        self.trie = trie
+        self.records = records
+
+
+class Catalog:
+    def __init__(self, id_column, name_column, detail_column, search_columns):
+        self.id_column = id_column
+        self.name_column = name_column
+        self.detail_column = detail_column
+        self.search_columns = search_columns
+        self.snapshot = None
+        self.loaded_at = None  # Monotonic time the current snapshot's query started
+        self.invalidated_at = 0.0
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        self.invalidated_at = time.monotonic()
+
+    def _fresh(self) -> bool:
+        return (self.loaded_at is not None and self.loaded_at > self.invalidated_at
+                and time.monotonic() - self.loaded_at < app_settings.SEARCH_TRIE_TTL_SECONDS)
+
+    # Returns None when the catalog is too large to keep in memory; callers then query the database
+    def current(self, db: Session) -> Optional[_Snapshot]:
+        if self._fresh():
+            return self.snapshot
+        with self.lock:
+            if self._fresh():
+                return self.snapshot
+
+            started = time.monotonic()
+            columns = [self.id_column, self.name_column, self.detail_column, *self.search_columns]
+            rows = db.query(*columns).limit(app_settings.SEARCH_TRIE_MAX_ENTRIES + 1).all()
+            if len(rows) > app_settings.SEARCH_TRIE_MAX_ENTRIES:
+                snapshot = None
+            else:
+                records = {row[0]: {"id": row[0], "name": row[1], "detail": row[2]} for row in rows}
+                entries = [(key, row[0]) for row in rows for value in row[3:] for key in _word_keys(value)]
+                snapshot = _Snapshot(PrefixTrie(entries), records)
+
+            self.snapshot, self.loaded_at = snapshot, started
+            return snapshot
+
+    def complete(self, db: Session, prefix: str, limit: int) -> Optional[list]:
+        snapshot = self.current(db)
+        if snapshot is None:
+            return None
+        return [snapshot.records[record_id] for record_id in snapshot.trie.complete(normalize(prefix), limit)]
+
+
+catalogs = {
+    "doctors": Catalog(models.Doctor.id, models.Doctor.name, models.Doctor.specialty,
+                       (models.Doctor.name, models.Doctor.specialty)),
+    "clinics": Catalog(models.Clinic.id, models.Clinic.name, models.Clinic.address, (models.Clinic.name,)),
+}
+
+
+# Called by the doctor and clinic routers after a write; other workers catch up within the TTL
+def invalidate(kind: str):
+    catalogs[kind].invalidate()
+
+
+# Autocomplete suggestions ({id, name, detail}) from the trie, or from the indexes when it is off
+def autocomplete(db: Session, kind: str, q: str, limit: int):
+    catalog = catalogs[kind]
+    if app_settings.SEARCH_TRIE_ENABLED:
+        suggestions = catalog.complete(db, q, limit)
+        if suggestions is not None:
+            return suggestions
+
+    model = catalog.id_column.class_
+    return [{"id": record.id, "name": record.name, "detail": getattr(record, catalog.detail_column.key)}
+            for record in search(db, model, catalog.search_columns, q, limit)]
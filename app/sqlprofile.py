@@ -0,0 +1,147 @@
+import json
+import logging
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+logger = logging.getLogger("app.sqlprofile")
+
+# Holds the profile of the request currently being served (None outside of a profiled request).
+# The handlers run in a threadpool, but the context is copied into the worker thread,
+# so the same RequestSQLProfile object is shared between the middleware and the handler.
+current_profile: ContextVar = ContextVar("sql_profile", default=None)
+
+
+# Statements executed while serving a single request, grouped by SQL text.
+class RequestSQLProfile:
+    def __init__(self, slow_query_ms: float, n_plus_one_threshold: int):
+        self.slow_query_ms = slow_query_ms
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.statements = {}  # SQL text -> [count, total_ms, max_ms]
+        self.slow_queries = []  # (SQL text, elapsed_ms)
+        self.total_queries = 0
+        self.total_ms = 0.0
+
+    def record(self, statement: str, elapsed_ms: float):
+        self.total_queries += 1
+        self.total_ms += elapsed_ms
+
+        stats = self.statements.get(statement)
+        if stats is None:
+            self.statements[statement] = [1, elapsed_ms, elapsed_ms]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed_ms
+            stats[2] = max(stats[2], elapsed_ms)
+
+        if elapsed_ms >= self.slow_query_ms:
+            self.slow_queries.append((statement, elapsed_ms))
+
+    # Statements repeated often enough within one request to look like an N+1 pattern
+    # (e.g. the lazy Appointment.doctor load issued once per appointment in a list).
+    def repeated_statements(self):
+        return {sql: stats for sql, stats in self.statements.items() if stats[0] >= self.n_plus_one_threshold}
+
+    def header_value(self) -> str:
+        return (f"queries={self.total_queries}; distinct={len(self.statements)}; "
+                f"total_ms={self.total_ms:.2f}; slow={len(self.slow_queries)}; "
+                f"n_plus_one={len(self.repeated_statements())}")
+
+    def summary(self, method: str, path: str, status_code: int) -> dict:
+        return {
+            "method": method,
+            "path": path,
+            "status_code": status_code,
+            "queries": self.total_queries,
+            "distinct": len(self.statements),
+            "total_ms": round(self.total_ms, 2),
+            "slow": [{"sql": sql, "ms": round(ms, 2)} for sql, ms in self.slow_queries],
+            "n_plus_one": [
+                {"sql": sql, "count": stats[0], "total_ms": round(stats[1], 2)}
+                for sql, stats in self.repeated_statements().items()
+            ],
+        }
+
+
+########################### SQLALCHEMY CURSOR EVENTS ###########################
+
+# The start time is kept on the statement's execution context rather than on the connection, so a
+# statement that fails (after_cursor_execute does not fire) leaves nothing behind on the pooled
+# connection to be paired with a later statement
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None and context is not None:
+        context._sqlprofile_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    if profile is None:
+        return
+
+    started = getattr(context, "_sqlprofile_start", None)
+    if started is None:
+        return
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    profile.record(statement, elapsed_ms)
+
+
+########################### ASGI MIDDLEWARE ###########################
+
+# Wraps every HTTP request in a RequestSQLProfile and reports it as an
+# X-SQL-Profile response header and a single JSON log line.
+class SQLProfilerMiddleware:
+    def __init__(self, app, slow_query_ms: float = 100.0, n_plus_one_threshold: int = 5,
+                 response_header: bool = True):
+        self.app = app
+        self.slow_query_ms = slow_query_ms
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.response_header = response_header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestSQLProfile(self.slow_query_ms, self.n_plus_one_threshold)
+        token = current_profile.set(profile)
+        status_code = 500
+
+        async def send_with_profile(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.response_header:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-sql-profile", profile.header_value().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            current_profile.reset(token)
+            summary = profile.summary(scope["method"], scope["path"], status_code)
+            if profile.slow_queries or summary["n_plus_one"]:
+                logger.warning(json.dumps(summary))
+            else:
+                logger.info(json.dumps(summary))
+
+
+# Attach the cursor listeners and the middleware. Nothing is registered when profiling is
+# disabled, so the default configuration pays no per-query or per-request cost.
+def install(app, engines, settings):
+    if not settings.SQL_PROFILING_ENABLED:
+        return
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    app.add_middleware(
+        SQLProfilerMiddleware,
+        slow_query_ms=settings.SQL_SLOW_QUERY_MS,
+        n_plus_one_threshold=settings.SQL_N_PLUS_ONE_THRESHOLD,
+        response_header=settings.SQL_PROFILING_HEADER,
+    )
@@ -0,0 +1,77 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import app_settings
+from .database import SessionLocal
+
+# Delta sync for the ?since= list endpoints. A sync token is the database time at which a sync
+# started; the next sync returns the records updated, and the ids deleted, since that time.
+#
+# updated_at is the start time of the writing transaction, so a transaction that started before
+# a sync but committed after it would be missed. Changes are therefore re-sent for
+# SYNC_OVERLAP_SECONDS before the token; clients apply them as idempotent upserts.
+
+SYNC_TOKEN_HEADER = "X-Sync-Token"
+_last_prune = 0.0
+
+
+def parse_since(since: str) -> datetime:
+    try:
+        parsed = datetime.fromisoformat(since)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="since must be a sync token returned by a previous request")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+
+    # Deletions older than the tombstone retention are gone, so the client has to start over
+    horizon = datetime.now(timezone.utc) - timedelta(days=app_settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+    if parsed < horizon:
+        raise HTTPException(status_code=status.HTTP_410_GONE,
+                            detail="Sync token expired, download the full list again")
+    return parsed
+
+
+# Take the token before reading, so anything committed during the read is sent again next time. On
+# a replica the token is the replica's clock while its data may lag behind; the overlap window
+# (SYNC_OVERLAP_SECONDS, well above REPLICA_MAX_LAG_SECONDS) re-sends those changes.
+def start_sync(db: Session, response: Response) -> str:
+    started = db.execute(select(func.clock_timestamp())).scalar()
+    # UTC with a Z suffix, so the token can be put in a query string without escaping a "+"
+    token = started.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    response.headers[SYNC_TOKEN_HEADER] = token
+    return token
+
+
+# Records of `model` changed since the token and ids of those deleted since then
+def changes(db: Session, model, since: datetime):
+    window_start = since - timedelta(seconds=app_settings.SYNC_OVERLAP_SECONDS)
+    changed = db.query(model).filter(model.updated_at >= window_start).all()
+    deleted = db.scalars(
+        select(models.Tombstone.record_id)
+        .where(models.Tombstone.table_name == model.__tablename__, models.Tombstone.deleted_at >= window_start)
+        .distinct()
+    ).all()
+
+    _maybe_prune()
+    return changed, deleted
+
+
+# Tombstones past the retention are deleted at most once per SYNC_PRUNE_SECONDS, piggybacking on a
+# sync. The sync itself may be reading from a replica, so the delete goes to the primary.
+def _maybe_prune():
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune < app_settings.SYNC_PRUNE_SECONDS:
+        return
+    _last_prune = now
+
+    horizon = datetime.now(timezone.utc) - timedelta(days=app_settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+    with SessionLocal() as primary:
+        primary.execute(delete(models.Tombstone).where(models.Tombstone.deleted_at < horizon))
+        primary.commit()
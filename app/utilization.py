@@ -0,0 +1,153 @@
+"""
+Utilization summary (booked vs. available slots per doctor, clinic and day).
+
+utilization_daily is maintained incrementally by statement triggers on appointments and
+schedules (see migrations d4e8a3c71b59 and c6e2f8a41d93); available slots are counted in seats,
+slots times the schedule's capacity. Bookings do not touch utilization_daily: the appointments
+trigger appends to utilization_deltas (migration d7a2e9f4b186), and a folder running in every
+worker adds those deltas to utilization_daily every UTILIZATION_FOLD_SECONDS, so booked counts
+lag by about that long. Pending deltas can be folded, and a summary that was ever written around
+the triggers rebuilt, without the API:
+
+    python -m app.utilization fold
+    python -m app.utilization rebuild
+"""
+import argparse
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import lifecycle
+from .config import app_settings
+from .database import SessionLocal
+
+logger = logging.getLogger("app.utilization")
+
+REBUILD = text("""
+    INSERT INTO utilization_daily (doctor_id, clinic_id, date, available_slots, booked_slots)
+    SELECT doctor_id, clinic_id, day, sum(available), sum(booked)
+    FROM (
+        SELECT doctor_id, clinic_id, date, cardinality(slots) * capacity, 0 FROM schedules
+        UNION ALL
+        SELECT doctor_id, clinic_id, appointment_date, 0, 1 FROM appointments WHERE appointment_status = 'booked'
+    ) AS counts (doctor_id, clinic_id, day, available, booked)
+    GROUP BY doctor_id, clinic_id, day
+""")
+
+
+# Moves the oldest deltas into the summary, one upsert per doctor, clinic and day in key order.
+# SKIP LOCKED lets the folders of several workers take separate batches.
+FOLD = text("""
+    WITH batch AS (
+        DELETE FROM utilization_deltas
+        WHERE id IN (SELECT id FROM utilization_deltas ORDER BY id LIMIT :limit FOR UPDATE SKIP LOCKED)
+        RETURNING doctor_id, clinic_id, date, booked_slots
+    ), folded AS (
+        INSERT INTO utilization_daily AS u (doctor_id, clinic_id, date, booked_slots)
+        SELECT doctor_id, clinic_id, date, sum(booked_slots) FROM batch
+        GROUP BY doctor_id, clinic_id, date
+        HAVING sum(booked_slots) <> 0
+        ORDER BY doctor_id, clinic_id, date
+        ON CONFLICT (doctor_id, clinic_id, date) DO UPDATE
+        SET booked_slots = u.booked_slots + excluded.booked_slots, updated_at = now()
+    )
+    SELECT count(*) FROM batch
+""")
+
+
+def ratio(booked_slots: int, available_slots: int) -> Optional[float]:
+    if not available_slots:
+        return None
+    return round(booked_slots / available_slots, 4)
+
+
+# Folds one batch of deltas; returns the number of deltas folded
+def fold(db: Session) -> int:
+    folded = db.execute(FOLD, {"limit": app_settings.UTILIZATION_FOLD_BATCH_SIZE}).scalar()
+    db.commit()
+    return folded
+
+
+# Recompute the whole summary from appointments and schedules in one transaction. Bookings wait
+# for it (their deltas are already counted by the recomputation once they can be appended).
+def rebuild(db: Session) -> int:
+    db.execute(text("LOCK TABLE utilization_daily, utilization_deltas IN EXCLUSIVE MODE"))
+    db.execute(text("DELETE FROM utilization_deltas"))
+    db.execute(text("DELETE FROM utilization_daily"))
+    rows = db.execute(REBUILD).rowcount
+    db.commit()
+    return rows
+
+
+########################### FOLDER ###########################
+
+class Folder:
+    def __init__(self):
+        self.task = None
+
+    def run_once(self) -> int:
+        with SessionLocal() as db:
+            return fold(db)
+
+    # A full batch is followed by the next one right away, so a backlog drains without waiting
+    async def _run(self):
+        while True:
+            try:
+                folded = await run_in_threadpool(self.run_once)
+            except SQLAlchemyError:
+                logger.exception("Could not fold utilization deltas")
+                folded = 0
+            if folded < app_settings.UTILIZATION_FOLD_BATCH_SIZE:
+                await asyncio.sleep(app_settings.UTILIZATION_FOLD_SECONDS)
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    # Deltas left behind are folded by the other workers, or this one once it starts again
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+
+folder = Folder()
+
+
+def install(app, settings):
+    if not settings.UTILIZATION_FOLD_ENABLED:
+        return
+
+    lifecycle.register(folder.start, folder.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the utilization summary table")
+    parser.add_argument("command", choices=["fold", "rebuild"])
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == "fold":
+            folded = total = fold(db)
+            while folded == app_settings.UTILIZATION_FOLD_BATCH_SIZE:
+                folded = fold(db)
+                total += folded
+            print(f"folded {total} utilization deltas")
+        else:
+            print(f"rebuilt utilization_daily: {rebuild(db)} rows")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,10 @@
+from datetime import datetime
+from typing import Optional
+
+from jose import JWTError, jwt
 from passlib.context import CryptContext
+
+from .config import app_settings
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def get_password_hash(password: str):
@@ -6,4 +12,26 @@ def get_password_hash(password: str):
 
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password, hashed_password)
+
+# Minutes after midnight of a schedule slot such as "09:30 AM", or None if it is not in that format
+def slot_minutes(slot: str) -> Optional[int]:
+    try:
+        parsed = datetime.strptime(slot.strip(), "%I:%M %p")
+    except ValueError:
+        return None
+    return parsed.hour * 60 + parsed.minute
+
+
+# The user id (sub claim) of an Authorization: Bearer header, or None. The signature is verified (an
+# HMAC, microseconds) but the database is not touched, so revocation is not checked. A user's id
+# stays the same when the access token is refreshed, unlike the header itself.
+def bearer_subject(authorization: Optional[str]) -> Optional[str]:
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = jwt.decode(token, app_settings.SECRET_KEY, algorithms=[app_settings.ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("sub")
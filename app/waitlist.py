@@ -0,0 +1,104 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from . import audit, availability, booking, models, utils
+
+# Backfill of freed and newly scheduled slots from the waitlist. The matching entry is booked in
+# the transaction that freed or added the slot, so the slot is never visibly free in between.
+
+# Time windows as [start, end) minutes after midnight; 'any' matches every slot
+TIME_WINDOWS = {
+    "morning": (0, 12 * 60),
+    "afternoon": (12 * 60, 17 * 60),
+    "evening": (17 * 60, 24 * 60),
+}
+
+
+def time_window(slot: str) -> Optional[str]:
+    minutes = utils.slot_minutes(slot)
+    if minutes is None:
+        return None
+    return next(window for window, (start, end) in TIME_WINDOWS.items() if start <= minutes < end)
+
+
+# The first waiting entry of one queue, locked. Entries locked by a concurrent backfill are
+# skipped rather than waited for, so two freed slots never hand out the same entry.
+def _head(db: Session, doctor_id: int, date: str, window: str):
+    return db.query(models.WaitlistEntry).filter(
+        models.WaitlistEntry.doctor_id == doctor_id,
+        models.WaitlistEntry.date == date,
+        models.WaitlistEntry.time_window == window,
+        models.WaitlistEntry.status == 'waiting',
+    ).order_by(models.WaitlistEntry.priority.desc(), models.WaitlistEntry.id) \
+        .limit(1).with_for_update(skip_locked=True).first()
+
+
+# Books a seat in the slot for the highest priority entry waiting for it, if the slot has one. A
+# slot is matched by two queues (its time window and 'any'), each read from the head of the queue
+# index, so the cost does not depend on queue length. The head of the other queue stays locked
+# until commit; concurrent backfills skip it and take the entry behind it.
+def backfill(db: Session, doctor_id: int, clinic_id: int, date: str, slot: str) -> Optional[models.Appointment]:
+    window = time_window(slot)
+    if window is None:
+        return None
+
+    candidates = [entry for entry in (_head(db, doctor_id, date, window), _head(db, doctor_id, date, "any"))
+                  if entry is not None]
+    if not candidates:
+        return None
+    entry = min(candidates, key=lambda candidate: (-candidate.priority, candidate.id))
+
+    # Lock the slot's counter and check for a free seat, so the insert below cannot fail
+    remaining = booking.seats_left(db, doctor_id, date, slot, lock=True)
+    if remaining is None or remaining < 1:
+        return None
+
+    appointment = models.Appointment(
+        patient_id=entry.patient_id, doctor_id=doctor_id, clinic_id=clinic_id,
+        patient_fkey=entry.patient_id, doctor_fkey=doctor_id, clinic_fkey=clinic_id, user_fkey=entry.user_id,
+        appointment_date=date, appointment_time=slot, appointment_status='booked',
+    )
+    db.add(appointment)
+    db.flush()
+
+    previous = audit.snapshot(entry)
+    entry.status = 'booked'
+    entry.appointment_id = appointment.appointments_id
+    entry.booked_at = datetime.now(timezone.utc)
+    # Written now, so a later backfill in the same transaction (sessions do not autoflush) never
+    # finds the entry still waiting and books it a second time
+    db.flush()
+    # Booked by the system on the entry's behalf, not by the user whose request freed the slot
+    audit.created(db, None, appointment)
+    audit.updated(db, None, previous, entry)
+    availability.slot_taken(db, appointment, remaining - 1)
+    return appointment
+
+
+# Backfills the seats a schedule added: every slot of a new schedule, or of one whose capacity
+# grew, otherwise only the added slots. Each slot is filled until it or its queues run out.
+def backfill_schedule(db: Session, schedule, previous=None):
+    db.flush()
+    slots = list(schedule.slots)
+    if previous is not None and (previous.doctor_id, previous.date) == (schedule.doctor_id, schedule.date) \
+            and schedule.capacity <= previous.capacity:
+        slots = [slot for slot in slots if slot not in previous.slots]
+
+    booked = []
+    for slot in slots:
+        appointment = backfill(db, schedule.doctor_id, schedule.clinic_id, schedule.date, slot)
+        while appointment is not None:
+            booked.append(appointment)
+            appointment = backfill(db, schedule.doctor_id, schedule.clinic_id, schedule.date, slot)
+    return booked
+
+
+# True when an appointment update gave up a booked slot (moved or no longer booked)
+def slot_released(previous, appointment) -> bool:
+    if previous.appointment_status != 'booked':
+        return False
+    moved = (previous.doctor_id, previous.appointment_date, previous.appointment_time) != \
+        (appointment.doctor_id, appointment.appointment_date, appointment.appointment_time)
+    return moved or appointment.appointment_status != 'booked'
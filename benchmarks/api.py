@@ -0,0 +1,161 @@
+"""
+Benchmark the API's hot paths in-process against the configured local database.
+
+    python -m benchmarks.api --reset --sizes 1000,10000,100000 --output bench.json
+
+Each size is a number of seeded appointments (users, doctors, clinics and schedules are
+scaled from it). The database named in .env is TRUNCATED before every size, so --reset
+must be passed explicitly. Results are written as JSON so runs can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+
+from fastapi.testclient import TestClient
+
+# All benchmark traffic comes from one client, which the rate limits would otherwise throttle
+os.environ.setdefault("ADMISSION_CONTROL_ENABLED", "false")
+
+from app.database import SessionLocal
+from app.main import app
+
+from .seed import BENCHMARK_PASSWORD, SEEDED_SLOTS_PER_DOCTOR, SLOTS_PER_SCHEDULE, SeedPlan, seed
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(name, size, requests, call):
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        response = call()
+        latencies.append((time.perf_counter() - request_started) * 1000)
+        if response.status_code >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "size": size,
+        "operation": name,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "p50_ms": round(percentile(latencies, 0.50), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99), 3) if latencies else None,
+    }
+
+
+def login(client, email):
+    response = client.post("/login/", data={"username": email, "password": BENCHMARK_PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def run_size(client, size, args, rng):
+    plan = SeedPlan(size)
+    db = SessionLocal()
+    try:
+        seed(db, plan, rng)
+    finally:
+        db.close()
+
+    admin_headers = login(client, "user1@bench.local")
+    patient_headers = login(client, "user2@bench.local")
+    free_slots = plan.free_slots()
+    results = []
+
+    def login_call():
+        user_id = rng.randint(1, plan.users)
+        return client.post("/login/", data={"username": f"user{user_id}@bench.local", "password": BENCHMARK_PASSWORD})
+
+    def book_call():
+        doctor_id, clinic_id, appointment_date, appointment_time = next(free_slots)
+        return client.post("/appointments/", headers=patient_headers, json={
+            "patient_id": 2, "doctor_id": doctor_id, "clinic_id": clinic_id,
+            "appointment_date": appointment_date, "appointment_time": appointment_time,
+        })
+
+    def doctor_schedules_call():
+        return client.get(f"/doctors/{rng.randint(1, plan.doctors)}/schedules")
+
+    booking_requests = min(args.requests, plan.doctors * (SLOTS_PER_SCHEDULE - SEEDED_SLOTS_PER_DOCTOR))
+
+    results.append(measure("login", size, args.login_requests, login_call))
+    results.append(measure("book_appointment", size, booking_requests, book_call))
+    results.append(measure("doctor_schedules", size, args.requests, doctor_schedules_call))
+    results.append(measure("list_appointments_admin", size, args.list_requests,
+                           lambda: client.get("/appointments/", headers=admin_headers)))
+    results.append(measure("list_appointments_patient", size, args.list_requests,
+                           lambda: client.get("/appointments/", headers=patient_headers)))
+    results.append(measure("list_patients_admin", size, args.list_requests,
+                           lambda: client.get("/patients/", headers=admin_headers)))
+    results.append(measure("list_doctors", size, args.list_requests, lambda: client.get("/doctors/")))
+    results.append(measure("list_clinics", size, args.list_requests, lambda: client.get("/clinics/")))
+    results.append(measure("list_schedules", size, args.list_requests, lambda: client.get("/schedules/")))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API's hot paths")
+    parser.add_argument("--sizes", default="1000,10000", help="Comma separated numbers of seeded appointments")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per booking/schedule measurement")
+    parser.add_argument("--login-requests", type=int, default=20, help="Requests per login measurement (bcrypt bound)")
+    parser.add_argument("--list-requests", type=int, default=20, help="Requests per list endpoint measurement")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for data generation and request mix")
+    parser.add_argument("--output", default="bench_output.json", help="Where to write the JSON results")
+    parser.add_argument("--reset", action="store_true", help="Confirm that the configured database may be truncated")
+    args = parser.parse_args()
+
+    if not args.reset:
+        parser.error("the benchmark truncates the configured database; pass --reset to confirm")
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    rng = random.Random(args.seed)
+    client = TestClient(app)
+
+    results = []
+    for size in sizes:
+        print(f"Benchmarking with {size} appointments...")
+        for result in run_size(client, size, args, rng):
+            print(f"  {result['operation']:<28} {result['throughput_rps']:>10} req/s  "
+                  f"p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms  errors {result['errors']}")
+            results.append(result)
+
+    report = {
+        "meta": {
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
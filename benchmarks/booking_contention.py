@@ -0,0 +1,159 @@
+"""
+Concurrency stress test for POST /appointments.
+
+Start the API against the database configured in .env, e.g.
+
+    ADMISSION_CONTROL_ENABLED=false uvicorn app.main:app --workers 4
+
+then run
+
+    python -m benchmarks.booking_contention --reset --base-url http://127.0.0.1:8000 --clients 50,100,250,500
+
+For every concurrency level the database is TRUNCATED and re-seeded, then each client
+repeatedly tries to book a random slot out of a small shared pool, so many requests
+race for the same (doctor, date, time). The report lists successful bookings/sec,
+conflicts (403 already booked), errors, and the number of slots found in the database
+afterwards with more bookings than seats or a seat counter that disagrees with the
+appointments, both of which must be 0. Leave admission control enabled instead
+to see how many requests its booking concurrency cap turns away with 429.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+from sqlalchemy import text
+
+from app import oauth2
+from app.database import SessionLocal
+
+from .seed import SeedPlan, seed
+
+# Slots holding more booked appointments than their capacity, or whose seat counter disagrees
+# with the appointments; both must be 0
+OVERBOOKINGS = text("""
+    SELECT count(*) FILTER (WHERE booked > capacity), count(*) FILTER (WHERE booked <> booked_count)
+    FROM (
+        SELECT s.capacity, s.booked_count, count(a.appointments_id) AS booked
+        FROM schedule_slots AS s
+        LEFT JOIN appointments AS a
+          ON (a.doctor_id, a.appointment_date, a.appointment_time) = (s.doctor_id, s.date, s.slot_time)
+         AND a.appointment_status = 'booked'
+        GROUP BY s.doctor_id, s.date, s.slot_time
+    ) AS slots
+""")
+
+
+async def client_worker(http, headers, slot_pool, attempts, rng, counters):
+    for _ in range(attempts):
+        doctor_id, clinic_id, appointment_date, appointment_time = rng.choice(slot_pool)
+        try:
+            response = await http.post("/appointments/", headers=headers, json={
+                "patient_id": 2, "doctor_id": doctor_id, "clinic_id": clinic_id,
+                "appointment_date": appointment_date, "appointment_time": appointment_time,
+            })
+        except httpx.HTTPError:
+            counters["errors"] += 1
+            continue
+
+        if response.status_code == 201:
+            counters["booked"] += 1
+        elif response.status_code == 403:
+            counters["conflicts"] += 1
+        elif response.status_code == 429:
+            counters["rejected"] += 1
+        else:
+            counters["errors"] += 1
+
+
+async def run_level(base_url, clients, args, rng):
+    db = SessionLocal()
+    try:
+        plan = SeedPlan(args.appointments)
+        seed(db, plan, rng)
+        if args.capacity != 1:
+            # The trigger on schedules copies the capacity into every slot's counter row
+            db.execute(text("UPDATE schedules SET capacity = :capacity"), {"capacity": args.capacity})
+            db.commit()
+    finally:
+        db.close()
+
+    # Tokens are minted directly so the measurement is not dominated by bcrypt logins
+    headers = {"Authorization": f"Bearer {oauth2.create_access_token(2, 'patient')}"}
+    free_slots = list(plan.free_slots())
+    slot_pool = free_slots[:max(1, min(len(free_slots), int(clients * args.pool_ratio)))]
+
+    counters = {"booked": 0, "conflicts": 0, "rejected": 0, "errors": 0}
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            client_worker(http, headers, slot_pool, args.attempts, random.Random(rng.random()), counters)
+            for _ in range(clients)
+        ))
+        elapsed = time.perf_counter() - started
+
+    db = SessionLocal()
+    try:
+        overbookings, counter_drift = db.execute(OVERBOOKINGS).one()
+    finally:
+        db.close()
+
+    return {
+        "clients": clients,
+        "slot_pool": len(slot_pool),
+        "requests": clients * args.attempts,
+        "elapsed_s": round(elapsed, 3),
+        "booked": counters["booked"],
+        "conflicts": counters["conflicts"],
+        "rejected": counters["rejected"],
+        "errors": counters["errors"],
+        "bookings_per_s": round(counters["booked"] / elapsed, 2),
+        "requests_per_s": round(clients * args.attempts / elapsed, 2),
+        "capacity": args.capacity,
+        "overbookings": overbookings,
+        "counter_drift": counter_drift,
+    }
+
+
+async def main_async(args):
+    rng = random.Random(args.seed)
+    results = []
+    for clients in [int(level) for level in args.clients.split(",")]:
+        result = await run_level(args.base_url, clients, args, rng)
+        print(f"{clients:>4} clients: {result['bookings_per_s']:>8} bookings/s  {result['booked']:>6} booked  "
+              f"{result['conflicts']:>6} conflicts  {result['rejected']:>6} rejected  {result['errors']:>4} errors  "
+              f"{result['overbookings']} overbooked  {result['counter_drift']} drifted")
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent booking stress test")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--clients", default="50,100,250,500", help="Comma separated concurrency levels")
+    parser.add_argument("--attempts", type=int, default=5, help="Booking attempts per client")
+    parser.add_argument("--pool-ratio", type=float, default=0.5,
+                        help="Size of the shared slot pool relative to the number of clients")
+    parser.add_argument("--appointments", type=int, default=10000, help="Appointments seeded before each level")
+    parser.add_argument("--capacity", type=int, default=1,
+                        help="Seats per slot; raise it with a small --pool-ratio to measure hot slot throughput")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="Optional JSON output file")
+    parser.add_argument("--reset", action="store_true", help="Confirm that the configured database may be truncated")
+    args = parser.parse_args()
+
+    if not args.reset:
+        parser.error("the stress test truncates the configured database; pass --reset to confirm")
+
+    results = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"args": vars(args), "results": results}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Compare the negotiated response formats against JSON for the list endpoints' payloads.
+
+    python -m benchmarks.formats --rows 100,1000,10000 --output formats_output.json
+
+Rows are generated in memory and validated with the response schemas, then serialized once
+the way FastAPI does for every format. For each format the encoded payload size (raw and
+gzipped), the server side encode time and the client side decode time are reported. No
+database is needed.
+"""
+import argparse
+import gzip
+import json
+import platform
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+import msgpack
+from pydantic import TypeAdapter
+from starlette.responses import JSONResponse
+
+from app import negotiation, schemas
+
+from .api import git_revision
+
+SPECIALTIES = ["Cardiology", "Dermatology", "General Practice", "Neurology", "Paediatrics", "Radiology"]
+SLOT_TIMES = [f"{hour:02d}:{minute:02d} {'AM' if hour < 12 else 'PM'}" for hour in (8, 9, 10, 11, 1, 2, 3, 4)
+              for minute in (0, 30)]
+
+
+def appointment_rows(count, rng):
+    created = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [{
+        "appointments_id": index,
+        "patient": {"name": f"Patient {index}", "dob": f"19{rng.randint(40, 99)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+                    "gender": rng.choice(["male", "female"]), "phone": f"0{rng.randint(200000000, 599999999)}"},
+        "doctor": {"name": f"Dr {rng.randint(1, 500)}", "specialty": rng.choice(SPECIALTIES)},
+        "clinic": {"name": f"Clinic {rng.randint(1, 50)}", "address": f"{rng.randint(1, 200)} High Street",
+                   "phone": f"0{rng.randint(200000000, 599999999)}"},
+        "appointment_date": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "appointment_time": rng.choice(SLOT_TIMES),
+        "appointment_status": rng.choice(["booked", "booked", "booked", "cancelled"]),
+        "created_at": created + timedelta(seconds=index),
+        "version": 1,
+    } for index in range(1, count + 1)]
+
+
+def schedule_rows(count, rng):
+    updated = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [{
+        "schedule_id": index,
+        "doctor": {"id": rng.randint(1, 500), "name": f"Dr {index}", "specialty": rng.choice(SPECIALTIES)},
+        "clinic": {"id": rng.randint(1, 50), "name": f"Clinic {index % 50}", "address": f"{index % 200} High Street",
+                   "phone": f"0{rng.randint(200000000, 599999999)}"},
+        "date": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "slots": rng.sample(SLOT_TIMES, rng.randint(4, len(SLOT_TIMES))),
+        "updated_at": updated + timedelta(seconds=index),
+        "version": 1,
+    } for index in range(1, count + 1)]
+
+
+PAYLOADS = {
+    "appointments": (schemas.AppointmentResponseData, appointment_rows),
+    "schedules": (schemas.DoctorScheduleResponseData, schedule_rows),
+}
+
+FORMATS = {
+    "application/json": (JSONResponse, json.loads),
+    negotiation.MSGPACK: (negotiation.MsgPackResponse, msgpack.unpackb),
+    negotiation.COLUMNAR_MSGPACK: (negotiation.ColumnarMsgPackResponse, msgpack.unpackb),
+    negotiation.COLUMNAR_JSON: (negotiation.ColumnarJSONResponse, json.loads),
+}
+
+
+def best_ms(repeat, call):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(min(timings), 3)
+
+
+def run_payload(name, rows, repeat, rng):
+    schema, generate = PAYLOADS[name]
+    adapter = TypeAdapter(List[schema])
+    objects = adapter.validate_python(generate(rows, rng))
+    # The step FastAPI runs for every format before the response class encodes the result
+    content = adapter.dump_python(objects, mode="json")
+    serialize_ms = best_ms(repeat, lambda: adapter.dump_python(objects, mode="json"))
+
+    results = []
+    json_size = None
+    for media_type, (response_class, decode) in FORMATS.items():
+        body = response_class(content).body
+        json_size = json_size or len(body)
+        results.append({
+            "payload": name,
+            "rows": rows,
+            "format": media_type,
+            "bytes": len(body),
+            "gzip_bytes": len(gzip.compress(body)),
+            "size_vs_json": round(len(body) / json_size, 3),
+            "serialize_ms": serialize_ms,
+            "encode_ms": best_ms(repeat, lambda: response_class(content)),
+            "decode_ms": best_ms(repeat, lambda: decode(body)),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the negotiated response formats against JSON")
+    parser.add_argument("--rows", default="100,1000,10000", help="Comma separated numbers of rows per list response")
+    parser.add_argument("--payloads", default=",".join(PAYLOADS), help="Comma separated list payloads to encode")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed repetitions per measurement (the best is kept)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for data generation")
+    parser.add_argument("--output", default="formats_output.json", help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = []
+    for name in args.payloads.split(","):
+        for rows in [int(rows) for rows in args.rows.split(",")]:
+            print(f"Encoding {rows} {name}...")
+            for result in run_payload(name, rows, args.repeat, rng):
+                print(f"  {result['format']:<46} {result['bytes']:>10} B  gzip {result['gzip_bytes']:>9} B  "
+                      f"encode {result['encode_ms']} ms  decode {result['decode_ms']} ms")
+                results.append(result)
+
+    report = {
+        "meta": {
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import math
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import insert, text
+
+from app import models, utils
+
+# Every seeded user shares this password (hashed once, since bcrypt is deliberately slow).
+BENCHMARK_PASSWORD = "benchmark-password"
+
+SLOTS_PER_SCHEDULE = 64  # 15 minute slots from 06:00 AM
+SEEDED_SLOTS_PER_DOCTOR = 40  # Remaining slots are left free for the booking benchmark
+BASE_DATE = date(2030, 1, 1)
+BATCH_SIZE = 5000
+
+TABLES = ["users", "patients", "doctors", "clinics", "schedules", "appointments"]
+
+
+def slot_label(index: int) -> str:
+    minutes = 6 * 60 + index * 15
+    hour, minute = divmod(minutes, 60)
+    suffix = "AM" if hour < 12 else "PM"
+    return f"{(hour - 1) % 12 + 1:02d}:{minute:02d} {suffix}"
+
+
+SLOTS = [slot_label(index) for index in range(SLOTS_PER_SCHEDULE)]
+
+
+# Row counts derived from the number of appointments in a data set.
+class SeedPlan:
+    def __init__(self, appointments: int):
+        self.appointments = appointments
+        self.doctors = max(10, math.ceil(appointments / SEEDED_SLOTS_PER_DOCTOR))
+        self.clinics = max(5, self.doctors // 10)
+        self.users = max(10, appointments // 10)
+        self.patients = self.users
+
+    # Each doctor has a single schedule on its own date, so (date, time) pairs never collide across doctors.
+    def schedule_date(self, doctor_id: int) -> str:
+        return (BASE_DATE + timedelta(days=doctor_id)).isoformat()
+
+    def clinic_for(self, doctor_id: int) -> int:
+        return (doctor_id - 1) % self.clinics + 1
+
+    def free_slots(self):
+        # (doctor_id, clinic_id, date, time) tuples that are not booked by the seed
+        for slot_index in range(SEEDED_SLOTS_PER_DOCTOR, SLOTS_PER_SCHEDULE):
+            for doctor_id in range(1, self.doctors + 1):
+                yield doctor_id, self.clinic_for(doctor_id), self.schedule_date(doctor_id), SLOTS[slot_index]
+
+
+def _insert_batches(db, model, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            db.execute(insert(model), batch)
+            batch = []
+    if batch:
+        db.execute(insert(model), batch)
+
+
+def reset(db):
+    db.execute(text(f"TRUNCATE {', '.join(TABLES)}, utilization_daily, utilization_deltas RESTART IDENTITY CASCADE"))
+    db.commit()
+
+
+# Seed a data set with `plan.appointments` booked appointments. User 1 is an admin.
+def seed(db, plan: SeedPlan, rng: random.Random):
+    reset(db)
+    password_hash = utils.get_password_hash(BENCHMARK_PASSWORD)
+
+    _insert_batches(db, models.User, (
+        {"id": user_id, "username": f"user{user_id}", "email": f"user{user_id}@bench.local",
+         "password": password_hash, "role": "admin" if user_id == 1 else "patient"}
+        for user_id in range(1, plan.users + 1)
+    ))
+    _insert_batches(db, models.Patient, (
+        {"id": patient_id, "name": f"Patient {patient_id}", "dob": "1990-01-01",
+         "gender": rng.choice(["female", "male"]), "phone": f"+1555{patient_id:07d}", "user_id": patient_id}
+        for patient_id in range(1, plan.patients + 1)
+    ))
+    _insert_batches(db, models.Doctor, (
+        {"id": doctor_id, "name": f"Doctor {doctor_id}", "specialty": rng.choice(["Cardiology", "Dermatology", "Pediatrics", "General Practice"])}
+        for doctor_id in range(1, plan.doctors + 1)
+    ))
+    _insert_batches(db, models.Clinic, (
+        {"id": clinic_id, "name": f"Clinic {clinic_id}", "address": f"{clinic_id} Main Street", "phone": f"+1444{clinic_id:07d}"}
+        for clinic_id in range(1, plan.clinics + 1)
+    ))
+    _insert_batches(db, models.DoctorSchedule, (
+        {"schedule_id": doctor_id, "doctor_id": doctor_id, "clinic_id": plan.clinic_for(doctor_id),
+         "doctor_fkey": doctor_id, "clinic_fkey": plan.clinic_for(doctor_id),
+         "date": plan.schedule_date(doctor_id), "slots": SLOTS}
+        for doctor_id in range(1, plan.doctors + 1)
+    ))
+
+    def appointment_rows():
+        for index in range(plan.appointments):
+            doctor_id = index % plan.doctors + 1
+            slot_index = index // plan.doctors
+            patient_id = rng.randint(1, plan.patients)
+            clinic_id = plan.clinic_for(doctor_id)
+            yield {"patient_id": patient_id, "doctor_id": doctor_id, "clinic_id": clinic_id,
+                   "user_fkey": patient_id, "patient_fkey": patient_id, "doctor_fkey": doctor_id, "clinic_fkey": clinic_id,
+                   "appointment_date": plan.schedule_date(doctor_id), "appointment_time": SLOTS[slot_index],
+                   "appointment_status": "booked"}
+
+    _insert_batches(db, models.Appointment, appointment_rows())
+
+    # Explicit ids were inserted, so move the sequences past them
+    for table, column in [("users", "id"), ("patients", "id"), ("doctors", "id"), ("clinics", "id"), ("schedules", "schedule_id")]:
+        db.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), (SELECT max({column}) FROM {table}))"))
+
+    db.commit()
+    db.execute(text("ANALYZE"))
+    db.commit()